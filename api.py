@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 
+import os
 import json
-from flask import Flask, request, jsonify, abort
+import hashlib
+import argparse
+import functools
+import itertools
+import threading
+from flask import Flask, Response, request, jsonify, abort, send_file
 from flask_restful import Api
 from subprocess import check_output
 
-# From current directory (lcd_functions.py and buzzer_functions.py)
-from lcd_functions import LCD
-from buzzer_functions import Buzzer
+from storage import open_storage
+from route_index import RouteIndex
+from track_cache import TrackCache, FORMATS
+from exporter import iter_export
+from spatial import SpatialIndex, parse_bbox, parse_point
+from response_cache import ResponseCache, files_version
+from live_feed import Hub, LIVE_FEED_PATH
 
 
 app = Flask(__name__)
@@ -15,36 +25,200 @@ api = Api(app)
 
 # TODO: logging
 
-routes_file = '/home/pi/trackman/GPS-Tracker/logs/gps_logs/routes.log'
-HOST_IP = check_output(['hostname', '--all-ip-addresses']).decode('ascii').strip()
+GPS_LOGS_DIR = '/home/pi/trackman/GPS-Tracker/logs/gps_logs/'
+STORAGE = 'files'  # or 'sqlite' (see storage.py)
 PORT = '5000'
+SERVER_THREADS = 8  # request worker threads of the production server
+RESPONSE_CACHE_BYTES = 8 << 20  # memory bound of the cached /routes and /stats responses
+RESPONSE_CACHE_ENTRY_BYTES = 1 << 20  # larger responses are streamed, not cached
+LIVE_FEED = LIVE_FEED_PATH  # ring file of the tracker (see live_feed.py)
+LIVE_SUBSCRIBERS = 16  # /live clients served at once, each holding a request thread added to the pool
+LIVE_KEEPALIVE = 15  # seconds between the keep-alive comments of an idle /live stream
+
+
+def init_storage(gps_logs_dir=GPS_LOGS_DIR, backend=STORAGE):
+    """Open the storage of the routes. Nothing is read until the first request."""
+    global storage, routes, track_cache, spatial_index, data_files, response_cache
+    storage = open_storage(backend, gps_logs_dir)
+    # routes.log is indexed in memory (the database has its own indexes)
+    routes = RouteIndex(storage.routes_log) if backend == 'files' else storage
+    track_cache = TrackCache(storage, os.path.join(gps_logs_dir, 'cache'))
+    spatial_index = SpatialIndex(gps_logs_dir, storage)
+    # files whose version (inode, size, mtime) is the version of the routes
+    data_files = [storage.routes_log] if backend == 'files' else [storage.path, storage.path + '-wal']
+    data_files.append(spatial_index.path)
+    response_cache = ResponseCache(RESPONSE_CACHE_BYTES, RESPONSE_CACHE_ENTRY_BYTES)
+
+
+init_storage()
+
+
+NDJSON = 'application/x-ndjson'
+CHUNK_ROUTES = 256  # routes per chunk of a streamed response
+
+
+def stream_json_array(lines):
+    """Stream the JSON routes lines as a JSON array, CHUNK_ROUTES per chunk."""
+    chunk, separator = ['['], ''
+    for line in lines:
+        chunk.append(separator + line.rstrip('\n'))
+        separator = ','
+        if len(chunk) >= CHUNK_ROUTES:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']\n')
+    yield ''.join(chunk)
+
+
+def stream_ndjson(lines):
+    """Stream the JSON routes lines as they are, CHUNK_ROUTES per chunk."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= CHUNK_ROUTES:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+def stream_routes(lines):
+    """Return a streamed response of the routes (a JSON array, or NDJSON if
+    the client prefers it). The routes.log lines are passed through as they are."""
+    if request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON:
+        return Response(stream_ndjson(lines), mimetype=NDJSON)
+    return Response(stream_json_array(lines), mimetype='application/json')
+
+
+def peek(lines):
+    """Return the first line and all the lines (reading the first line raises
+    FileNotFoundError before the response starts if no route was logged)."""
+    first_line = next(lines, None)
+    return first_line, itertools.chain([first_line] if first_line is not None else [], lines)
+
+
+def cached(view):
+    """Cache the responses of a view of the routes by request and version
+    of the routes (see response_cache.py). The responses have an ETag, so a
+    conditional request (If-None-Match) of a client whose copy is up to date
+    is answered 304 Not Modified from a stat of the data files. The
+    Last-Modified date is only informative: If-Modified-Since is ignored as
+    its 1 second resolution misses the routes logged in the same second."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            version, last_modified = files_version(data_files)
+        except FileNotFoundError:
+            return view(*args, **kwargs)
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               request.headers.get('Accept', ''))
+        etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response_cache.count_not_modified()
+            response = Response(status=304)
+        else:
+            entry = response_cache.get(key, version)
+            if entry is not None:
+                body, headers = entry
+                response = Response(body, headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    response = response_cache.store(key, version, response)
+                response.headers['X-Cache'] = 'MISS'
+        response.set_etag(etag)
+        response.last_modified = int(last_modified)
+        response.headers['Vary'] = 'Accept'
+        return response
+    return wrapper
+
+
+# Range parameters of /routes: parameter -> (route field, bound)
+RANGE_PARAMS = {'start_from': ('timestamp_start', 0), 'start_to': ('timestamp_start', 1),
+                'stop_from': ('timestamp_stop', 0), 'stop_to': ('timestamp_stop', 1),
+                'min_distance': ('distance', 0), 'max_distance': ('distance', 1)}
+PAGE_PARAMS = ('sort', 'order', 'since_route_id', 'limit')
+SPATIAL_PARAMS = ('bbox', 'near', 'radius')
+DEFAULT_RADIUS = 100  # meters
+
+
+def parse_routes_query(params_dict):
+    """Split the /routes parameters into equality filters, (low, high) ranges
+    and the sorting/pagination arguments of iter_lines. Raise ValueError
+    for invalid values."""
+    params, ranges, page = {}, {}, {}
+    for key, value in params_dict.items():
+        if key in RANGE_PARAMS:
+            field, bound = RANGE_PARAMS[key]
+            if field.startswith('timestamp') and bound and len(value) == 10:
+                value += 'T23:59:59Z'  # a date includes the whole day
+            low_high = list(ranges.get(field, (None, None)))
+            low_high[bound] = value
+            ranges[field] = tuple(low_high)
+        elif key not in PAGE_PARAMS + SPATIAL_PARAMS:
+            params[key] = value
+    if 'distance' in ranges:
+        ranges['distance'] = tuple(None if bound is None else float(bound) for bound in ranges['distance'])
+    page['sort'] = params_dict.get('sort', 'route_id')
+    if params_dict.get('order', 'asc') not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    page['descending'] = params_dict.get('order') == 'desc'
+    if 'since_route_id' in params_dict:
+        page['since_route_id'] = int(params_dict['since_route_id'])
+    if 'limit' in params_dict:
+        page['limit'] = int(params_dict['limit'])
+        if page['limit'] < 1:
+            raise ValueError('limit must be positive')
+    return params, ranges, page
+
+
+def spatial_query(params_dict):
+    """Return the IDs of the routes that passed through the bbox
+    (min_lon,min_lat,max_lon,max_lat) or within radius meters of a point
+    (near=lat,lon) of the /routes parameters (None if there is no area).
+    Raise ValueError for invalid values."""
+    route_ids = None
+    if 'bbox' in params_dict:
+        route_ids = spatial_index.within_bbox(parse_bbox(params_dict['bbox']))
+    if 'near' in params_dict:
+        radius = float(params_dict.get('radius', DEFAULT_RADIUS))
+        if radius <= 0:
+            raise ValueError('radius must be positive')
+        near_ids = spatial_index.near(*parse_point(params_dict['near']), radius)
+        route_ids = near_ids if route_ids is None else route_ids & near_ids
+    return route_ids
 
 
 def get_all_routes_data():
-    results = []
-    with open(routes_file) as rf:
-        for line in rf:
-            results.append(json.loads(line))
-    return jsonify(results)
+    _, lines = peek(routes.iter_lines())
+    return stream_routes(lines)
 
 
 def get_routes_data_by_param(params_dict):
-    results = []
-    key, value = params_dict.popitem()
-    with open(routes_file) as rf:
-        for line in rf:
-            if str(json.loads(line)[key]) == str(value):
-                results.append(json.loads(line))
-    if not results:
+    """Routes matching the filters, sorted and paginated. A full page sorted by
+    route_id has the cursor of the next page in the X-Next-Since-Route-Id header.
+    Only a query with equality filters alone answers 404 if nothing matches."""
+    try:
+        params, ranges, page = parse_routes_query(params_dict)
+        route_ids = spatial_query(params_dict)
+        first_line, lines = peek(routes.iter_lines(params, ranges, route_ids=route_ids, **page))
+    except ValueError as error:
+        abort(400, str(error))
+    if first_line is None and not (ranges or route_ids is not None or page.keys() - {'sort', 'descending'}):
         abort(404)
-    return jsonify(results)
+    if 'limit' not in page:
+        return stream_routes(lines)
+    lines = list(lines)
+    response = stream_routes(lines)
+    if len(lines) == page['limit'] and page['sort'] == 'route_id' and not page['descending']:
+        response.headers['X-Next-Since-Route-Id'] = str(json.loads(lines[-1])['route_id'])
+    return response
 
 
 @app.route('/routes', methods=['GET'])
+@cached
 def get_routes():
     params_dict = request.args.to_dict()
-    if len(params_dict) > 1:
-        raise TypeError('Too many parameters')
     try:
         if params_dict == {}:
             data = get_all_routes_data()
@@ -56,7 +230,143 @@ def get_routes():
         return data
 
 
-if __name__ == '__main__':
+@app.route('/routes/<int:route_id>/track', methods=['GET'])
+def get_route_track(route_id):
+    """The points of a route as CSV (default), GeoJSON or an encoded polyline
+    (?format=csv|geojson|polyline), simplified for a map zoom level (?zoom=)
+    or with a tolerance in meters (?tolerance=), gzip compressed for the
+    clients that accept it. The responses have strong ETags and support
+    Range requests."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400, f'format must be one of: {", ".join(FORMATS)}')
+    compressed = 'gzip' in request.accept_encodings
+    try:
+        tolerance = float(request.args['tolerance']) if 'tolerance' in request.args else None
+        zoom = int(request.args['zoom']) if 'zoom' in request.args else None
+        path = track_cache.get(route_id, fmt, compressed, tolerance, zoom)
+    except ValueError as error:
+        abort(400, str(error))
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=FORMATS[fmt][1], conditional=True)
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/stats', methods=['GET'])
+@cached
+def get_stats():
+    """Route count, distance and duration totals grouped by user, day, week
+    or month (?group_by=, default user), for all the users or for one user
+    (?user_id=), computed from the rollups of the routes."""
+    try:
+        return jsonify(routes.stats(request.args.get('group_by', 'user'), request.args.get('user_id')))
+    except ValueError as error:
+        abort(400, str(error))
+    except FileNotFoundError:
+        abort(404)
+
+
+@app.route('/cache', methods=['GET'])
+def get_cache_stats():
+    """Size and hit/miss/304/eviction counters of the response cache, to tune
+    RESPONSE_CACHE_BYTES."""
+    return jsonify(response_cache.stats())
+
+
+live_hub = None
+
+
+def init_live_feed(path=LIVE_FEED, subscribers=LIVE_SUBSCRIBERS):
+    """Follow the live feed ring of the tracker, in one thread (started by
+    the first /live request) for at most subscribers /live clients at once."""
+    global live_hub, live_subscribers
+    if live_hub is not None:
+        live_hub.close()
+    live_hub = Hub(path)
+    live_subscribers = threading.BoundedSemaphore(subscribers)
+
+
+init_live_feed()
+
+
+def stream_live(after):
+    """Stream the fixes of the live feed as Server-Sent Events (the event ID
+    is the sequence number of the fix). The request thread waits for the
+    fixes of the hub (it does not poll the ring). A comment is sent when the
+    tracker is idle, so a disconnected client releases its thread."""
+    yield 'retry: 2000\n\n'
+    for fix in live_hub.subscribe(after, timeout=LIVE_KEEPALIVE):
+        if fix is None:
+            yield ': keep-alive\n\n'
+        else:
+            yield f'id: {fix["sequence"]}\nevent: fix\ndata: {json.dumps(fix)}\n\n'
+
+
+@app.route('/live', methods=['GET'])
+def get_live():
+    """Server-Sent Events stream of the fixes of the route being logged,
+    from the last fix (or after the Last-Event-ID of a reconnecting client).
+    At most LIVE_SUBSCRIBERS clients (--live-subscribers) are served at once
+    (503 otherwise)."""
+    try:
+        after = int(request.headers['Last-Event-ID']) if 'Last-Event-ID' in request.headers else None
+    except ValueError:
+        abort(400)
+    if not live_subscribers.acquire(blocking=False):
+        abort(503)
+    response = Response(stream_live(after), mimetype='text/event-stream')
+    response.call_on_close(live_subscribers.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+EXPORT_BATCH = 1000  # maximum number of routes per export
+EXPORT_WORKERS = 4  # maximum number of compression threads (one per core)
+
+
+@app.route('/export', methods=['GET'])
+def export_routes():
+    """Tar stream of the routes after the since_route_id cursor (at most
+    ?limit=EXPORT_BATCH routes) with their tracks, see exporter.py. The
+    tracks can be gzip compressed (?compression=gzip), in parallel with
+    ?workers=N. The cursor of the next export is returned in the
+    X-Next-Since-Route-Id header, 204 No Content means there is nothing new."""
+    try:
+        since_route_id = int(request.args.get('since_route_id', 0))
+        limit = min(int(request.args.get('limit', EXPORT_BATCH)), EXPORT_BATCH)
+        workers = max(1, min(int(request.args.get('workers', 1)), EXPORT_WORKERS))
+    except ValueError:
+        abort(400)
+    compression = request.args.get('compression')
+    if compression not in (None, 'gzip'):
+        abort(400, 'compression must be gzip')
+    try:
+        lines = list(routes.iter_lines(since_route_id=since_route_id, limit=limit))
+    except FileNotFoundError:
+        lines = []
+    if not lines:
+        return Response(status=204, headers={'X-Next-Since-Route-Id': str(since_route_id)})
+    first_route_id, last_route_id = json.loads(lines[0])['route_id'], json.loads(lines[-1])['route_id']
+    response = Response(iter_export(storage, lines, compression, workers), mimetype='application/x-tar')
+    response.headers['X-Next-Since-Route-Id'] = str(last_route_id)
+    response.headers['Content-Disposition'] = f'attachment; filename=routes_{first_route_id}-{last_route_id}.tar'
+    return response
+
+
+def get_host_ip():
+    return check_output(['hostname', '--all-ip-addresses']).decode('ascii').strip()
+
+
+def show_connection_info(host, port):
+    """Beep and display the API address on the LCD."""
+    # From current directory (lcd_functions.py and buzzer_functions.py)
+    from lcd_functions import LCD
+    from buzzer_functions import Buzzer
 
     lcd = LCD()
     buzzer = Buzzer()
@@ -64,7 +374,42 @@ if __name__ == '__main__':
     buzzer.beep()
 
     # Display Connection Info
-    lcd.display('API - PORT:{} '.format(PORT), 1)
-    lcd.display(HOST_IP, 2)
+    lcd.display('API - PORT:{} '.format(port), 1)
+    lcd.display(host, 2)
+
+
+def serve(host, port, threads=SERVER_THREADS, live_threads=LIVE_SUBSCRIBERS):
+    """Serve the API with waitress, a production WSGI server: the requests
+    are handled by a pool of threads while the sockets (and the files sent
+    with send_file) are written by its I/O loop, so slow clients do not
+    hold the request threads. A /live stream holds its thread for the
+    whole connection, so live_threads threads are added to the pool for
+    them. Without waitress the threaded development server of Flask is used."""
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        app.run(host=host, port=port, threaded=True)
+    else:
+        waitress_serve(app, host=host, port=port, threads=threads + live_threads)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='GPS Tracker REST API.')
+    parser.add_argument('--logs-dir', default=GPS_LOGS_DIR, help='GPS logs folder (containing routes.log)')
+    parser.add_argument('--storage', default=STORAGE, choices=['files', 'sqlite'])
+    parser.add_argument('--host', default=None, help='default: the IP addresses of the Raspberry Pi')
+    parser.add_argument('--port', default=PORT)
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    parser.add_argument('--live-feed', default=LIVE_FEED, help='live feed ring file of the tracker')
+    parser.add_argument('--live-subscribers', type=int, default=LIVE_SUBSCRIBERS,
+                        help='maximum number of /live clients (each one with its own request thread)')
+    parser.add_argument('--no-lcd', action='store_true', help='do not display the API address')
+    args = parser.parse_args()
 
-    app.run(host=HOST_IP, port=PORT)
+    init_storage(args.logs_dir, args.storage)
+    init_live_feed(args.live_feed, args.live_subscribers)
+    host = args.host or get_host_ip()
+    if not args.no_lcd:
+        threading.Thread(target=show_connection_info, args=(host, args.port), daemon=True).start()
+    serve(host, args.port, args.threads, args.live_subscribers)
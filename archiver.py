@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Archive rotation of the finished route tracks.
+
+The tracks of the routes logged in routes.log and stopped more than
+keep_days ago are moved from the routes folder to zip archives of up to
+batch_size routes of the same month (archive/routes_YYYY-MM_<route_id>.zip,
+by the start of the routes, with the ID of the first route) and indexed
+in archive/manifest.log, one JSON entry per line:
+
+    {"route_id": 1, "user_id": 142189814135, "archive": "routes_2020-02_1.zip",
+     "member": "route_1_142189814135.csv", "offset": 0, "size": 7421,
+     "compressed_size": 2515, "points": 148}
+
+Routes are archived in routes.log order, so each run resumes after the
+last route of the manifest. An archive is written once (to a temporary
+file renamed once synced), so archiving a batch writes only its own
+tracks, and a track is removed from the routes folder only after it was
+committed to its archive and to the manifest. The archived tracks are read through
+Archive.iter_points, directly at the offset recorded in the manifest
+(storage.FileStorage falls back to it for the routes that are no longer
+in the routes folder).
+
+Usage (runs in the idle I/O scheduling class):
+    python3 archiver.py [--logs-dir DIR] [--keep-days 7] [--interval SECONDS]
+"""
+
+import os
+import sys
+import zlib
+import json
+import time
+import struct
+import zipfile
+import argparse
+import subprocess
+
+import tracks
+
+
+GPS_LOGS_DIR = '/home/pi/trackman/GPS-Tracker/logs/gps_logs/'
+
+# Zip local file header (see the .ZIP File Format Specification, 4.3.7)
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+class Archive:
+    """Monthly zip archives of the route tracks and their manifest."""
+
+    def __init__(self, gps_logs_dir):
+        self.gps_logs_dir = gps_logs_dir
+        self.routes_log = os.path.join(gps_logs_dir, 'routes.log')
+        self.routes_dir = os.path.join(gps_logs_dir, 'routes')
+        self.archive_dir = os.path.join(gps_logs_dir, 'archive')
+        self.manifest = os.path.join(self.archive_dir, 'manifest.log')
+        self.index = {}
+        self.index_offset = 0
+        # routes.log position where the next run resumes (and the inode it belongs to)
+        self.log_inode, self.log_offset = None, 0
+
+    def __repr__(self):
+        return f'Archive in {self.archive_dir} ({len(self.index)} routes indexed).'
+
+    def _refresh_index(self):
+        """Index the manifest entries appended since the last lookup."""
+        try:
+            size = os.path.getsize(self.manifest)
+        except FileNotFoundError:
+            size = 0
+        if size < self.index_offset:
+            self.index, self.index_offset = {}, 0
+        if size == self.index_offset:
+            return
+        with open(self.manifest, 'rb') as manifest:
+            manifest.seek(self.index_offset)
+            for line in manifest:
+                if not line.endswith(b'\n'):
+                    break  # entry being written
+                entry = json.loads(line)
+                self.index[entry['route_id']] = entry
+                self.index_offset += len(line)
+
+    def lookup(self, route_id):
+        """Return the manifest entry of an archived route (None if it is not archived)."""
+        self._refresh_index()
+        return self.index.get(route_id)
+
+    def entries(self):
+        """Return the manifest entries of all the archived routes, sorted by route ID."""
+        self._refresh_index()
+        return [self.index[route_id] for route_id in sorted(self.index)]
+
+    def member_path(self, entry):
+        """Return the path of an archived track inside its archive
+        (archive/routes_YYYY-MM_<route_id>.zip/<member>)."""
+        return os.path.join(self.archive_dir, entry['archive'], entry['member'])
+
+    def read_member(self, entry):
+        """Return the track of a manifest entry, read at the offset of its
+        local header (the central directory of the archive is not parsed)."""
+        with open(os.path.join(self.archive_dir, entry['archive']), 'rb') as archive:
+            archive.seek(entry['offset'])
+            (signature, _, _, flags, method, _, _, crc, _, _,
+             name_size, extra_size) = LOCAL_HEADER.unpack(archive.read(LOCAL_HEADER.size))
+            name = archive.read(name_size)
+            if signature != LOCAL_HEADER_SIGNATURE or name.decode() != entry['member']:
+                raise zipfile.BadZipFile(f'{entry["archive"]}: no {entry["member"]} at offset {entry["offset"]}.')
+            archive.seek(extra_size, os.SEEK_CUR)
+            data = archive.read(entry['compressed_size'])
+        if method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif method != zipfile.ZIP_STORED:
+            raise zipfile.BadZipFile(f'{entry["archive"]}: unsupported compression of {entry["member"]}.')
+        # The CRC is in a data descriptor (after the data) if flag bit 3 is set
+        if not flags & 0x08 and zlib.crc32(data) != crc:
+            raise zipfile.BadZipFile(f'{entry["archive"]}: bad CRC of {entry["member"]}.')
+        return data
+
+    def iter_points(self, route_id):
+        """Yield the (timestamp, lat, lon, total_distance) points of an archived route."""
+        entry = self.lookup(route_id)
+        if entry is None:
+            return
+        yield from tracks.iter_rows_from_bytes(self.read_member(entry), entry['member'])
+
+    def _last_archived_route(self):
+        """Return the last manifest entry, after dropping an entry cut
+        by a power loss and finishing the removal of its track."""
+        try:
+            last_line, end = tracks.read_last_line(self.manifest)
+        except FileNotFoundError:
+            return None
+        if end != os.path.getsize(self.manifest):
+            with open(self.manifest, 'r+b') as manifest:
+                manifest.truncate(end)
+        if last_line is None:
+            return None
+        entry = json.loads(last_line)
+        try:
+            os.remove(os.path.join(self.routes_dir, entry['member']))
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def _find_track(self, route):
+        for extension in ('csv', 'trk'):
+            path = os.path.join(self.routes_dir, f'route_{route["route_id"]}_{route["user_id"]}.{extension}')
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _write_archive(self, name, paths):
+        """Write the tracks to a new archive and return their ZipInfo.
+
+        The archive is written to a temporary file that is renamed only
+        once synced, so a crash never leaves a broken archive (an archive
+        left by a run that stopped before updating the manifest has the
+        same name, the name of its first route, and is replaced)."""
+        archive_path = os.path.join(self.archive_dir, name)
+        tmp_path = archive_path + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for path in paths:
+                archive.write(path, os.path.basename(path))
+            infos = archive.infolist()
+        with open(tmp_path, 'rb') as archive:
+            os.fsync(archive)
+        os.replace(tmp_path, archive_path)
+        fsync_dir(self.archive_dir)
+        return infos
+
+    def archive_routes(self, routes, pause=0.0):
+        """Move the tracks of (route, path) pairs of the same month to a
+        new archive and index them in the manifest, in order. A track is
+        removed only after its archive and its manifest entry are on the
+        disk. Return the manifest entries."""
+        first_route = routes[0][0]
+        name = f'routes_{first_route["timestamp_start"][:7]}_{first_route["route_id"]}.zip'
+        points = [sum(1 for _ in tracks.iter_rows(path)) for _, path in routes]
+        infos = self._write_archive(name, [path for _, path in routes])
+        entries = []
+        for (route, path), info, count in zip(routes, infos, points):
+            entry = {'route_id': route['route_id'],
+                     'user_id': route['user_id'],
+                     'archive': name,
+                     'member': info.filename,
+                     'offset': info.header_offset,
+                     'size': info.file_size,
+                     'compressed_size': info.compress_size,
+                     'points': count}
+            with open(self.manifest, 'a') as manifest:
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+                os.fsync(manifest)
+            os.remove(path)
+            entries.append(entry)
+            time.sleep(pause)
+        return entries
+
+    def archive_route(self, route, path):
+        """Move a route track to a new archive and index it in the manifest."""
+        return self.archive_routes([(route, path)])[0]
+
+    def run(self, keep_days=7, pause=0.0, now=None, batch_size=100):
+        """Archive the finished routes stopped more than keep_days ago,
+        up to batch_size routes per archive, pausing between routes.
+        Return the number of archived routes.
+
+        routes.log is read from where the previous run stopped (from the
+        start again if it was replaced or truncated). Its corrupted lines
+        are skipped."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        deadline = (now or time.time()) - keep_days * 86400
+        last_entry = self._last_archived_route()
+        last_route_id = last_entry['route_id'] if last_entry else 0
+        count = 0
+        try:
+            routes_log = open(self.routes_log, 'rb')
+        except FileNotFoundError:
+            return 0
+        with routes_log:
+            stat = os.fstat(routes_log.fileno())
+            if stat.st_ino != self.log_inode or stat.st_size < self.log_offset:
+                self.log_inode, self.log_offset = stat.st_ino, 0
+            routes_log.seek(self.log_offset)
+            offset, batch = self.log_offset, []
+            for line in routes_log:
+                if not line.endswith(b'\n'):
+                    break
+                route, stop = _logged_route(line)
+                if route is not None and route['route_id'] > last_route_id:
+                    if stop > deadline:
+                        break  # keep the order of routes.log in the manifest
+                    path = self._find_track(route)
+                    if path is not None:
+                        if batch and (len(batch) >= batch_size
+                                      or batch[0][0]['timestamp_start'][:7] != route['timestamp_start'][:7]):
+                            count += len(self.archive_routes(batch, pause))
+                            self.log_offset, batch = offset, []
+                        batch.append((route, path))
+                offset += len(line)
+            if batch:
+                count += len(self.archive_routes(batch, pause))
+            self.log_offset = offset
+        return count
+
+
+def _logged_route(line):
+    """Return the route of a routes.log line and its stop time (epoch),
+    (None, None) for a corrupted line or a route without timestamps."""
+    try:
+        route = json.loads(line)
+        start = tracks.to_epoch(route['timestamp_start'])
+        stop = tracks.to_epoch(route['timestamp_stop']) if route.get('timestamp_stop') else start
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None, None
+    if not isinstance(route.get('route_id'), int):
+        return None, None
+    return route, stop
+
+
+def fsync_dir(path):
+    """Commit the entries of a folder (eg. a file replaced in it) to the disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def lower_io_priority():
+    """Move the current process to the idle I/O scheduling class
+    (and to the lowest CPU priority)."""
+    os.nice(19)
+    try:
+        subprocess.call(['ionice', '-c', '3', '-p', str(os.getpid())])
+    except FileNotFoundError:
+        print('ionice not found, running with the default I/O priority.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive the finished route tracks.')
+    parser.add_argument('--logs-dir', default=GPS_LOGS_DIR, help='GPS logs folder (containing routes.log)')
+    parser.add_argument('--keep-days', type=float, default=7,
+                        help='keep the routes stopped in the last days in the routes folder')
+    parser.add_argument('--pause', type=float, default=0.1, help='pause between routes (in seconds)')
+    parser.add_argument('--interval', type=float, default=None,
+                        help='run again every INTERVAL seconds instead of exiting')
+    args = parser.parse_args(argv)
+
+    lower_io_priority()
+    archive = Archive(args.logs_dir)
+    while True:
+        count = archive.run(args.keep_days, args.pause)
+        print(f'{count} routes archived.')
+        if args.interval is None:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Microbenchmark of the NMEA parser against the original
+string based GPS.extract_parameters implementation (which
+does not validate the checksum).
+
+Usage: python3 benchmarks/bench_nmea.py [number_of_sentences]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nmea
+
+
+RMC = b'$GPRMC,135914.00,A,4425.47492,N,02603.22266,E,0.412,,060220,,,A*74\r\n'
+
+
+def extract_parameters(data):
+    """Original GPS.extract_parameters (without the UI side effects)."""
+    data = str(data).split(',')
+    lat = round(float(data[3][:2]) + float(data[3][2:]) / 60, 6)
+    lon = round(float(data[5][:3]) + float(data[5][3:]) / 60, 6)
+    _date = data[9][4:6] + '-' + data[9][2:4] + '-' + data[9][:2]
+    _time = data[1][:2] + ':' + data[1][2:4] + ':' + data[1][4:6]
+    timestamp = '20' + _date + 'T' + _time + 'Z'
+    return timestamp, lat, lon
+
+
+def main(number=100000):
+    assert extract_parameters(RMC) == nmea.parse_rmc(RMC)[:3]
+    body = memoryview(RMC)[1:RMC.rfind(b'*')]
+    for name, func in [('extract_parameters (str)', extract_parameters),
+                       ('nmea.checksum (only)', lambda _: nmea.checksum(body)),
+                       ('nmea.parse_rmc (bytes, checksum)', nmea.parse_rmc),
+                       ('nmea.parse_rmc (memoryview)', lambda line: nmea.parse_rmc(memoryview(line))),
+                       ('nmea.parse (dispatch)', nmea.parse),
+                       ]:
+        best = min(timeit.repeat(lambda: func(RMC), number=number, repeat=5))
+        print(f'{name:<36} {best / number * 1e6:7.2f} us/sentence')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
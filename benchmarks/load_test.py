@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Load test of the REST API: N concurrent clients send requests to the
+API and the throughput and the latency percentiles are reported.
+
+Generate a large synthetic GPS logs folder, serve it and load it:
+    python3 benchmarks/load_test.py generate /tmp/gps_logs --routes 200000
+    python3 api.py --logs-dir /tmp/gps_logs --host 127.0.0.1 --no-lcd &
+    python3 benchmarks/load_test.py run http://127.0.0.1:5000/routes?user_id=780870559455&limit=100 \\
+        --clients 8 --requests 2000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+USER_IDS = [780870559455, 142189814135, 123412341234, 836205736274]
+
+
+def generate(gps_logs_dir, number_of_routes, points=50, seed=0):
+    """Write a routes.log of synthetic routes (one route every 10 minutes)
+    and the CSV tracks of the first routes."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(gps_logs_dir, 'routes'), exist_ok=True)
+    start = 1577836800  # 2020-01-01
+    with open(os.path.join(gps_logs_dir, 'routes.log'), 'w') as routes_log:
+        for route_id in range(1, number_of_routes + 1):
+            timestamp = start + route_id * 600
+            lat, lon = 44.4245 + rng.uniform(-0.05, 0.05), 26.0537 + rng.uniform(-0.05, 0.05)
+            route = {'route_id': route_id,
+                     'user_id': rng.choice(USER_IDS),
+                     'timestamp_start': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp)),
+                     'lat_start': round(lat, 6),
+                     'lon_start': round(lon, 6),
+                     'timestamp_stop': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp + points)),
+                     'lat_stop': round(lat + points * 1e-5, 6),
+                     'lon_stop': round(lon, 6),
+                     'distance': round(points * 1.11, 2)}
+            routes_log.write(json.dumps(route) + '\n')
+            if route_id <= 100:
+                path = os.path.join(gps_logs_dir, 'routes', f'route_{route_id}_{route["user_id"]}.csv')
+                with open(path, 'w') as track:
+                    track.write('Timestamp,Latitude,Longitude,Total_Distance\n')
+                    for i in range(points):
+                        track.write(f'{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp + i))},'
+                                    f'{round(lat + i * 1e-5, 6)},{round(lon, 6)},{round(i * 1.11, 2)}\n')
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(url, clients, number_of_requests, timeout=60):
+    """Send the requests from the concurrent clients, return the latencies (in seconds)."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def request(_):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                while response.read(65536):
+                    pass
+        except Exception as error:
+            with lock:
+                errors.append(error)
+        else:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(request, range(number_of_requests)))
+    return sorted(latencies), errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the REST API.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help='write a synthetic GPS logs folder')
+    generate_parser.add_argument('gps_logs_dir')
+    generate_parser.add_argument('--routes', type=int, default=200000)
+    run_parser = commands.add_parser('run', help='load an API URL with concurrent clients')
+    run_parser.add_argument('url')
+    run_parser.add_argument('--clients', type=int, default=8)
+    run_parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate(args.gps_logs_dir, args.routes)
+        print(f'{args.routes} routes written to {args.gps_logs_dir}')
+        return 0
+
+    urllib.request.urlopen(args.url).read()  # warm up (index of routes.log)
+    start = time.perf_counter()
+    latencies, errors = run(args.url, args.clients, args.requests)
+    elapsed = time.perf_counter() - start
+    print(f'{args.clients} clients, {len(latencies)} requests in {elapsed:.2f} s, {len(errors)} errors')
+    if errors:
+        print(f'first error: {errors[0]!r}')
+    if latencies:
+        print(f'throughput {len(latencies) / elapsed:.1f} req/s, latency '
+              f'p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+              f'p99 {percentile(latencies, 0.99) * 1000:.1f} ms, '
+              f'max {latencies[-1] * 1000:.1f} ms')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Store of the authorized RFID cards.
+
+The cards are read from a file, with any metadata columns besides the
+card ID (eg. the name of the driver and the depot):
+
+    cards.csv       --  a CSV file with a header, one card per row:
+                            card_id,name,depot
+                            780870559455,Driver 1,North
+    cards.json      --  a list of objects with a card_id key, or an object
+                        of card ID -> metadata
+    cards.db        --  a SQLite database with a cards table (card_id column)
+
+The cards are kept in memory in a dict (card ID -> metadata), so a card
+is validated in constant time whatever the number of cards. The file is
+reloaded when it changes (its inode, size or mtime, checked at most every
+check_interval seconds) without restarting the tracker; a file that can
+not be read keeps the previous cards. Replace the file atomically (write
+a temporary file and rename it), so it is never read half written.
+
+Usage:
+    python3 cards.py <cards file> [<card ID>...]  --  check the file or card IDs
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('.csv', '.json', '.db')
+
+
+class CardStoreError(ValueError):
+    """Raised for card files that can not be read."""
+
+
+def read_cards(path):
+    """Return the cards of a file as a dict of card ID -> metadata."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise NotImplementedError('Available card file formats: CSV, JSON, DB (SQLite)')
+    try:
+        if extension == '.csv':
+            with open(path, newline='') as file:
+                rows = list(csv.DictReader(file))
+        elif extension == '.json':
+            with open(path) as file:
+                data = json.load(file)
+            if isinstance(data, dict):
+                rows = [dict(metadata or {}, card_id=card_id) for card_id, metadata in data.items()]
+            else:
+                rows = data
+        else:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                db.row_factory = sqlite3.Row
+                rows = [dict(row) for row in db.execute('SELECT * FROM cards')]
+            finally:
+                db.close()
+        cards = {}
+        for row in rows:
+            if row['card_id'] in (None, ''):
+                continue  # blank line
+            metadata = {key: value for key, value in row.items() if key != 'card_id'}
+            cards[str(row['card_id']).strip()] = metadata
+        return cards
+    except (KeyError, TypeError, AttributeError, ValueError, sqlite3.Error) as error:
+        raise CardStoreError(f'{path}: {error!r}') from None
+
+
+class CardStore:
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.cards = {}
+        self.version = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'CardStore of {self.path} ({len(self.cards)} cards).'
+
+    def _file_version(self):
+        """Return the inode, size and mtime of the file (and of the WAL of a database)."""
+        version = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                version.append(None)
+            else:
+                version.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(version)
+
+    def refresh(self, force=False):
+        """Reload the cards if the file changed (checked at most every
+        check_interval seconds, unless force is True)."""
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < self.check_interval:
+            return
+        with self.lock:
+            self.checked = now
+            version = self._file_version()
+            if version == self.version:
+                return
+            try:
+                cards = read_cards(self.path)
+            except FileNotFoundError:
+                logger.error(f'Cards file {self.path} not found, no card is authorized.')
+                cards = {}
+            except CardStoreError as error:
+                logger.error(f'Cards file not reloaded: {error}')
+                return
+            self.cards, self.version = cards, version
+            logger.info(f'{len(cards)} cards loaded from {self.path}.')
+
+    def __contains__(self, card_id):
+        self.refresh()
+        return str(card_id).strip() in self.cards
+
+    def __len__(self):
+        self.refresh()
+        return len(self.cards)
+
+    def get(self, card_id):
+        """Return the metadata of an authorized card (None if it is not authorized)."""
+        self.refresh()
+        return self.cards.get(str(card_id).strip())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check a file of authorized cards.')
+    parser.add_argument('path')
+    parser.add_argument('card_ids', nargs='*')
+    args = parser.parse_args(argv)
+    cards = read_cards(args.path)
+    print(f'{len(cards)} cards in {args.path}')
+    for card_id in args.card_ids:
+        metadata = cards.get(card_id)
+        print(f'{card_id}: ' + ('not authorized' if metadata is None else f'authorized {metadata}'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,12 @@
 # Cleanup script
 
 sudo rm /home/pi/trackman/GPS-Tracker/logs/gps_logs/routes.log
+sudo rm -f /home/pi/trackman/GPS-Tracker/logs/gps_logs/routes.seq
+sudo rm -f /home/pi/trackman/GPS-Tracker/logs/gps_logs/checkpoint.json
+sudo rm -f /home/pi/trackman/GPS-Tracker/logs/gps_logs/routes.db*
+sudo rm /home/pi/trackman/GPS-Tracker/logs/gps_logs/spatial.log
 sudo rm /home/pi/trackman/GPS-Tracker/logs/gps_logs/routes/route*
+sudo rm -r /home/pi/trackman/GPS-Tracker/logs/gps_logs/archive
+sudo rm -r /home/pi/trackman/GPS-Tracker/logs/gps_logs/cache
 sudo rm /home/pi/trackman/GPS-Tracker/logs/system_logs/*
 
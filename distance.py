@@ -0,0 +1,72 @@
+"""Distance (in meters) between two GPS coordinates given as
+(lat, lon) pairs in decimal degrees.
+
+Available backends:
+    enu         --  flat local East-North plane using the WGS-84 radii of
+                    curvature at the mid latitude (default)
+    haversine   --  great circle on a sphere of mean Earth radius
+    geodesic    --  geopy's geodesic on the WGS-84 ellipsoid (reference).
+                    geopy is only imported the first time it is used.
+
+Accuracy for the short (< 100 m) segments between consecutive fixes,
+compared to the geodesic reference:
+    enu         --  relative error below 1e-8 (sub-micrometer), ~150 times faster
+    haversine   --  relative error up to 0.6% (the Earth's flattening is
+                    ignored), ~100 times faster
+The error of the enu backend grows with the cube of the distance:
+it stays below 1 cm up to ~10 km, so it is not meant for long segments.
+"""
+
+from math import radians, sin, cos, asin, sqrt, hypot
+
+
+# WGS-84 ellipsoid
+A = 6378137.0
+F = 1 / 298.257223563
+E2 = F * (2 - F)
+
+# Mean Earth radius (IUGG)
+R = 6371008.8
+
+
+def enu(point1, point2):
+    """Distance in the local East-North plane of the segment's mid point."""
+    lat1, lon1 = point1
+    lat2, lon2 = point2
+    phi = radians((lat1 + lat2) / 2)
+    sin_phi = sin(phi)
+    w = 1 - E2 * sin_phi * sin_phi
+    n = A / sqrt(w)  # prime vertical radius of curvature
+    m = n * (1 - E2) / w  # meridional radius of curvature
+    d_lon = (lon2 - lon1 + 180) % 360 - 180
+    return hypot(radians(lat2 - lat1) * m, radians(d_lon) * n * cos(phi))
+
+
+def haversine(point1, point2):
+    """Great circle distance on a sphere of mean Earth radius."""
+    lat1, lon1 = point1
+    lat2, lon2 = point2
+    phi1, phi2 = radians(lat1), radians(lat2)
+    h = (sin((phi2 - phi1) / 2) ** 2
+         + cos(phi1) * cos(phi2) * sin(radians(lon2 - lon1) / 2) ** 2)
+    return 2 * R * asin(sqrt(min(1.0, h)))
+
+
+def geodesic(point1, point2):
+    """Geodesic distance on the WGS-84 ellipsoid (geopy, Karney's algorithm)."""
+    from geopy.distance import geodesic as _geodesic
+    return _geodesic(point1, point2).m
+
+
+BACKENDS = {'enu':       enu,
+            'haversine': haversine,
+            'geodesic':  geodesic,
+            }
+
+
+def get_backend(name='enu'):
+    """Return the distance function of the specified backend."""
+    try:
+        return BACKENDS[name.lower()]
+    except KeyError:
+        raise NotImplementedError(f'Available distance backends: {", ".join(BACKENDS)}')
@@ -0,0 +1,85 @@
+"""Incremental bulk export of the routes for the offline data dump.
+
+An export is a tar stream built on the fly (without temporary files):
+
+    routes.ndjson                       --  the exported routes.log lines
+    routes/route_<id>_<user_id>.csv     --  the track of each exported route
+                                            (.csv.gz with gzip compression)
+
+The routes are exported in route ID order after a cursor (the last route
+ID of the previous export), in batches of a bounded number of routes.
+With gzip compression the tracks can be rendered and compressed by a pool
+of threads (zlib releases the GIL), with a bounded window of routes in
+flight so the memory used does not depend on the batch size.
+"""
+
+import io
+import json
+import gzip
+import time
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from track_cache import render
+
+
+class _StreamBuffer:
+    """Write-only file object whose data is drained by a generator."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def render_track(storage, route, compression=None):
+    """Return the tar member name and the data of the CSV track of a route."""
+    name = f'routes/route_{route["route_id"]}_{route["user_id"]}.csv'
+    data = render('csv', storage.iter_points(route['route_id'])).encode()
+    if compression == 'gzip':
+        return name + '.gz', gzip.compress(data, compresslevel=6, mtime=0)
+    return name, data
+
+
+def _add_member(archive, name, data, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    archive.addfile(info, io.BytesIO(data))
+
+
+def iter_export(storage, lines, compression=None, workers=1):
+    """Yield the chunks of the tar stream of the routes of the routes.log
+    lines and of their tracks (see the module docstring)."""
+    if compression not in (None, 'gzip'):
+        raise NotImplementedError('Available compressions: GZIP')
+    routes = [json.loads(line) for line in lines]
+    buffer = _StreamBuffer()
+    mtime = int(time.time())
+    with tarfile.open(fileobj=buffer, mode='w|') as archive:
+        _add_member(archive, 'routes.ndjson', ''.join(lines).encode(), mtime)
+        yield buffer.drain()
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                pending = deque()
+                for route in routes:
+                    pending.append(executor.submit(render_track, storage, route, compression))
+                    if len(pending) >= workers * 2:
+                        _add_member(archive, *pending.popleft().result(), mtime)
+                        yield buffer.drain()
+                while pending:
+                    _add_member(archive, *pending.popleft().result(), mtime)
+                    yield buffer.drain()
+        else:
+            for route in routes:
+                _add_member(archive, *render_track(storage, route, compression), mtime)
+                yield buffer.drain()
+    yield buffer.drain()
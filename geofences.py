@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Geofences (depots, customer sites) that close, split or flag the
+routes when the tracker enters or leaves them.
+
+The zones are configured in a JSON file (geofences.json in the tracker
+folder), a circle around a point or a polygon of [lat, lon] vertices,
+with the action of the tracker when it enters (on_enter) or leaves
+(on_exit) the zone:
+
+    [{"name": "Depot", "lat": 44.4245, "lon": 26.0537, "radius": 150, "on_enter": "stop"},
+     {"name": "Customer", "polygon": [[44.43, 26.05], [44.43, 26.06], [44.44, 26.055]],
+      "on_enter": "flag", "on_exit": "flag"}]
+
+    stop   --  the route is ended (as if the card was swiped)
+    split  --  the route is ended and a new route of the same user starts
+    flag   --  the event is only recorded in the route (geofence_events)
+
+The zones are indexed on a grid of CELL_SIZE degrees: each cell holds
+the zones whose bounding box overlaps it, so a fix is tested only against
+the few zones of its cell, whatever the number of zones. An event is
+confirmed after confirm_fixes consecutive fixes, so the GPS noise on the
+border of a zone does not end a route.
+
+Usage:
+    python3 geofences.py <geofences.json> <lat> <lon>  --  print the zones of a point
+"""
+
+import abc
+import sys
+import json
+import math
+import argparse
+
+from distance import haversine
+from spatial import radius_bbox
+
+
+CELL_SIZE = 0.01  # degrees
+ACTIONS = ('stop', 'split', 'flag')
+
+
+class GeofenceError(ValueError):
+    """Raised for invalid geofence configurations."""
+
+
+class Zone(abc.ABC):
+
+    def __init__(self, name, on_enter=None, on_exit=None):
+        for action in (on_enter, on_exit):
+            if action is not None and action not in ACTIONS:
+                raise GeofenceError(f'{name}: the actions are {", ".join(ACTIONS)}.')
+        self.name = name
+        self.on_enter = on_enter
+        self.on_exit = on_exit
+        self.bbox = None  # min_lon, min_lat, max_lon, max_lat
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.name}.'
+
+    def action(self, event):
+        return self.on_enter if event == 'enter' else self.on_exit
+
+    @abc.abstractmethod
+    def contains(self, lat, lon):
+        """Return True if the point is inside the zone."""
+
+
+class CircleZone(Zone):
+
+    def __init__(self, name, lat, lon, radius, on_enter=None, on_exit=None):
+        super().__init__(name, on_enter, on_exit)
+        if radius <= 0:
+            raise GeofenceError(f'{name}: the radius must be positive.')
+        self.center = (lat, lon)
+        self.radius = radius
+        self.bbox = radius_bbox(lat, lon, radius)
+
+    def contains(self, lat, lon):
+        return haversine(self.center, (lat, lon)) <= self.radius
+
+
+class PolygonZone(Zone):
+
+    def __init__(self, name, polygon, on_enter=None, on_exit=None):
+        super().__init__(name, on_enter, on_exit)
+        if len(polygon) < 3:
+            raise GeofenceError(f'{name}: a polygon needs 3 vertices.')
+        self.polygon = [(float(lat), float(lon)) for lat, lon in polygon]
+        lats, lons = [lat for lat, _ in self.polygon], [lon for _, lon in self.polygon]
+        self.bbox = min(lons), min(lats), max(lons), max(lats)
+
+    def contains(self, lat, lon):
+        """Ray casting (even-odd rule) in the lat/lon plane."""
+        inside = False
+        lat1, lon1 = self.polygon[-1]
+        for lat2, lon2 in self.polygon:
+            if (lat1 > lat) != (lat2 > lat) and lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                inside = not inside
+            lat1, lon1 = lat2, lon2
+        return inside
+
+
+def zone_from_dict(data):
+    try:
+        actions = {'on_enter': data.get('on_enter'), 'on_exit': data.get('on_exit')}
+        if 'polygon' in data:
+            return PolygonZone(data['name'], data['polygon'], **actions)
+        return CircleZone(data['name'], float(data['lat']), float(data['lon']), float(data['radius']), **actions)
+    except GeofenceError:
+        raise
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        raise GeofenceError(f'Invalid geofence {data!r}: {error!r}') from None
+
+
+def load_geofences(path):
+    """Return the zones of a geofences file ([] if it does not exist)."""
+    try:
+        with open(path) as file:
+            return [zone_from_dict(data) for data in json.load(file)]
+    except FileNotFoundError:
+        return []
+
+
+def cell(lat, lon):
+    return math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE)
+
+
+class GeofenceIndex:
+
+    def __init__(self, zones):
+        self.zones = list(zones)
+        self.cells = {}  # cell -> zones
+        for zone in self.zones:
+            min_lon, min_lat, max_lon, max_lat = zone.bbox
+            (i0, j0), (i1, j1) = cell(min_lat, min_lon), cell(max_lat, max_lon)
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self.cells.setdefault((i, j), []).append(zone)
+
+    def __repr__(self):
+        return f'GeofenceIndex ({len(self.zones)} zones, {len(self.cells)} cells).'
+
+    def zones_at(self, lat, lon):
+        """Return the zones that contain a point."""
+        return [zone for zone in self.cells.get(cell(lat, lon), ()) if zone.contains(lat, lon)]
+
+
+class GeofenceMonitor:
+    """Enter/exit events of the fixes of a route."""
+
+    def __init__(self, index, confirm_fixes=3):
+        self.index = index
+        self.confirm_fixes = confirm_fixes
+        self.inside = set()
+        self.pending = {}  # zone -> consecutive fixes on the other side
+
+    def reset(self, lat, lon):
+        """Start a route: the zones of the first fix are not entered."""
+        self.inside = set(self.index.zones_at(lat, lon))
+        self.pending = {}
+
+    def update(self, lat, lon):
+        """Return the (zone, 'enter' or 'exit') events confirmed by a fix."""
+        current = set(self.index.zones_at(lat, lon))
+        events = []
+        for zone in (current ^ self.inside) | self.pending.keys():
+            if (zone in current) == (zone in self.inside):
+                self.pending.pop(zone, None)
+                continue
+            self.pending[zone] = self.pending.get(zone, 0) + 1
+            if self.pending[zone] >= self.confirm_fixes:
+                del self.pending[zone]
+                if zone in current:
+                    self.inside.add(zone)
+                    events.append((zone, 'enter'))
+                else:
+                    self.inside.discard(zone)
+                    events.append((zone, 'exit'))
+        return events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the geofences of a point.')
+    parser.add_argument('path')
+    parser.add_argument('lat', type=float)
+    parser.add_argument('lon', type=float)
+    args = parser.parse_args(argv)
+    for zone in GeofenceIndex(load_geofences(args.path)).zones_at(args.lat, args.lon):
+        print(f'{zone.name}: on_enter={zone.on_enter} on_exit={zone.on_exit}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
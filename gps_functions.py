@@ -0,0 +1,136 @@
+import time
+import logging
+
+import serial
+from serial.tools import list_ports
+
+
+logger = logging.getLogger(__name__)
+
+
+class GPSReader:
+    """Long-lived serial session to the GPS sensor.
+
+    The port is resolved once (by USB vendor ID) and kept open between
+    reads. Discovery only runs again after a real I/O failure, and each
+    consecutive failure doubles the wait before the next attempt.
+
+    A line cut by the read timeout is kept and completed by the next
+    readline (it is dropped if the session is closed first, or if it gets
+    longer than max_line bytes without an end of line, eg. UBX output).
+
+    Arguments:
+        vid         --  USB vendor ID of the GPS sensor (eg. '1546' for u-blox)
+        baudrate    --  serial baud rate
+        timeout     --  read timeout (in seconds)
+        max_backoff --  upper bound of the reconnect delay (in seconds)
+    """
+
+    max_line = 1024
+
+    def __init__(self, vid, baudrate=9600, timeout=1, max_backoff=30):
+        self.vid = vid
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.port = None
+        self.serial = None
+        self.partial = b''
+        self.failures = 0
+        self.on_connect = None
+
+        # Counters
+        self.reconnects = 0
+        self.lines_read = 0
+        self.partial_lines = 0
+        self.dropped_lines = 0
+
+    def __repr__(self):
+        return f'GPSReader on port {self.port} (VID: {self.vid}).'
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    @property
+    def backoff(self):
+        """Delay before the next reconnect attempt (in seconds)."""
+        if not self.failures:
+            return 0
+        return min(self.max_backoff, 2 ** (self.failures - 1))
+
+    def open(self):
+        """Open the serial port, running port discovery only if no port is cached."""
+        if self.is_open:
+            return self.serial
+        if self.port is None:
+            self.port = self.get_gps_port(self.vid)
+            if self.port is None:
+                raise serial.SerialException(f'GPS device with VID {self.vid} not found.')
+            logger.info(f'GPS device found on port {self.port}.')
+        self.serial = serial.Serial(self.port, baudrate=self.baudrate, timeout=self.timeout)
+        if self.on_connect is not None:
+            self.on_connect(self)
+        return self.serial
+
+    def close(self):
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except (IOError, OSError):
+                pass
+        self.serial = None
+        if self.partial:
+            self.partial = b''
+            self.dropped_lines += 1
+
+    def fail(self):
+        """Close the session after an I/O error and forget the cached port
+        so that the next open() reruns the port discovery."""
+        self.close()
+        self.port = None
+        self.failures += 1
+        self.reconnects += 1
+
+    def readline(self):
+        """Return the next complete line from the GPS sensor or None if the
+        read timed out (in the middle of a line, the partial line is kept
+        for the next call)."""
+        data = self.open().readline()
+        self.failures = 0
+        if not data.endswith(b'\n'):
+            if data:
+                self.partial_lines += 1
+                self.partial += data
+                if len(self.partial) > self.max_line:
+                    self.partial = b''
+                    self.dropped_lines += 1
+            return None
+        line, self.partial = self.partial + data, b''
+        self.lines_read += 1
+        return line
+
+    def read(self, size=1):
+        """Return the bytes currently available (at least one, unless the read times out)."""
+        ser = self.open()
+        data = ser.read(max(size, ser.in_waiting))
+        self.failures = 0
+        return data
+
+    def write(self, data):
+        return self.open().write(data)
+
+    def stats(self):
+        return {'port':          self.port,
+                'reconnects':    self.reconnects,
+                'lines_read':    self.lines_read,
+                'partial_lines': self.partial_lines,
+                'dropped_lines': self.dropped_lines,
+                }
+
+    @staticmethod
+    def get_gps_port(vid):
+        """Return the serial port name of the GPS sensor with the specified vendor ID."""
+        for port in list_ports.comports():
+            if vid in port.hwid:
+                return port.device
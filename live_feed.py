@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Live feed of the GPS fixes of the route being logged.
+
+The tracker publishes each fix into a ring of fixed-size slots in a
+memory-mapped file (in /dev/shm by default, so it is never written to
+the SD card) and any number of readers (eg. the /live endpoint of the
+API) follow it. Publishing is a copy into the mapped memory: it never
+waits for the readers and the tracker does not know about them. A reader
+that falls behind by more than the size of the ring skips the overwritten
+fixes.
+
+File layout (little endian):
+    header  --  magic b'GPSLIV', format version (u8), number of slots (u32),
+                slot size (u32), sequence number of the last fix (u64)
+    slots   --  fix with sequence number n in slot n % slots:
+                    sequence number u64
+                    user ID         u64
+                    route ID        u32
+                    fix             16 bytes, a record of tracks.py
+                    sequence number u64  (written last)
+
+The publisher writes the leading sequence number, then the fix, then the
+trailing sequence number; a reader reads them in the reverse order (the
+trailing number, the fix, the leading number, in three separate reads).
+A slot is valid only if both its sequence numbers are the expected one:
+an overwrite that started before the fix was read has changed the leading
+number by the time it is read, so a torn fix is detected and skipped.
+
+A Hub follows the ring in one thread for any number of subscribers (the
+/live clients of the API), which wait for its fixes instead of each
+polling the ring.
+
+Usage:
+    python3 live_feed.py [<ring file>]  --  print the fixes as JSON lines
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import threading
+import collections
+
+import tracks
+
+
+LIVE_FEED_PATH = '/dev/shm/gps-tracker-live.ring'
+MAGIC = b'GPSLIV'
+VERSION = 1
+HEADER = struct.Struct('<6sBxII')
+SEQUENCE = struct.Struct('<Q')
+HEAD_OFFSET = HEADER.size
+SLOTS_OFFSET = 32
+SLOT = struct.Struct('<QQI4x16sQ')
+PAYLOAD = struct.Struct('<QI4x16s')  # the slot between its sequence numbers
+PAYLOAD_OFFSET = SEQUENCE.size
+TRAILER_OFFSET = SLOT.size - SEQUENCE.size
+SLOTS = 256
+
+
+class LiveFeedError(ValueError):
+    """Raised for files that are not live feed rings."""
+
+
+def _slot_offset(sequence, slots):
+    return SLOTS_OFFSET + sequence % slots * SLOT.size
+
+
+class Publisher:
+    """Writer of the ring (one per ring file, ie. the tracker)."""
+
+    def __init__(self, path=LIVE_FEED_PATH, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        header = HEADER.pack(MAGIC, VERSION, slots, SLOT.size)
+        size = SLOTS_OFFSET + slots * SLOT.size
+        try:
+            with open(path, 'rb') as file:
+                compatible = file.read(HEADER.size) == header and os.fstat(file.fileno()).st_size == size
+        except FileNotFoundError:
+            compatible = False
+        if not compatible:
+            # A new file (never truncated in place: the readers map it)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(header)
+                file.truncate(size)
+            os.replace(path + '.tmp', path)
+        with open(path, 'r+b') as file:
+            self.map = mmap.mmap(file.fileno(), size)
+        # The sequence goes on after a restart of the tracker, for the readers
+        self.sequence = SEQUENCE.unpack_from(self.map, HEAD_OFFSET)[0]
+
+    def __repr__(self):
+        return f'Publisher of {self.path} (fix {self.sequence}).'
+
+    def publish(self, route_id, user_id, timestamp, lat, lon, total_distance):
+        sequence = self.sequence + 1
+        offset = _slot_offset(sequence, self.slots)
+        payload = PAYLOAD.pack(user_id, route_id, tracks.pack(timestamp, lat, lon, total_distance))
+        self.map[offset:offset + PAYLOAD_OFFSET] = SEQUENCE.pack(sequence)
+        self.map[offset + PAYLOAD_OFFSET:offset + TRAILER_OFFSET] = payload
+        self.map[offset + TRAILER_OFFSET:offset + SLOT.size] = SEQUENCE.pack(sequence)
+        SEQUENCE.pack_into(self.map, HEAD_OFFSET, sequence)
+        self.sequence = sequence
+
+    def close(self):
+        self.map.close()
+
+
+class Reader:
+    """Follower of the ring, with its own position (see follow)."""
+
+    def __init__(self, path=LIVE_FEED_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < SLOTS_OFFSET:
+            raise LiveFeedError(f'{path}: truncated header.')
+        magic, version, self.slots, slot_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC or slot_size != SLOT.size or len(self.map) < SLOTS_OFFSET + self.slots * SLOT.size:
+            raise LiveFeedError(f'{path}: not a live feed ring.')
+        if version != VERSION:
+            raise LiveFeedError(f'{path}: unsupported live feed version {version}.')
+
+    def __repr__(self):
+        return f'Reader of {self.path}.'
+
+    def last_sequence(self):
+        return SEQUENCE.unpack_from(self.map, HEAD_OFFSET)[0]
+
+    def replaced(self):
+        """Return True if the ring file was removed or replaced."""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def read(self, sequence):
+        """Return the fix with a sequence number as a dict (None if it was
+        overwritten or is being written)."""
+        offset = _slot_offset(sequence, self.slots)
+        # In the reverse order of Publisher.publish (see the module docstring)
+        last, = SEQUENCE.unpack(self.map[offset + TRAILER_OFFSET:offset + SLOT.size])
+        payload = self.map[offset + PAYLOAD_OFFSET:offset + TRAILER_OFFSET]
+        first, = SEQUENCE.unpack(self.map[offset:offset + PAYLOAD_OFFSET])
+        if first != sequence or last != sequence:
+            return None
+        user_id, route_id, record = PAYLOAD.unpack(payload)
+        timestamp, lat, lon, total_distance = tracks.unpack(tracks.RECORD.unpack(record))
+        return {'sequence': sequence, 'route_id': route_id, 'user_id': user_id, 'timestamp': timestamp,
+                'lat': lat, 'lon': lon, 'total_distance': total_distance}
+
+    def fixes(self, after):
+        """Return the fixes published after a sequence number (the oldest
+        ones are skipped if they were overwritten)."""
+        last_sequence = self.last_sequence()
+        if last_sequence < after:
+            after = 0  # new ring
+        first = max(after + 1, last_sequence - self.slots + 1)
+        return [fix for fix in map(self.read, range(first, last_sequence + 1)) if fix is not None]
+
+    def close(self):
+        self.map.close()
+
+
+def follow(path=LIVE_FEED_PATH, after=None, poll_interval=0.2, timeout=None):
+    """Yield the fixes published after a sequence number (the last published
+    fix first if after is None), polling the ring every poll_interval
+    seconds. Yield None when no fix was published for timeout seconds (eg. to
+    send a keep-alive to a client). Wait for the ring if it does not exist."""
+    reader, idle = None, 0.0
+    while True:
+        if reader is not None and reader.replaced():
+            reader.close()
+            reader, after = None, 0
+        if reader is None:
+            try:
+                reader = Reader(path)
+            except (FileNotFoundError, LiveFeedError, ValueError):
+                pass  # the tracker is not started or is creating the ring
+            else:
+                if after is None:
+                    after = max(reader.last_sequence() - 1, 0)
+        fixes = reader.fixes(after) if reader is not None else []
+        for fix in fixes:
+            yield fix
+            after = fix['sequence']
+        if fixes:
+            idle = 0.0
+            continue
+        time.sleep(poll_interval)
+        idle += poll_interval
+        if timeout is not None and idle >= timeout:
+            idle = 0.0
+            yield None
+
+
+class Hub:
+    """One follower of the ring fanning the fixes out to any number of
+    subscribers (eg. the /live clients of the API): the ring is polled by
+    the thread of the hub only, the subscribers wait for its fixes. The
+    hub keeps the fixes of the last slots fixes, so a subscriber that falls
+    behind skips the older ones as a Reader does."""
+
+    def __init__(self, path=LIVE_FEED_PATH, poll_interval=0.2, slots=SLOTS):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.fixes = collections.deque(maxlen=slots)
+        self.generation = 0  # incremented when the ring is replaced (its sequence starts again)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.closed = False
+
+    def __repr__(self):
+        return f'Hub of {self.path}.'
+
+    def start(self):
+        """Start the thread of the hub, once the fixes already in the ring are read."""
+        with self.condition:
+            if self.thread is not None:
+                return
+            try:
+                reader = Reader(self.path)
+            except (FileNotFoundError, LiveFeedError, ValueError):
+                after = 0  # the tracker is not started
+            else:
+                self.fixes.extend(reader.fixes(0))
+                reader.close()
+                after = self.fixes[-1]['sequence'] if self.fixes else 0
+            self.thread = threading.Thread(target=self._follow, args=(after,), name=repr(self), daemon=True)
+            self.thread.start()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def _follow(self, after):
+        for fix in follow(self.path, after, self.poll_interval, timeout=self.poll_interval):
+            with self.condition:
+                if self.closed:
+                    return
+                if fix is None:
+                    continue
+                if self.fixes and fix['sequence'] <= self.fixes[-1]['sequence']:
+                    self.fixes.clear()
+                    self.generation += 1
+                self.fixes.append(fix)
+                self.condition.notify_all()
+
+    def _after(self, after):
+        return [fix for fix in self.fixes if fix['sequence'] > after]
+
+    def subscribe(self, after=None, timeout=None):
+        """Yield the fixes published after a sequence number (the last
+        published fix first if after is None), as follow does: None is
+        yielded when no fix was published for timeout seconds."""
+        self.start()
+        with self.condition:
+            generation = self.generation
+            if after is None:
+                after = self.fixes[-1]['sequence'] - 1 if self.fixes else 0
+        while True:
+            with self.condition:
+                if self.closed:
+                    return
+                if generation != self.generation or self.fixes and self.fixes[-1]['sequence'] < after:
+                    generation, after = self.generation, 0  # new ring
+                fixes = self._after(after)
+                if not fixes:
+                    if self.condition.wait(timeout):
+                        continue
+                    fixes = [None]
+            for fix in fixes:
+                yield fix
+                if fix is not None:
+                    after = fix['sequence']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the live GPS fixes of the tracker.')
+    parser.add_argument('path', nargs='?', default=LIVE_FEED_PATH)
+    args = parser.parse_args(argv)
+    try:
+        for fix in follow(args.path):
+            print(json.dumps(fix), flush=True)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
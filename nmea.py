@@ -0,0 +1,159 @@
+"""NMEA 0183 sentence parser.
+
+Sentences are parsed from the bytes (or a memoryview of the buffer) read
+from the serial port, after their '*hh' checksum is validated (the
+original string parser of GPS.extract_parameters logged corrupted
+sentences as fixes). A memoryview is copied once to bytes and a sentence
+is split only up to the last field used. The checksum, a Python loop
+over the bytes, keeps the parser slower than the original one, see
+benchmarks/bench_nmea.py.
+"""
+
+from collections import namedtuple
+
+
+RMC = namedtuple('RMC', 'timestamp lat lon speed course')
+GGA = namedtuple('GGA', 'time lat lon quality satellites hdop altitude')
+VTG = namedtuple('VTG', 'course speed')
+GSA = namedtuple('GSA', 'mode fix_type satellites pdop hdop vdop')
+
+# Fix quality values of the GGA sentence
+NO_FIX, GPS_FIX, DGPS_FIX = 0, 1, 2
+
+KNOTS_TO_KMH = 1.852
+
+
+class NMEAError(ValueError):
+    """Raised for malformed sentences or sentences without a valid fix."""
+
+
+class ChecksumError(NMEAError):
+    """Raised when the '*hh' checksum of a sentence does not match."""
+
+
+def checksum(data):
+    """Return the XOR of all the bytes in data."""
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def fields(line, count=0):
+    """Validate the checksum of a raw NMEA sentence and return its fields
+    (the first field being the address, eg. b'GPRMC').
+
+    Arguments:
+        line    --  raw sentence (bytes or memoryview), eg. b'$GPRMC,...*hh\\r\\n'
+        count   --  number of fields used, the fields after them are not
+                    split (all the fields are split if 0)
+    """
+    line = bytes(line)  # not copied if it is bytes
+    star = line.rfind(b'*')
+    if line[:1] != b'$' or star < 0:
+        raise NMEAError(f'Not a NMEA sentence: {line!r}')
+    try:
+        expected = int(line[star + 1:star + 3], 16)
+    except ValueError:
+        raise NMEAError(f'Invalid checksum field: {line!r}')
+    body = line[1:star]
+    if checksum(body) != expected:
+        raise ChecksumError(f'Checksum mismatch: {line!r}')
+    data = body.split(b',', count or -1)
+    if len(data) < count:
+        raise NMEAError(f'Truncated sentence: {line!r}')
+    return data
+
+
+def parse_rmc(line):
+    """Return the timestamp (ISO 8601), latitude, longitude (in decimal degrees),
+    speed (in km/h) and course (in degrees) of a RMC sentence."""
+    f = fields(line, 10)
+    if f[2] != b'A':
+        raise NMEAError('RMC: no valid fix.')
+    return RMC(_timestamp(f[9], f[1]),
+               _coordinate(f[3], f[4]),
+               _coordinate(f[5], f[6]),
+               _optional_float(f[7], KNOTS_TO_KMH),
+               _optional_float(f[8]))
+
+
+def parse_gga(line):
+    """Return the UTC time, position, fix quality, number of satellites used,
+    HDOP and altitude (in meters) of a GGA sentence."""
+    f = fields(line, 10)
+    quality = int(f[6] or 0)
+    if quality == NO_FIX:
+        return GGA(_time(f[1]), None, None, NO_FIX, int(f[7] or 0), None, None)
+    return GGA(_time(f[1]),
+               _coordinate(f[2], f[3]),
+               _coordinate(f[4], f[5]),
+               quality,
+               int(f[7] or 0),
+               _optional_float(f[8]),
+               _optional_float(f[9]))
+
+
+def parse_vtg(line):
+    """Return the course (in degrees) and speed (in km/h) of a VTG sentence."""
+    f = fields(line, 8)
+    return VTG(_optional_float(f[1]), _optional_float(f[7]))
+
+
+def parse_gsa(line):
+    """Return the mode, fix type (1 - no fix, 2 - 2D, 3 - 3D),
+    PRNs of the satellites used and the dilutions of precision of a GSA sentence."""
+    f = fields(line, 18)
+    return GSA(f[1].decode('ascii'),
+               int(f[2] or 1),
+               tuple(int(prn) for prn in f[3:15] if prn),
+               _optional_float(f[15]),
+               _optional_float(f[16]),
+               _optional_float(f[17]))
+
+
+PARSERS = {b'RMC': parse_rmc,
+           b'GGA': parse_gga,
+           b'VTG': parse_vtg,
+           b'GSA': parse_gsa,
+           }
+
+
+def parse(line):
+    """Parse any of the supported sentences (talker independent).
+    Return None for the sentence types that are not supported."""
+    parser = PARSERS.get(bytes(line[3:6]))
+    if parser is None:
+        return None
+    return parser(line)
+
+
+def _coordinate(value, hemisphere):
+    """Convert a (d)ddmm.mmmm field to decimal degrees (rounded to 6 decimals)."""
+    dot = value.find(b'.')
+    if dot < 3:
+        raise NMEAError(f'Invalid coordinate: {value!r}')
+    degrees = int(value[:dot - 2]) + float(value[dot - 2:]) / 60
+    if hemisphere in (b'S', b'W'):
+        degrees = -degrees
+    return round(degrees, 6)
+
+
+def _timestamp(date, time):
+    """Convert ddmmyy and hhmmss(.ss) fields to an ISO 8601 UTC timestamp."""
+    if len(date) != 6 or len(time) < 6:
+        raise NMEAError('Invalid date or time.')
+    return (b'20%b-%b-%bT%b:%b:%bZ' % (date[4:6], date[2:4], date[:2],
+                                       time[:2], time[2:4], time[4:6])).decode('ascii')
+
+
+def _time(time):
+    if len(time) < 6:
+        return None
+    return (b'%b:%b:%b' % (time[:2], time[2:4], time[4:6])).decode('ascii')
+
+
+def _optional_float(value, factor=1):
+    if not value:
+        return None
+    return float(value) * factor
@@ -0,0 +1,115 @@
+"""LRU cache of the REST API responses.
+
+The responses are cached by request (path, query and Accept header) with
+the version of the data they were built from (eg. the inode, size and
+mtime of routes.log): an entry of an older version is never served, it
+is replaced. The cache is bounded by the total size of the cached bodies
+and a streamed response is cached as it is sent, only if it is not
+larger than max_entry_bytes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+def files_version(paths):
+    """Return the version of the data of files (their inode, size and mtime,
+    the files are not read) and their last modification time. Raise
+    FileNotFoundError if the first file does not exist, the other ones
+    (eg. the WAL of a SQLite database) are optional."""
+    version, last_modified = [], 0
+    for i, path in enumerate(paths):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if i == 0:
+                raise
+            version.append(None)
+            continue
+        version.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        last_modified = max(last_modified, stat.st_mtime)
+    return tuple(version), last_modified
+
+
+class ResponseCache:
+
+    def __init__(self, max_bytes=8 << 20, max_entry_bytes=1 << 20):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()  # key -> (version, body, headers)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return f'ResponseCache ({len(self.entries)} responses, {self.size} bytes).'
+
+    def get(self, key, version):
+        """Return the (body, headers) of a cached response (None if there is
+        no response of this version of the data in the cache)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, key, version, body, headers):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= len(old_entry[1])
+            self.entries[key] = (version, body, headers)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, old_body, _) = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+                self.evictions += 1
+
+    def store(self, key, version, response):
+        """Cache a response (a streamed response is cached once it was sent)."""
+        headers = [(name, value) for name, value in response.headers.items() if name != 'Content-Length']
+        if not response.is_streamed:
+            self.put(key, version, response.get_data(), headers)
+            return response
+        chunks, size = [], 0
+        body = response.response
+
+        def generate():
+            nonlocal chunks, size
+            for chunk in body:
+                if chunks is not None:
+                    chunks.append(chunk.encode() if isinstance(chunk, str) else chunk)
+                    size += len(chunks[-1])
+                    if size > self.max_entry_bytes:
+                        chunks = None  # too large to be cached
+                yield chunk
+            if chunks is not None:
+                self.put(key, version, b''.join(chunks), headers)
+
+        response.response = generate()
+        return response
+
+    def count_not_modified(self):
+        with self.lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'responses': len(self.entries),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': round(self.hits / requests, 3) if requests else None,
+                    'not_modified': self.not_modified,
+                    'evictions': self.evictions}
@@ -0,0 +1,184 @@
+"""In-memory index of routes.log for the REST API.
+
+The routes are parsed once and kept in memory with hash indexes on
+route_id and user_id and sorted indexes on route_id, the timestamps
+and the distance. Each lookup first refreshes the index incrementally: only the
+lines appended to routes.log since the last refresh are parsed (from the
+remembered byte offset), and the index is rebuilt only if routes.log was
+replaced (new inode, eg. route_tools.py rewrite) or truncated.
+
+The route totals by user, day, week and month (see storage.Rollup) are
+updated as the routes are parsed, so /stats costs O(groups).
+
+RouteIndex has the same iter_routes/find_routes interface as the
+storage backends (see storage.py). It is shared by the request threads:
+a lookup refreshes the index and takes the positions of its routes from
+the indexes under the lock. The routes and lines lists of the index are
+only appended to (a rebuild replaces them with new lists), so the
+positions stay valid in the lists referenced under the lock.
+"""
+
+import os
+import json
+import bisect
+import threading
+import itertools
+
+from storage import RANGE_FIELDS, Rollup, with_cursor, route_matches
+
+
+class RouteIndex:
+    hash_fields = ('route_id', 'user_id')
+    sorted_fields = RANGE_FIELDS
+
+    def __init__(self, routes_log):
+        self.routes_log = routes_log
+        self.lock = threading.Lock()
+        self._reset()
+
+    def __repr__(self):
+        return f'RouteIndex of {self.routes_log} ({len(self.routes)} routes).'
+
+    def __len__(self):
+        with self.lock:
+            self._refresh()
+            return len(self.routes)
+
+    def _reset(self, inode=None):
+        self.inode = inode
+        self.offset = 0
+        self.routes = []
+        self.lines = []
+        self.hash_indexes = {field: {} for field in self.hash_fields}
+        self.sorted_indexes = {field: [] for field in self.sorted_fields}
+        self.rollup = Rollup()
+
+    def _add(self, line):
+        route = json.loads(line)
+        position = len(self.routes)
+        self.routes.append(route)
+        self.lines.append(line)
+        self.rollup.add(route)
+        for field, index in self.hash_indexes.items():
+            index.setdefault(str(route.get(field)), []).append(position)
+        for field, cast in self.sorted_fields.items():
+            try:
+                key = cast(route[field])
+            except (KeyError, TypeError, ValueError):
+                continue
+            index = self.sorted_indexes[field]
+            if not index or index[-1][0] <= key:
+                index.append((key, position))  # routes are mostly logged in order
+            else:
+                bisect.insort(index, (key, position))
+
+    def refresh(self):
+        """Parse the routes appended to routes.log since the last refresh.
+        Raise FileNotFoundError if no route was logged."""
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        with open(self.routes_log, 'rb') as routes_log:
+            stat = os.fstat(routes_log.fileno())
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self._reset(stat.st_ino)
+            if stat.st_size == self.offset:
+                return
+            routes_log.seek(self.offset)
+            for line in routes_log:
+                if not line.endswith(b'\n'):
+                    break  # route being logged
+                self._add(line.decode())
+                self.offset += len(line)
+
+    def iter_routes(self):
+        with self.lock:
+            self._refresh()
+            return iter(self.routes[:])
+
+    def _positions(self, params):
+        """Return the positions of the routes matching the indexed parameters
+        (all the positions if there is none) and the other parameters
+        (called under the lock)."""
+        positions = None
+        other_params = {}
+        for key, value in params.items():
+            if key in self.hash_indexes:
+                matches = self.hash_indexes[key].get(str(value), [])
+                positions = matches[:] if positions is None else sorted(set(positions) & set(matches))
+            else:
+                other_params[key] = str(value)
+        if positions is None:
+            positions = range(len(self.routes))
+        return positions, other_params
+
+    def find_routes(self, **params):
+        """Return the routes whose fields are equal (as strings) to the specified values,
+        using the route_id and user_id indexes."""
+        with self.lock:
+            self._refresh()
+            routes = self.routes
+            positions, other_params = self._positions(params)
+        return [routes[position] for position in positions
+                if all(str(routes[position].get(key)) == value for key, value in other_params.items())]
+
+    def iter_lines(self, params=None, ranges=None, sort='route_id', descending=False,
+                   since_route_id=None, limit=None, route_ids=None):
+        """Yield the routes.log lines (as they were logged) of the routes selected
+        as in storage.Storage.iter_lines. The candidates are taken from the most
+        selective index (a hash index, the sorted index of a range or the route_id
+        index of route_ids), and are sorted only if they do not come from the
+        sorted index of the sort field."""
+        if sort not in self.sorted_fields:
+            raise ValueError(f'Routes can not be sorted by {sort}.')
+        ranges = with_cursor(ranges, since_route_id, sort, descending)
+        with self.lock:
+            self._refresh()
+            routes, lines = self.routes, self.lines
+            candidates = [(field, self._between(field, low, high)) for field, (low, high) in ranges.items()]
+            for key, value in (params or {}).items():
+                if key in self.hash_indexes:
+                    candidates.append((key, self.hash_indexes[key].get(str(value), [])[:]))
+            if route_ids is not None:
+                route_id_index = self.hash_indexes['route_id']
+                candidates.append(('route_id', sorted(position for route_id in route_ids
+                                                      for position in route_id_index.get(str(route_id), []))))
+            if not candidates:
+                # The sorted index of the sort field is in order already
+                candidates.append((sort, self._between(sort)))
+        field, positions = min(candidates, key=lambda candidate: len(candidate[1]))
+        cast = self.sorted_fields[sort]
+        if sort == 'route_id' and field in self.hash_indexes:
+            # The hash index positions are in the log order (of route_id)
+            positions = reversed(positions) if descending else positions
+        elif field != sort or descending:
+            # Stable sort: ties stay in the order of the log (of route_id)
+            positions = sorted((position for position in positions if sort in routes[position]),
+                               key=lambda position: cast(routes[position][sort]), reverse=descending)
+        selected = (position for position in positions
+                    if route_matches(routes[position], params, ranges)
+                    and (route_ids is None or routes[position].get('route_id') in route_ids))
+        for position in itertools.islice(selected, limit):
+            yield lines[position]
+
+    def between(self, field, low=None, high=None, refresh=True):
+        """Return the positions of the routes with low <= field <= high
+        (in the order of the field), using the sorted indexes."""
+        with self.lock:
+            if refresh:
+                self._refresh()
+            return self._between(field, low, high)
+
+    def _between(self, field, low=None, high=None):
+        cast = self.sorted_fields[field]
+        index = self.sorted_indexes[field]
+        start = 0 if low is None else bisect.bisect_left(index, (cast(low),))
+        end = len(index) if high is None else bisect.bisect_right(index, (cast(high), float('inf')))
+        return [position for _, position in index[start:end]]
+
+    def stats(self, group_by, user_id=None):
+        """Return the route totals of storage.Rollup.stats."""
+        with self.lock:
+            self._refresh()
+            return self.rollup.stats(group_by, user_id)
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""Offline tools for auditing the route logs.
+
+A route CSV is loaded into NumPy arrays and the segment distances, the
+dead-band filter and the running total are computed in one vectorized
+pass (the same rules as Journey.calculate_distance).
+
+Usage:
+    python3 route_tools.py verify  [<route_csv> ...]
+    python3 route_tools.py rewrite <route_csv> [<route_csv> ...]
+    python3 route_tools.py reprocess [--workers N]
+
+verify compares the recomputed distance with the Total_Distance column
+and the routes.log entry (of all the routes if no route CSV is given),
+rewrite replaces both with the recomputed values. reprocess regenerates
+the whole routes.log from the routes/ folder and the archive.
+
+The archived tracks (see archiver.py) are listed with the path of their
+member inside its archive (archive/routes_YYYY-MM_<route_id>.zip/<member>)
+and read through Archive.iter_points. They are never rewritten.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import tracks
+import distance
+from archiver import Archive
+from tracks import read_last_line
+
+
+GPS_LOGS_DIR = '/home/pi/trackman/GPS-Tracker/logs/gps_logs/'
+CSV_HEADER = 'Timestamp,Latitude,Longitude,Total_Distance'
+DEADBAND = 1  # meters, segments up to this length are ignored (GPS jitter)
+
+TRACK_DTYPE = np.dtype([('timestamp', 'U20'), ('lat', 'f8'), ('lon', 'f8'), ('distance', 'f8')])
+BINARY_DTYPE = np.dtype([('epoch', '<u4'), ('lat', '<i4'), ('lon', '<i4'), ('distance', '<u4')])
+ROUTE_FILENAME = re.compile(r'route_(\d+)_(\d+)\.(csv|trk)$')
+
+
+def parse_route_filename(path):
+    """Return the route ID and user ID of a route_<route_id>_<user_id>.csv (or .trk) file."""
+    match = ROUTE_FILENAME.search(os.path.basename(path))
+    if match is None:
+        raise ValueError(f'Not a route file: {path}')
+    return int(match.group(1)), int(match.group(2))
+
+
+def read_track_lines(path):
+    """Return the data lines of a route CSV. An incomplete last line
+    (left by a power loss in the middle of a write) is dropped."""
+    with open(path) as file:
+        lines = file.read().splitlines()[1:]
+    if lines and lines[-1].count(',') != 3:
+        lines.pop()
+    return lines
+
+
+def to_array(lines):
+    """Convert route CSV lines to a structured array (timestamp, lat, lon, distance)."""
+    if not lines:
+        return np.empty(0, dtype=TRACK_DTYPE)
+    return np.loadtxt(lines, delimiter=',', dtype=TRACK_DTYPE, ndmin=1)
+
+
+def load_binary_track(path):
+    """Load a binary (.trk) track into the same structured array as a route CSV."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    tracks.check_header(data, path)
+    records = np.frombuffer(data, dtype=BINARY_DTYPE, offset=tracks.HEADER.size,
+                            count=(len(data) - tracks.HEADER.size) // tracks.RECORD.size)
+    track = np.empty(len(records), dtype=TRACK_DTYPE)
+    track['timestamp'] = np.char.add(np.datetime_as_string(records['epoch'].astype('datetime64[s]')), 'Z')
+    track['lat'] = records['lat'] / 1e6
+    track['lon'] = records['lon'] / 1e6
+    track['distance'] = records['distance'] / 100
+    return track
+
+
+_archives = {}  # one Archive per GPS logs folder (and per worker process)
+
+
+def is_archived(path):
+    """Return True for the path of an archived track (see list_routes)."""
+    return os.path.dirname(path).endswith('.zip')
+
+
+def load_archived_track(path):
+    """Load an archived track (archive/routes_YYYY-MM_<route_id>.zip/<member>)
+    into the same structured array as a route CSV."""
+    gps_logs_dir = os.path.dirname(os.path.dirname(os.path.dirname(path)))
+    archive = _archives.get(gps_logs_dir)
+    if archive is None:
+        archive = _archives[gps_logs_dir] = Archive(gps_logs_dir)
+    rows = list(archive.iter_points(parse_route_filename(path)[0]))
+    return np.array(rows, dtype=TRACK_DTYPE) if rows else np.empty(0, dtype=TRACK_DTYPE)
+
+
+def load_route(path):
+    if is_archived(path):
+        return load_archived_track(path)
+    if path.endswith('.trk'):
+        return load_binary_track(path)
+    return to_array(read_track_lines(path))
+
+
+def segment_distances(lat, lon, backend='enu'):
+    """Return the distances (in meters) between consecutive points.
+
+    enu and haversine are evaluated on whole arrays (same formulas as
+    distance.py), other backends fall back to one call per segment.
+    """
+    lat1, lat2, lon1, lon2 = lat[:-1], lat[1:], lon[:-1], lon[1:]
+    if backend == 'enu':
+        phi = np.radians((lat1 + lat2) / 2)
+        sin_phi = np.sin(phi)
+        w = 1 - distance.E2 * sin_phi * sin_phi
+        n = distance.A / np.sqrt(w)
+        m = n * (1 - distance.E2) / w
+        d_lon = (lon2 - lon1 + 180) % 360 - 180
+        return np.hypot(np.radians(lat2 - lat1) * m, np.radians(d_lon) * n * np.cos(phi))
+    if backend == 'haversine':
+        phi1, phi2 = np.radians(lat1), np.radians(lat2)
+        h = (np.sin((phi2 - phi1) / 2) ** 2
+             + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2)
+        return 2 * distance.R * np.arcsin(np.sqrt(np.minimum(1.0, h)))
+    calculate_distance = distance.get_backend(backend)
+    return np.fromiter((calculate_distance(p1, p2) for p1, p2
+                        in zip(zip(lat1, lon1), zip(lat2, lon2))),
+                       dtype='f8', count=len(lat1))
+
+
+def cumulative_distance(lat, lon, threshold=DEADBAND, backend='enu'):
+    """Return the total distance traveled up to each point.
+    Segments not longer than threshold (in meters) are not counted."""
+    total = np.zeros(len(lat))
+    if len(lat) > 1:
+        d = segment_distances(lat, lon, backend)
+        np.cumsum(np.where(d > threshold, d, 0), out=total[1:])
+    return total
+
+
+def summarize(route_id, user_id, track, total):
+    """Return the routes.log entry of a route track."""
+    start, stop = track[0], track[-1]
+    duration = (_parse_timestamp(stop['timestamp'])
+                - _parse_timestamp(start['timestamp'])).total_seconds()
+    return {'route_id':        route_id,
+            'user_id':         user_id,
+            'timestamp_start': str(start['timestamp']),
+            'lat_start':       float(start['lat']),
+            'lon_start':       float(start['lon']),
+            'timestamp_stop':  str(stop['timestamp']),
+            'lat_stop':        float(stop['lat']),
+            'lon_stop':        float(stop['lon']),
+            'distance':        round(float(total[-1]), 2),
+            'duration':        int(duration),
+            'points':          len(track),
+            }
+
+
+def process_route(path, threshold=DEADBAND, backend='enu', compacted=False):
+    """Recompute a route track. Return its summary, the CSV lines (None for
+    binary and archived tracks), the track array and the recomputed running
+    totals (summary is None for an empty route).
+
+    The distance of a compacted track (see Journey._compact_route_log) can
+    not be recomputed from its remaining points, its stored running totals
+    are returned instead."""
+    route_id, user_id = parse_route_filename(path)
+    if is_archived(path) or path.endswith('.trk'):
+        lines = None
+        track = load_route(path)
+    else:
+        lines = read_track_lines(path)
+        track = to_array(lines)
+    if compacted:
+        total = track['distance'].copy()
+    else:
+        total = cumulative_distance(track['lat'], track['lon'], threshold, backend)
+    summary = summarize(route_id, user_id, track, total) if len(track) else None
+    return summary, lines, track, total
+
+
+def iter_logged_routes(routes_log):
+    """Yield the routes.log entries (skipping the corrupted lines)."""
+    try:
+        with open(routes_log) as file:
+            for line in file:
+                try:
+                    route = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(route, dict) and 'route_id' in route:
+                    yield route
+    except FileNotFoundError:
+        pass
+
+
+def read_logged_routes(routes_log, route_ids):
+    """Return the routes.log entries of the specified route IDs."""
+    return {route['route_id']: route for route in iter_logged_routes(routes_log)
+            if route['route_id'] in route_ids}
+
+
+def rewrite_track(path, lines, total):
+    """Replace the Total_Distance column of a route CSV (atomically)."""
+    totals = np.round(total, 2).tolist()
+    with open(path + '.tmp', 'w') as file:
+        file.write(CSV_HEADER + '\n')
+        file.writelines(f'{line.rpartition(",")[0]},{value}\n'
+                        for line, value in zip(lines, totals))
+        file.flush()
+        os.fsync(file)
+    os.replace(path + '.tmp', path)
+
+
+def update_routes_log(routes_log, summaries):
+    """Replace (or append) the routes.log entries of the summarized routes (atomically)."""
+    pending = dict(summaries)
+    with open(routes_log + '.tmp', 'w') as new_log:
+        try:
+            with open(routes_log) as old_log:
+                for line in old_log:
+                    try:
+                        route = json.loads(line)
+                        route_id = route['route_id']
+                    except (ValueError, KeyError, TypeError):
+                        new_log.write(line)
+                        continue
+                    if route_id in pending:
+                        route.update(pending.pop(route_id))
+                        line = json.dumps(route) + '\n'
+                    new_log.write(line)
+        except FileNotFoundError:
+            pass
+        for route_id in sorted(pending):
+            new_log.write(json.dumps(pending[route_id]) + '\n')
+        new_log.flush()
+        os.fsync(new_log)
+    os.replace(routes_log + '.tmp', routes_log)
+
+
+def verify(paths, routes_log, threshold=DEADBAND, backend='enu', tolerance=1.0):
+    """Print a verification report. Return True if all the stored totals
+    are within tolerance (in meters, or 0.1% of the distance if larger)."""
+    logged = read_logged_routes(routes_log, {parse_route_filename(path)[0] for path in paths})
+    results = []
+    for path in paths:
+        compacted = bool(logged.get(parse_route_filename(path)[0], {}).get('compacted'))
+        summary, lines, track, total = process_route(path, threshold, backend, compacted)
+        if summary is None:
+            print(f'{os.path.basename(path)}: empty route')
+        else:
+            results.append((summary, float(track['distance'][-1])))
+    all_ok = True
+    print(f'{"route_id":>8} {"points":>7} {"recomputed":>11} {"csv":>11} {"routes.log":>11}  status')
+    for summary, csv_total in results:
+        recomputed = summary['distance']
+        allowed = max(tolerance, recomputed * 1e-3)
+        log_total = logged.get(summary['route_id'], {}).get('distance')
+        ok = abs(csv_total - recomputed) <= allowed and (
+            log_total is None or abs(float(log_total) - recomputed) <= allowed)
+        all_ok = all_ok and ok
+        print(f'{summary["route_id"]:>8} {summary["points"]:>7} {recomputed:>11.2f} {csv_total:>11.2f} '
+              f'{"-" if log_total is None else format(float(log_total), ".2f"):>11}  '
+              f'{"OK" if ok else "MISMATCH"}')
+    return all_ok
+
+
+def rewrite(paths, routes_log, threshold=DEADBAND, backend='enu'):
+    """Rewrite the running totals of the route CSVs and their routes.log entries."""
+    logged = read_logged_routes(routes_log, {parse_route_filename(path)[0] for path in paths})
+    summaries = {}
+    for path in paths:
+        if logged.get(parse_route_filename(path)[0], {}).get('compacted'):
+            print(f'{os.path.basename(path)}: compacted tracks are not rewritten.')
+            continue
+        summary, lines, track, total = process_route(path, threshold, backend)
+        if summary is None:
+            continue
+        if is_archived(path):
+            print(f'{os.path.basename(path)}: archived tracks are not rewritten.')
+            continue
+        if lines is None:
+            print(f'{os.path.basename(path)}: binary tracks are not rewritten, '
+                  'convert them with tracks.py first.')
+            continue
+        rewrite_track(path, lines, total)
+        summaries[summary['route_id']] = summary
+        print(f'Route {summary["route_id"]}: {summary["distance"]} m ({summary["points"]} points)')
+    if summaries:
+        update_routes_log(routes_log, summaries)
+
+
+def list_routes(routes_dir, archive=None):
+    """Return the (route_id, path) of all the route tracks, sorted by route ID,
+    including the tracks of the archive (see is_archived). A track still
+    in the routes folder takes precedence over its archived copy."""
+    routes = {}
+    if archive is not None:
+        for entry in archive.entries():
+            routes[entry['route_id']] = archive.member_path(entry)
+    with os.scandir(routes_dir) as entries:
+        for entry in entries:
+            match = ROUTE_FILENAME.match(entry.name)
+            if match:
+                routes[int(match.group(1))] = entry.path
+    return sorted(routes.items())
+
+
+def _summary_line(path, threshold, backend, logged=None):
+    """Worker: return the routes.log line of a route track (None for an
+    empty route). logged is its entry in the current routes.log (if any):
+    the fields that can not be derived from the track (eg. geofence_events,
+    bbox or compacted) are carried over to the new line."""
+    logged = logged or {}
+    summary = process_route(path, threshold, backend, bool(logged.get('compacted')))[0]
+    if summary is None:
+        return None
+    route = dict(logged)
+    route.update(summary)
+    return json.dumps(route) + '\n'
+
+
+def reprocess(routes_dir, routes_log, workers=None, threshold=DEADBAND, backend='enu', include_open=False):
+    """Regenerate routes.log from the route tracks (including the archived
+    ones) with a pool of worker processes.
+
+    The new log is streamed to routes.log.reprocess in route ID order,
+    with at most a few routes in flight per worker, so the memory used
+    does not depend on the number of routes. If interrupted, the next run
+    resumes after the last route written there. routes.log is replaced
+    only when all the routes have been processed. A route that can not be
+    processed is reported and keeps its current line, the number of these
+    routes is returned.
+
+    Routes newer than the last route of the current routes.log are still
+    open (or waiting to be resumed after a power loss) and are skipped
+    unless include_open is set. The other fields of the current routes.log
+    lines are kept, and the distance of the routes marked 'compacted' there
+    is read from their tracks (see process_route).
+    """
+    routes = list_routes(routes_dir, Archive(os.path.dirname(routes_log)))
+    if not include_open and os.path.isfile(routes_log):
+        last_line = read_last_line(routes_log)[0]
+        try:
+            last_route_id = json.loads(last_line)['route_id'] if last_line else 0
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('The last line of routes.log is corrupted, the open route '
+                             'cannot be identified (use --include-open).')
+        routes = [(route_id, path) for route_id, path in routes if route_id <= last_route_id]
+
+    partial_log = routes_log + '.reprocess'
+    done = 0
+    if os.path.isfile(partial_log):
+        last_line, end = read_last_line(partial_log)
+        done = json.loads(last_line)['route_id'] if last_line else 0
+        os.truncate(partial_log, end)  # drop a line cut by the interruption
+        routes = [(route_id, path) for route_id, path in routes if route_id > done]
+        print(f'Resuming after route {done}.')
+
+    # The current routes.log is read along the routes (both in route ID order)
+    logged_routes = iter_logged_routes(routes_log)
+    logged = next(logged_routes, None)
+    workers = workers or os.cpu_count()
+    failures = 0
+    with open(partial_log, 'a') as new_log, ProcessPoolExecutor(workers) as executor:
+        window = workers * 4
+        pending = deque()
+        for count, (route_id, path) in enumerate(routes, 1):
+            while logged is not None and logged['route_id'] < route_id:
+                logged = next(logged_routes, None)
+            entry = logged if logged is not None and logged['route_id'] == route_id else None
+            pending.append((path, entry, executor.submit(_summary_line, path, threshold, backend, entry)))
+            if len(pending) >= window:
+                failures += not _write_result(new_log, *pending.popleft())
+            if count % 1000 == 0:
+                print(f'{count}/{len(routes)} routes processed.')
+        while pending:
+            failures += not _write_result(new_log, *pending.popleft())
+        new_log.flush()
+        os.fsync(new_log)
+    logged_routes.close()
+    os.replace(partial_log, routes_log)
+    print(f'routes.log regenerated ({len(routes)} routes processed, {failures} failed).')
+    return failures
+
+
+def _write_result(file, path, logged, future):
+    """Write the result of a worker. If the route could not be processed
+    (eg. a malformed track), its current routes.log line (if any) is kept
+    and False is returned."""
+    try:
+        line = future.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as error:
+        print(f'{path}: {error!r}, route skipped.')
+        line = json.dumps(logged) + '\n' if logged else None
+        ok = False
+    else:
+        ok = True
+    if line is not None:
+        file.write(line)
+    return ok
+
+
+def _parse_timestamp(timestamp):
+    return datetime.strptime(str(timestamp), '%Y-%m-%dT%H:%M:%SZ')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recompute route distances from the route CSV logs.')
+    parser.add_argument('--logs-dir', default=GPS_LOGS_DIR, help='GPS logs folder (containing routes.log)')
+    parser.add_argument('--backend', default='enu', choices=list(distance.BACKENDS))
+    parser.add_argument('--threshold', type=float, default=DEADBAND, help='dead-band (in meters)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify_parser = commands.add_parser('verify', help='compare the stored totals with the recomputed ones')
+    verify_parser.add_argument('--tolerance', type=float, default=1.0, help='allowed difference (in meters)')
+    verify_parser.add_argument('paths', nargs='*', help='route CSVs (all the routes by default)')
+    rewrite_parser = commands.add_parser('rewrite', help='replace the stored totals with the recomputed ones')
+    rewrite_parser.add_argument('paths', nargs='+')
+    reprocess_parser = commands.add_parser('reprocess', help='regenerate routes.log from all the route CSVs')
+    reprocess_parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    reprocess_parser.add_argument('--include-open', action='store_true',
+                                  help='also summarize the routes newer than the last one in routes.log')
+    args = parser.parse_args(argv)
+
+    routes_log = os.path.join(args.logs_dir, 'routes.log')
+    if args.command == 'reprocess':
+        failures = reprocess(os.path.join(args.logs_dir, 'routes'), routes_log,
+                             args.workers, args.threshold, args.backend, args.include_open)
+        return 0 if not failures else 1
+    if args.command == 'verify':
+        paths = args.paths or [path for _, path in list_routes(os.path.join(args.logs_dir, 'routes'),
+                                                               Archive(args.logs_dir))]
+        return 0 if verify(paths, routes_log, args.threshold, args.backend, args.tolerance) else 1
+    rewrite(args.paths, routes_log, args.threshold, args.backend)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
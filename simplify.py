@@ -0,0 +1,68 @@
+"""Route track simplification (Douglas-Peucker).
+
+The points are projected on a local plane around the first point of the
+track (equirectangular, exact enough for the extent of a route) and the
+Douglas-Peucker algorithm keeps the points that are farther than the
+tolerance (in meters) from the simplified line. The kept rows are
+unchanged, including their Total_Distance, so the distance of a
+simplified track is still the distance of the full track.
+
+A map zoom level is converted to the tolerance of one pixel of a
+256 pixels Web Mercator tile at the latitude of the route.
+"""
+
+import math
+
+import numpy as np
+
+from distance import R
+
+
+MAX_ZOOM = 22
+MERCATOR_METERS_PER_PIXEL = 2 * math.pi * 6378137.0 / 256  # at zoom 0, on the equator
+
+
+def zoom_tolerance(zoom, lat):
+    """Return the size of a map pixel (in meters) at a zoom level and latitude."""
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f'zoom must be between 0 and {MAX_ZOOM}')
+    return MERCATOR_METERS_PER_PIXEL * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def douglas_peucker(x, y, tolerance):
+    """Return the mask of the points kept by the Douglas-Peucker algorithm
+    (iterative, with the distances of each segment computed with NumPy)."""
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        norm = math.hypot(dx, dy)
+        if norm:
+            distances = np.abs(dx * py - dy * px) / norm
+        else:
+            distances = np.hypot(px, py)  # closed loop
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack += [(start, middle), (middle, end)]
+    return keep
+
+
+def simplify(rows, tolerance):
+    """Return the (timestamp, lat, lon, total_distance) rows of a
+    track simplified with a tolerance in meters."""
+    rows = list(rows)
+    if len(rows) < 3 or tolerance <= 0:
+        return rows
+    lats = np.array([row[1] for row in rows])
+    lons = np.array([row[2] for row in rows])
+    x = np.radians(lons - lons[0]) * R * math.cos(math.radians(lats[0]))
+    y = np.radians(lats - lats[0]) * R
+    keep = douglas_peucker(x, y, tolerance)
+    return [row for row, kept in zip(rows, keep) if kept]
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Spatial index of the route tracks, for the "which routes passed through
+this area" queries.
+
+The points of the tracks are indexed on a grid of CELL_SIZE degrees
+(about 110 m x 80 m at the latitude of Bucharest). spatial.log (in the
+GPS logs folder) has one JSON line per indexed route:
+
+    {"route_id": 1, "bbox": [min_lon, min_lat, max_lon, max_lat], "cells": [[i, j], ...]}
+
+with the bounding box of its track and the grid cells of its points. The
+tracker indexes each route when it ends (see Journey._route_to_json), and
+the routes logged before (or imported) are indexed offline:
+
+    python3 spatial.py index [--logs-dir <GPS logs folder>] [--storage files|sqlite]
+
+spatial.log is loaded in memory and refreshed incrementally, as routes.log
+by the RouteIndex (see route_index.py): the routes of each block of
+BLOCK_CELLS x BLOCK_CELLS cells are in a hash index and the cells of each
+route are kept in a compact array. A query (a bounding box, or a point and
+a radius) takes the routes of the blocks it covers, prunes them with their
+bounding box and then with their cells: a route with a cell entirely
+inside the area matches. Only the routes whose cells are on the border of
+the area are checked exactly, point by point, from their track.
+
+    python3 spatial.py query --bbox 26.0,44.4,26.1,44.5
+    python3 spatial.py query --near 44.4245,26.0537 --radius 500
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+import threading
+import itertools
+from array import array
+
+from distance import R, haversine
+from storage import open_storage
+
+
+CELL_SIZE = 0.001  # degrees
+BLOCK_CELLS = 10  # cells per side of the blocks of the hash index
+
+
+def cell(lat, lon):
+    return math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE)
+
+
+def cell_bbox(i, j, size=1):
+    """Return the bounding box of a cell (of a block of size cells)."""
+    return j * size * CELL_SIZE, i * size * CELL_SIZE, (j + 1) * size * CELL_SIZE, (i + 1) * size * CELL_SIZE
+
+
+def track_summary(rows):
+    """Return the bounding box and the sorted grid cells of the points of a
+    track (None and [] for a track without points)."""
+    lats, lons, cells = [], [], set()
+    for _, lat, lon, _ in rows:
+        lats.append(lat)
+        lons.append(lon)
+        cells.add(cell(lat, lon))
+    if not lats:
+        return None, []
+    return [min(lons), min(lats), max(lons), max(lats)], sorted(cells)
+
+
+def parse_bbox(text):
+    """Return the (min_lon, min_lat, max_lon, max_lat) of a 'min_lon,min_lat,max_lon,max_lat'
+    string. Raise ValueError if it is not a bounding box."""
+    bbox = tuple(float(value) for value in text.split(','))
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat')
+    return bbox
+
+
+def parse_point(text):
+    """Return the (lat, lon) of a 'lat,lon' string. Raise ValueError if it is not a point."""
+    point = tuple(float(value) for value in text.split(','))
+    if len(point) != 2 or not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+        raise ValueError('near must be lat,lon')
+    return point
+
+
+def radius_bbox(lat, lon, radius):
+    """Return the bounding box of the circle of a radius (in meters) around a point."""
+    d_lat = math.degrees(radius / R)
+    d_lon = math.degrees(radius / (R * max(math.cos(math.radians(lat)), 1e-6)))
+    return lon - d_lon, lat - d_lat, lon + d_lon, lat + d_lat
+
+
+def intersects(bbox1, bbox2):
+    return bbox1[0] <= bbox2[2] and bbox2[0] <= bbox1[2] and bbox1[1] <= bbox2[3] and bbox2[1] <= bbox1[3]
+
+
+def contains(bbox, inner_bbox):
+    return bbox[0] <= inner_bbox[0] and inner_bbox[2] <= bbox[2] and bbox[1] <= inner_bbox[1] and inner_bbox[3] <= bbox[3]
+
+
+class SpatialIndex:
+
+    def __init__(self, gps_logs_dir, storage):
+        self.path = os.path.join(gps_logs_dir, 'spatial.log')
+        self.storage = storage
+        self.lock = threading.Lock()
+        self._reset()
+
+    def __repr__(self):
+        return f'SpatialIndex of {self.path} ({len(self.bboxes)} routes, {len(self.blocks)} blocks).'
+
+    def _reset(self, inode=None):
+        self.inode = inode
+        self.offset = 0
+        self.bboxes = {}  # route_id -> bbox
+        self.route_cells = {}  # route_id -> array of i, j (of each cell)
+        self.blocks = {}  # block -> set of route_id
+
+    def _route_blocks(self, route_id):
+        cells = self.route_cells[route_id]
+        return {(i // BLOCK_CELLS, j // BLOCK_CELLS) for i, j in zip(cells[::2], cells[1::2])}
+
+    def _add(self, line):
+        entry = json.loads(line)
+        route_id = entry['route_id']
+        if route_id in self.route_cells:
+            for block in self._route_blocks(route_id):
+                self.blocks[block].discard(route_id)  # indexed again
+        self.bboxes[route_id] = entry['bbox']
+        self.route_cells[route_id] = array('i', itertools.chain.from_iterable(entry['cells']))
+        for block in self._route_blocks(route_id):
+            self.blocks.setdefault(block, set()).add(route_id)
+
+    def refresh(self):
+        """Load the routes indexed since the last refresh."""
+        with self.lock:
+            try:
+                with open(self.path, 'rb') as spatial_log:
+                    stat = os.fstat(spatial_log.fileno())
+                    if stat.st_ino != self.inode or stat.st_size < self.offset:
+                        self._reset(stat.st_ino)
+                    spatial_log.seek(self.offset)
+                    for line in spatial_log:
+                        if not line.endswith(b'\n'):
+                            break  # route being indexed
+                        self._add(line.decode())
+                        self.offset += len(line)
+            except FileNotFoundError:
+                self._reset()
+
+    def add_route(self, route_id, rows):
+        """Index the track of a route. Return its bounding box (None if it has no points)."""
+        bbox, cells = track_summary(rows)
+        if bbox is not None:
+            line = json.dumps({'route_id': route_id, 'bbox': bbox, 'cells': cells}, separators=(',', ':'))
+            with open(self.path, 'a') as spatial_log:
+                spatial_log.write(line + '\n')
+        return bbox
+
+    def index_routes(self):
+        """Index the routes of the storage that are not indexed yet.
+        Return the number of indexed routes."""
+        self.refresh()
+        indexed = 0
+        for route in list(self.storage.iter_routes()):
+            if route['route_id'] not in self.bboxes:
+                if self.add_route(route['route_id'], self.storage.iter_points(route['route_id'])):
+                    indexed += 1
+        return indexed
+
+    def _search(self, bbox, inside, point_inside):
+        """Return the IDs of the routes with a point in an area: bbox is the
+        bounding box of the area, inside(cell_bbox) is True for the boxes
+        entirely inside it and point_inside(lat, lon) for its points."""
+        self.refresh()
+        with self.lock:
+            (i0, j0), (i1, j1) = cell(bbox[1], bbox[0]), cell(bbox[3], bbox[2])
+            i0, j0, i1, j1 = i0 // BLOCK_CELLS, j0 // BLOCK_CELLS, i1 // BLOCK_CELLS, j1 // BLOCK_CELLS
+            if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self.blocks):
+                blocks = ((i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+            else:
+                blocks = (key for key in self.blocks if i0 <= key[0] <= i1 and j0 <= key[1] <= j1)
+            matches, candidates = set(), set()
+            for block in blocks:
+                route_ids = self.blocks.get(block)
+                if route_ids:
+                    (matches if inside(cell_bbox(*block, BLOCK_CELLS)) else candidates).update(route_ids)
+            border_routes = []
+            for route_id in candidates - matches:
+                if not intersects(self.bboxes[route_id], bbox):
+                    continue
+                cells = self.route_cells[route_id]
+                border = False
+                for i, j in zip(cells[::2], cells[1::2]):
+                    route_cell = cell_bbox(i, j)
+                    if inside(route_cell):
+                        matches.add(route_id)
+                        break
+                    border = border or intersects(route_cell, bbox)
+                else:
+                    if border:
+                        border_routes.append(route_id)
+        for route_id in border_routes:
+            if any(point_inside(lat, lon) for _, lat, lon, _ in self.storage.iter_points(route_id)):
+                matches.add(route_id)
+        return matches
+
+    def within_bbox(self, bbox):
+        """Return the IDs of the routes with a point in a (min_lon, min_lat, max_lon, max_lat) box."""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        return self._search(bbox, lambda inner_bbox: contains(bbox, inner_bbox),
+                            lambda lat, lon: min_lat <= lat <= max_lat and min_lon <= lon <= max_lon)
+
+    def near(self, lat, lon, radius):
+        """Return the IDs of the routes with a point within a radius (in meters) of a point."""
+        def inside(inner_bbox):
+            min_lon, min_lat, max_lon, max_lat = inner_bbox
+            return all(haversine((lat, lon), corner) <= radius
+                       for corner in ((min_lat, min_lon), (min_lat, max_lon), (max_lat, min_lon), (max_lat, max_lon)))
+
+        return self._search(radius_bbox(lat, lon, radius), inside,
+                            lambda point_lat, point_lon: haversine((lat, lon), (point_lat, point_lon)) <= radius)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Spatial index of the route tracks.')
+    parser.add_argument('--logs-dir', default='/home/pi/trackman/GPS-Tracker/logs/gps_logs/')
+    parser.add_argument('--storage', default='files', choices=['files', 'sqlite'])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('index', help='index the routes that are not indexed yet')
+    query_parser = commands.add_parser('query', help='print the IDs of the routes that passed through an area')
+    query_parser.add_argument('--bbox', type=parse_bbox, help='min_lon,min_lat,max_lon,max_lat')
+    query_parser.add_argument('--near', type=parse_point, help='lat,lon')
+    query_parser.add_argument('--radius', type=float, default=100.0, help='meters (default: 100)')
+    args = parser.parse_args(argv)
+
+    spatial_index = SpatialIndex(args.logs_dir, open_storage(args.storage, args.logs_dir))
+    if args.command == 'index':
+        print(f'{spatial_index.index_routes()} routes indexed.')
+    elif args.bbox is not None:
+        print(' '.join(map(str, sorted(spatial_index.within_bbox(args.bbox)))))
+    elif args.near is not None:
+        print(' '.join(map(str, sorted(spatial_index.near(*args.near, args.radius)))))
+    else:
+        parser.error('query needs --bbox or --near')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,882 @@
+#!/usr/bin/env python3
+"""Route storage backends.
+
+    files   --  the original layout: routes.log (one JSON route per line)
+                and one track file per route in the routes/ folder
+    sqlite  --  a SQLite database in WAL mode with a routes table and a
+                points table indexed on route_id, user_id and time
+
+Both backends have the same interface, used by the tracker (Journey)
+and by the REST API, and each one provides the route writers that
+commit the track points of a route in groups.
+
+The files layout also serves as the import/export format of the database:
+    python3 storage.py import <gps_logs_dir> [<database>]
+    python3 storage.py export <database> <gps_logs_dir> [--track-format csv|trk]
+"""
+
+import os
+import abc
+import csv
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+import itertools
+import threading
+
+import tracks
+from archiver import Archive
+
+
+class RouteWriter:
+    """Route CSV log kept open for the whole route.
+
+    Rows are buffered and committed to the SD card (flush + fsync) as a
+    group when either:
+        - sync_rows rows have been written since the last commit,
+        - sync_interval seconds have passed since the last commit (the
+          flusher thread of the writer commits the rows when no other
+          row is written, eg. the GPS lost its fix),
+        - the route is stopped (close) or sync() is called.
+    on_commit(last_row) is called after each commit (eg. to save the
+    checkpoint of the route), from the thread that committed the rows.
+    On a power failure at most the last sync_rows rows, or the rows of the
+    last sync_interval seconds (whichever is fewer), are lost.
+    sync_rows=1 gives the old behaviour of one fsync per GPS fix.
+
+    Arguments:
+        path            --  route CSV log file
+        sync_rows       --  maximum number of rows per commit
+        sync_interval   --  maximum time between commits (in seconds)
+        on_commit       --  function called with the last committed row
+    """
+    headers = ['Timestamp', 'Latitude', 'Longitude', 'Total_Distance']
+
+    def __init__(self, path, sync_rows=10, sync_interval=5.0, on_commit=None):
+        self.path = path
+        self.sync_rows = sync_rows
+        self.sync_interval = sync_interval
+        self.on_commit = on_commit
+        self.condition = threading.Condition()
+        self.flusher = None
+        self._closed = False
+        self.file = self.open()
+        self.pending_rows = 0
+        self.last_row = None
+        self.last_sync = time.monotonic()
+
+        # Instrumentation
+        self.rows_written = 0
+        self.fsync_count = 0
+        self.fsync_time = 0.0
+        self.fsync_max_time = 0.0
+
+    def __repr__(self):
+        return f'RouteWriter for {self.path} ({self.pending_rows} rows pending).'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def open(self):
+        file = open(self.path, 'a')
+        self.writer = csv.writer(file, delimiter=',', lineterminator='\n')
+        if file.tell() == 0:
+            self.writer.writerow(self.headers)
+        return file
+
+    def write_row(self, timestamp, lat, lon, total_distance):
+        self.writer.writerow((timestamp, lat, lon, total_distance))
+
+    def write(self, timestamp, lat, lon, total_distance):
+        with self.condition:
+            self.write_row(timestamp, lat, lon, total_distance)
+            self.last_row = (timestamp, lat, lon, total_distance)
+            self.pending_rows += 1
+            self.rows_written += 1
+            if (self.pending_rows >= self.sync_rows
+                    or time.monotonic() - self.last_sync >= self.sync_interval):
+                self._sync()
+            elif self.pending_rows == 1 and self.sync_interval < float('inf'):
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self._flush, name=f'Flusher of {self.path}',
+                                                    daemon=True)
+                    self.flusher.start()
+                self.condition.notify()
+
+    def sync(self):
+        """Commit the buffered rows to the disk."""
+        with self.condition:
+            self._sync()
+
+    def _flush(self):
+        """Flusher thread: commit the pending rows sync_interval seconds
+        after the last commit, until the writer is closed."""
+        with self.condition:
+            while not self.closed:
+                delay = self.last_sync + self.sync_interval - time.monotonic()
+                if not self.pending_rows:
+                    self.condition.wait()
+                elif delay > 0:
+                    self.condition.wait(delay)
+                else:
+                    self._sync()
+
+    def _sync(self):
+        self.last_sync = time.monotonic()
+        if not self.pending_rows:
+            return
+        start = time.perf_counter()
+        self.commit()
+        fsync_time = time.perf_counter() - start
+        self.fsync_count += 1
+        self.fsync_time += fsync_time
+        self.fsync_max_time = max(self.fsync_max_time, fsync_time)
+        self.pending_rows = 0
+        if self.on_commit is not None:
+            self.on_commit(self.last_row)
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file)
+
+    def close(self):
+        with self.condition:
+            if not self.closed:
+                self._sync()
+                self.file.close()
+                self._closed = True
+                self.condition.notify()
+        if self.flusher is not None:
+            self.flusher.join()
+
+    def stats(self):
+        return {'rows_written':        self.rows_written,
+                'fsync_count':         self.fsync_count,
+                'fsync_avg_time_ms':   round(1000 * self.fsync_time / max(1, self.fsync_count), 3),
+                'fsync_max_time_ms':   round(1000 * self.fsync_max_time, 3),
+                }
+
+
+class BinaryRouteWriter(RouteWriter):
+    """Append-only binary (.trk) route log (see tracks.py), with the
+    same group commit policy as the CSV RouteWriter."""
+
+    def open(self):
+        file = open(self.path, 'ab')
+        size = file.tell()
+        if size < tracks.HEADER.size:
+            file.truncate(0)
+            file.write(tracks.HEADER.pack(tracks.MAGIC, tracks.VERSION, tracks.RECORD.size))
+        else:
+            # Drop a record cut by a power loss
+            file.truncate(size - (size - tracks.HEADER.size) % tracks.RECORD.size)
+        return file
+
+    def write_row(self, timestamp, lat, lon, total_distance):
+        self.file.write(tracks.pack(timestamp, lat, lon, total_distance))
+
+
+class SQLiteRouteWriter(RouteWriter):
+    """Route points buffered in memory and inserted into the points table
+    in one transaction per commit, with the same group commit policy as
+    the CSV RouteWriter."""
+
+    def __init__(self, storage, route_id, user_id, sync_rows=10, sync_interval=5.0, on_commit=None):
+        self.storage = storage
+        self.route_id = route_id
+        self.user_id = user_id
+        self.rows = []
+        RouteWriter.__init__(self, storage.path, sync_rows, sync_interval, on_commit)
+
+    def open(self):
+        # Its own connection, also used by the flusher thread (under the lock of the writer)
+        return self.storage.connect(check_same_thread=False)
+
+    def write_row(self, timestamp, lat, lon, total_distance):
+        self.rows.append((self.route_id, self.user_id, tracks.to_epoch(timestamp),
+                          lat, lon, total_distance))
+
+    def commit(self):
+        with self.file:
+            self.file.executemany('INSERT INTO points VALUES (?, ?, ?, ?, ?, ?)', self.rows)
+        self.rows.clear()
+
+
+# Route fields that can be sorted and filtered by range, with their types
+RANGE_FIELDS = {'route_id': int, 'timestamp_start': str, 'timestamp_stop': str, 'distance': float}
+
+
+def with_cursor(ranges, since_route_id, sort='route_id', descending=False):
+    """Return the (low, high) ranges of the route fields restricted to the
+    routes after since_route_id (keyset pagination). Raise ValueError if the
+    routes are not sorted by ascending route_id, the order of the cursor."""
+    ranges = dict(ranges or {})
+    if since_route_id is not None:
+        if sort != 'route_id' or descending:
+            raise ValueError('since_route_id requires the routes sorted by ascending route_id')
+        low, high = ranges.get('route_id', (None, None))
+        low = int(since_route_id) + 1 if low is None else max(int(low), int(since_route_id) + 1)
+        ranges['route_id'] = (low, high)
+    return ranges
+
+
+def route_matches(route, params=None, ranges=None):
+    """Return True if the route fields are equal (as strings) to the params
+    values and within the (low, high) ranges (None for an open bound)."""
+    for key, value in (params or {}).items():
+        if str(route.get(key)) != str(value):
+            return False
+    for field, (low, high) in (ranges or {}).items():
+        cast = RANGE_FIELDS[field]
+        try:
+            value = cast(route[field])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if (low is not None and value < cast(low)) or (high is not None and value > cast(high)):
+            return False
+    return True
+
+
+# Route statistics groups (by user or by the day, ISO week or month of the route start)
+STATS_GROUPS = ('user', 'day', 'week', 'month')
+
+
+def period_keys(timestamp):
+    """Return the day, ISO week and month of a timestamp."""
+    year, week, _ = datetime.date(int(timestamp[:4]), int(timestamp[5:7]), int(timestamp[8:10])).isocalendar()
+    return {'day': timestamp[:10], 'week': f'{year}-W{week:02}', 'month': timestamp[:7]}
+
+
+class Rollup:
+    """Route count, distance and duration totals by user and by the day,
+    week and month of the route start (for all the users and for each user),
+    updated route by route.
+
+    totals[group_by][user_id][key] = [routes, distance, duration]
+    (user_id is '' for the totals of all the users)
+    """
+
+    def __init__(self):
+        self.totals = {group_by: {} for group_by in STATS_GROUPS}
+
+    @staticmethod
+    def keys(route):
+        """Return the (group_by, user_id, key) totals updated by a route."""
+        user_id = str(route.get('user_id'))
+        keys = [('user', user_id, user_id)]
+        try:
+            periods = period_keys(route['timestamp_start'])
+        except (KeyError, TypeError, ValueError):
+            return keys
+        for group_by, key in periods.items():
+            keys += [(group_by, '', key), (group_by, user_id, key)]
+        return keys
+
+    @staticmethod
+    def values(route):
+        """Return the (routes, distance, duration) of a route."""
+        try:
+            distance = float(route.get('distance') or 0)
+        except (TypeError, ValueError):
+            distance = 0
+        try:
+            duration = tracks.to_epoch(route['timestamp_stop']) - tracks.to_epoch(route['timestamp_start'])
+        except (KeyError, TypeError, ValueError):
+            duration = 0
+        return 1, distance, duration
+
+    def add(self, route, sign=1):
+        values = self.values(route)
+        for group_by, user_id, key in self.keys(route):
+            totals = self.totals[group_by].setdefault(user_id, {}).setdefault(key, [0, 0, 0])
+            for i, value in enumerate(values):
+                totals[i] += sign * value
+
+    def stats(self, group_by, user_id=None):
+        """Return the totals grouped by a group of STATS_GROUPS, for all
+        the users or for one user, in the order of the group keys."""
+        if group_by not in STATS_GROUPS:
+            raise ValueError(f'Routes can not be grouped by {group_by}.')
+        groups = self.totals[group_by]
+        if group_by == 'user':
+            users = sorted(groups) if user_id is None else [str(user_id)]
+            items = [item for user in users for item in groups.get(user, {}).items()]
+        else:
+            items = sorted(groups.get('' if user_id is None else str(user_id), {}).items())
+        return [stats_entry(group_by, key, *totals) for key, totals in items]
+
+
+def stats_entry(group_by, key, routes, distance, duration):
+    return {group_by if group_by != 'user' else 'user_id': key,
+            'routes': routes, 'distance': round(distance, 2), 'duration': duration}
+
+
+def _replace_json(path, data):
+    """Replace a small JSON file (atomically)."""
+    with open(path + '.tmp', 'w') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file)
+    os.replace(path + '.tmp', path)
+
+
+class Storage(abc.ABC):
+    """Checkpoint of the active route (checkpoint.json in the GPS logs
+    folder), shared by the storage backends.
+
+    The checkpoint holds the route ID, the user ID, the start fix and the
+    last committed fix (with the running distance) of the route being
+    logged, so the route is resumed after an unexpected shutdown by reading
+    only this file and the tail of the route track.
+    """
+    checkpoint_path = None
+
+    def save_checkpoint(self, route_id, user_id, first_row, last_row):
+        _replace_json(self.checkpoint_path, {'route_id': route_id,
+                                             'user_id': user_id,
+                                             'first_row': list(first_row),
+                                             'last_row': list(last_row)})
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def iter_lines(self, params=None, ranges=None, sort='route_id', descending=False,
+                   since_route_id=None, limit=None, route_ids=None):
+        """Yield as JSON lines the routes whose fields are equal (as strings) to
+        the params values and within the (low, high) ranges of RANGE_FIELDS
+        (and whose ID is in route_ids, eg. the result of a spatial query),
+        sorted by a field of RANGE_FIELDS, after the since_route_id cursor and
+        up to limit routes. The routes are scanned in the log order (the order
+        of route_id), and sorted in memory only for the other orders."""
+        if sort not in RANGE_FIELDS:
+            raise ValueError(f'Routes can not be sorted by {sort}.')
+        ranges = with_cursor(ranges, since_route_id, sort, descending)
+        routes = (route for route in self.iter_routes()
+                  if sort in route and route_matches(route, params, ranges)
+                  and (route_ids is None or route.get('route_id') in route_ids))
+        if sort != 'route_id' or descending:
+            routes = sorted(routes, key=lambda route: RANGE_FIELDS[sort](route[sort]), reverse=descending)
+        for route in itertools.islice(routes, limit):
+            yield json.dumps(route) + '\n'
+
+    @abc.abstractmethod
+    def iter_routes(self):
+        """Yield all the logged routes (in route ID order)."""
+
+    @abc.abstractmethod
+    def last_point(self, route_id, user_id):
+        """Return the last point of a route track (None if it has no points)."""
+
+    @abc.abstractmethod
+    def track_ends(self, route_id):
+        """Return the user ID and the first and last points of the track of
+        a route (None if it has no points)."""
+
+    @abc.abstractmethod
+    def track_version(self, route_id):
+        """Return a string that changes whenever the track of a route
+        changes (None if the route has no track)."""
+
+    @abc.abstractmethod
+    def compact_track(self, route_id, tolerance):
+        """Replace the track of a route with its simplification (see simplify.py)
+        for a tolerance in meters. Return the number of points (before, after).
+        The kept points keep their Total_Distance, so the distance of the
+        route can no longer be recomputed from the track: the route is
+        marked 'compacted' in its log entry (see Journey._compact_route_log)."""
+
+    def stats(self, group_by, user_id=None):
+        """Return the route totals of Rollup.stats, computed from all the routes."""
+        rollup = Rollup()
+        for route in self.iter_routes():
+            rollup.add(route)
+        return rollup.stats(group_by, user_id)
+
+    def find_open_route(self, route_id):
+        """Return the user ID and the first and last points of the route
+        interrupted by an unexpected shutdown if its ID is route_id (None
+        otherwise). The checkpoint is validated against the tail of the route
+        track: points committed after the checkpoint was saved take over its
+        last point.
+
+        Without a checkpoint of the route (eg. the file was lost, or the route
+        was started by a tracker without checkpoints), a track of a route that
+        is not logged yet is the interrupted route, and is resumed from its
+        first and last points."""
+        checkpoint = self.load_checkpoint()
+        if checkpoint is None or checkpoint['route_id'] != route_id:
+            track = self.track_ends(route_id) if route_id > self.last_route_id() else None
+            if track is None:
+                return None
+            user_id, first_row, last_row = track
+            return {'user_id': user_id, 'first_row': tuple(first_row[:3]), 'last_row': tuple(last_row)}
+        user_id = checkpoint['user_id']
+        first_row, last_row = tuple(checkpoint['first_row']), tuple(checkpoint['last_row'])
+        tail = self.last_point(route_id, user_id)
+        if tail is not None and tail[0] >= last_row[0]:
+            last_row = tail
+        return {'user_id': user_id, 'first_row': first_row, 'last_row': last_row}
+
+
+class FileStorage(Storage):
+    """routes.log (one JSON route per line) and one track file
+    per route (route_<route_id>_<user_id>.csv or .trk)."""
+
+    def __init__(self, gps_logs_dir, track_format='csv'):
+        if track_format.lower() not in ('csv', 'trk'):
+            raise NotImplementedError('Available track formats: CSV, TRK (binary)')
+        self.gps_logs_dir = gps_logs_dir
+        self.track_format = track_format.lower()
+        self.routes_log = os.path.join(gps_logs_dir, 'routes.log')
+        self.route_sequence = os.path.join(gps_logs_dir, 'routes.seq')
+        self.checkpoint_path = os.path.join(gps_logs_dir, 'checkpoint.json')
+        self.archive = Archive(gps_logs_dir)
+        self.routes_dir = os.path.join(gps_logs_dir, 'routes')
+        self._track_files, self._track_files_mtime, self._track_files_listed = {}, None, 0
+
+    def __repr__(self):
+        return f'FileStorage in {self.gps_logs_dir}.'
+
+    def last_route_id(self):
+        """Return the ID of the last logged route (0 if there is none).
+
+        The ID is read from the route sequence file (routes.seq), which is
+        trusted only while routes.log still has the size recorded with it,
+        so a crash between the two writes or an offline rewrite of routes.log
+        is detected. Otherwise the ID is read from the last line of routes.log
+        (seeking from the end of the file) and the sequence is rebuilt.
+        """
+        try:
+            size = os.path.getsize(self.routes_log)
+        except FileNotFoundError:
+            return 0
+        try:
+            with open(self.route_sequence) as file:
+                sequence = json.load(file)
+            if sequence['offset'] == size:
+                return sequence['route_id']
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+        last_log = tracks.read_last_line(self.routes_log)[0]
+        route_id = json.loads(last_log)['route_id'] if last_log else 0
+        self._write_sequence(route_id, size)
+        return route_id
+
+    def _write_sequence(self, route_id, offset):
+        _replace_json(self.route_sequence, {'route_id': route_id, 'offset': offset})
+
+    def add_route(self, route):
+        with open(self.routes_log, 'a') as routes_log:
+            routes_log.write(json.dumps(route) + '\n')
+            routes_log.flush()
+            os.fsync(routes_log)
+            offset = routes_log.tell()
+        self._write_sequence(route['route_id'], offset)
+
+    def iter_routes(self):
+        """Yield all the logged routes. Raise FileNotFoundError if no route was logged."""
+        with open(self.routes_log) as routes_log:
+            for line in routes_log:
+                yield json.loads(line)
+
+    def find_routes(self, **params):
+        """Yield the routes whose fields are equal (as strings) to the specified values."""
+        params = {key: str(value) for key, value in params.items()}
+        for route in self.iter_routes():
+            if all(str(route.get(key)) == value for key, value in params.items()):
+                yield route
+
+    def track_path(self, route_id):
+        """Return the track file of a route (None if it does not exist).
+
+        The routes folder is listed again only when its mtime changes (a
+        track file was created, replaced or removed), instead of being
+        scanned for each track. A listing made in the same second as the
+        change is not trusted, for file systems with coarse timestamps.
+        """
+        try:
+            mtime = os.stat(self.routes_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._track_files_mtime or self._track_files_listed - mtime < 1e9:
+            track_files = {}
+            listed = time.time_ns()
+            for name in os.listdir(self.routes_dir):
+                parts = name.split('_')
+                if len(parts) == 3 and parts[0] == 'route' and not name.endswith('.tmp'):
+                    track_files.setdefault(parts[1], name)
+            self._track_files, self._track_files_mtime, self._track_files_listed = track_files, mtime, listed
+        name = self._track_files.get(str(route_id))
+        return os.path.join(self.routes_dir, name) if name is not None else None
+
+    def iter_points(self, route_id):
+        """Yield the (timestamp, lat, lon, total_distance) points of a route,
+        from its track file or from the archive (see archiver.py)."""
+        path = self.track_path(route_id)
+        if path is not None:
+            yield from tracks.iter_rows(path)
+        else:
+            yield from self.archive.iter_points(route_id)
+
+    def track_ends(self, route_id):
+        path = self.track_path(route_id)
+        if path is None:
+            return None
+        try:
+            first, last = tracks.first_and_last_rows(path)
+        except (FileNotFoundError, tracks.TrackFormatError):
+            return None
+        if first is None:
+            return None
+        user_id = int(os.path.splitext(os.path.basename(path))[0].split('_')[2])
+        return user_id, first, last
+
+    def track_version(self, route_id):
+        path = self.track_path(route_id)
+        if path is not None:
+            stat = os.stat(path)
+            return f'{os.path.basename(path)}-{stat.st_size}-{stat.st_mtime_ns}'
+        entry = self.archive.lookup(route_id)
+        if entry is not None:
+            return f'{entry["archive"]}-{entry["member"]}-{entry["offset"]}-{entry["size"]}'
+        return None
+
+    def compact_track(self, route_id, tolerance):
+        from simplify import simplify  # NumPy is only needed to compact the tracks
+        path = self.track_path(route_id)
+        if path is None:
+            return 0, 0
+        rows = list(tracks.iter_rows(path))
+        simplified = simplify(rows, tolerance)
+        if len(simplified) < len(rows):
+            tracks.write_rows(path + '.tmp', simplified, binary=path.endswith('.trk'))
+            with open(path + '.tmp', 'rb') as file:
+                os.fsync(file)
+            os.replace(path + '.tmp', path)
+        return len(rows), len(simplified)
+
+    def _user_track_path(self, route_id, user_id):
+        """Return the existing track file of a route (in any format),
+        or the path of a new track file in the storage format."""
+        path = os.path.join(self.routes_dir, f'route_{route_id}_{user_id}.')
+        if os.path.isfile(path + 'csv'):
+            return path + 'csv'
+        if os.path.isfile(path + 'trk'):
+            return path + 'trk'
+        return path + self.track_format
+
+    def route_writer(self, route_id, user_id, sync_rows=10, sync_interval=5.0, on_commit=None):
+        """Return the writer of a route track, appending to the
+        existing track (in its own format) if there is one."""
+        path = self._user_track_path(route_id, user_id)
+        writer = BinaryRouteWriter if path.endswith('.trk') else RouteWriter
+        return writer(path, sync_rows=sync_rows, sync_interval=sync_interval, on_commit=on_commit)
+
+    def last_point(self, route_id, user_id):
+        path = self._user_track_path(route_id, user_id)
+        try:
+            return tracks.first_and_last_rows(path)[1]
+        except (FileNotFoundError, tracks.TrackFormatError):
+            return None
+
+    def import_route(self, route, points):
+        with self.route_writer(route['route_id'], route['user_id'],
+                               sync_rows=float('inf'), sync_interval=float('inf')) as writer:
+            for point in points:
+                writer.write(*point)
+        self.add_route(route)
+
+
+class SQLiteStorage(Storage):
+    """Routes and track points in a SQLite database in WAL mode, so that
+    the API can read while the tracker writes. Each thread gets its own
+    connection."""
+
+    columns = ['route_id', 'user_id', 'timestamp_start', 'lat_start', 'lon_start',
+               'timestamp_stop', 'lat_stop', 'lon_stop', 'distance']
+    column_types = {'route_id': int, 'user_id': int,
+                    'lat_start': float, 'lon_start': float,
+                    'lat_stop': float, 'lon_stop': float, 'distance': float}
+    schema = """
+        CREATE TABLE IF NOT EXISTS routes (
+            route_id        INTEGER PRIMARY KEY,
+            user_id         INTEGER NOT NULL,
+            timestamp_start TEXT,
+            lat_start       REAL,
+            lon_start       REAL,
+            timestamp_stop  TEXT,
+            lat_stop        REAL,
+            lon_stop        REAL,
+            distance        REAL,
+            extra           TEXT
+        );
+        CREATE INDEX IF NOT EXISTS routes_user_id ON routes (user_id);
+        CREATE INDEX IF NOT EXISTS routes_timestamp_start ON routes (timestamp_start);
+        CREATE TABLE IF NOT EXISTS points (
+            route_id        INTEGER NOT NULL,
+            user_id         INTEGER NOT NULL,
+            time            INTEGER NOT NULL,
+            lat             REAL NOT NULL,
+            lon             REAL NOT NULL,
+            distance        REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS points_route_id ON points (route_id, time);
+        CREATE INDEX IF NOT EXISTS points_user_id ON points (user_id, time);
+        CREATE INDEX IF NOT EXISTS points_time ON points (time);
+        CREATE TABLE IF NOT EXISTS rollups (
+            group_by        TEXT NOT NULL,
+            user_id         TEXT NOT NULL,
+            key             TEXT NOT NULL,
+            routes          INTEGER NOT NULL,
+            distance        REAL NOT NULL,
+            duration        INTEGER NOT NULL,
+            PRIMARY KEY (group_by, user_id, key)
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint_path = os.path.join(os.path.dirname(path), 'checkpoint.json')
+        self.local = threading.local()
+        db = self.connection()
+        db.executescript(self.schema)
+        if not db.execute('SELECT 1 FROM rollups LIMIT 1').fetchone():
+            # Database created before the rollups table
+            with db:
+                for route in list(self.iter_routes()):
+                    self._add_to_rollups(db, route)
+
+    def __repr__(self):
+        return f'SQLiteStorage in {self.path}.'
+
+    def connect(self, **kwargs):
+        """Return a new connection to the database (kwargs of sqlite3.connect)."""
+        db = sqlite3.connect(self.path, **kwargs)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        return db
+
+    def connection(self):
+        """Return the connection of the current thread."""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.connect()
+        return db
+
+    def last_route_id(self):
+        return self.connection().execute('SELECT coalesce(max(route_id), 0) FROM routes').fetchone()[0]
+
+    def add_route(self, route):
+        extra = {key: value for key, value in route.items() if key not in self.columns}
+        values = [route.get(column) for column in self.columns]
+        with self.connection() as db:
+            old_route = next(self._select_routes('WHERE route_id = ?', (route['route_id'],)), None)
+            if old_route is not None:
+                self._add_to_rollups(db, old_route, -1)
+            db.execute(f'INSERT OR REPLACE INTO routes VALUES ({", ".join("?" * 10)})',
+                       values + [json.dumps(extra) if extra else None])
+            self._add_to_rollups(db, route)
+
+    @staticmethod
+    def _add_to_rollups(db, route, sign=1):
+        """Update the rollups table (see storage.Rollup) in the transaction of a route."""
+        values = [sign * value for value in Rollup.values(route)]
+        db.executemany('INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?) '
+                       'ON CONFLICT (group_by, user_id, key) DO UPDATE SET '
+                       'routes = routes + excluded.routes, '
+                       'distance = distance + excluded.distance, '
+                       'duration = duration + excluded.duration',
+                       [keys + tuple(values) for keys in Rollup.keys(route)])
+
+    def stats(self, group_by, user_id=None):
+        """Return the route totals of Rollup.stats, from the rollups table."""
+        if group_by not in STATS_GROUPS:
+            raise ValueError(f'Routes can not be grouped by {group_by}.')
+        if group_by == 'user':
+            where, args = ('', ()) if user_id is None else ('AND user_id = ?', (str(user_id),))
+        else:
+            where, args = 'AND user_id = ?', ('' if user_id is None else str(user_id),)
+        query = (f'SELECT key, routes, distance, duration FROM rollups '
+                 f'WHERE group_by = ? {where} AND routes != 0 ORDER BY key')
+        return [stats_entry(group_by, *row) for row in self.connection().execute(query, (group_by,) + args)]
+
+    def _select_routes(self, where='', args=(), order='ORDER BY route_id'):
+        query = f'SELECT {", ".join(self.columns)}, extra FROM routes {where} {order}'
+        for row in self.connection().execute(query, args):
+            route = dict(zip(self.columns, row))
+            if row[-1]:
+                route.update(json.loads(row[-1]))
+            yield route
+
+    def iter_routes(self):
+        return self._select_routes()
+
+    def _conditions(self, params):
+        """Return the SQL conditions and arguments of the params on the route
+        columns and the other params (None if a value does not fit its column)."""
+        conditions, args, other_params = [], [], {}
+        for key, value in params.items():
+            if key in self.columns:
+                try:
+                    args.append(self.column_types.get(key, str)(value))
+                except ValueError:
+                    return None
+                conditions.append(f'{key} = ?')
+            else:
+                other_params[key] = str(value)
+        return conditions, args, other_params
+
+    def find_routes(self, **params):
+        """Yield the routes whose fields are equal to the specified values.
+        The route columns are matched in SQL (using the indexes), other
+        fields are compared as strings."""
+        conditions = self._conditions(params)
+        if conditions is None:
+            return
+        conditions, args, other_params = conditions
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        for route in self._select_routes(where, args):
+            if route_matches(route, other_params):
+                yield route
+
+    def iter_lines(self, params=None, ranges=None, sort='route_id', descending=False,
+                   since_route_id=None, limit=None, route_ids=None):
+        """Same as Storage.iter_lines, with the filters on the route columns,
+        the sorting and the cursor in SQL (using the indexes)."""
+        if sort not in RANGE_FIELDS:
+            raise ValueError(f'Routes can not be sorted by {sort}.')
+        conditions = self._conditions(params or {})
+        if conditions is None:
+            return
+        conditions, args, other_params = conditions
+        conditions.append(f'{sort} IS NOT NULL')
+        for field, (low, high) in with_cursor(ranges, since_route_id, sort, descending).items():
+            cast = RANGE_FIELDS[field]
+            if low is not None:
+                conditions.append(f'{field} >= ?')
+                args.append(cast(low))
+            if high is not None:
+                conditions.append(f'{field} <= ?')
+                args.append(cast(high))
+        if route_ids is not None:
+            conditions.append('route_id IN (SELECT value FROM json_each(?))')
+            args.append(json.dumps(sorted(route_ids)))
+        order = f'ORDER BY {sort} {"DESC" if descending else "ASC"}, route_id'
+        if limit is not None and not other_params:
+            order += f' LIMIT {int(limit)}'
+        routes = (route for route in self._select_routes('WHERE ' + ' AND '.join(conditions), args, order)
+                  if route_matches(route, other_params))
+        for route in itertools.islice(routes, limit):
+            yield json.dumps(route) + '\n'
+
+    def iter_points(self, route_id):
+        query = 'SELECT time, lat, lon, distance FROM points WHERE route_id = ? ORDER BY time'
+        for epoch, lat, lon, total_distance in self.connection().execute(query, (route_id,)):
+            yield tracks.to_timestamp(epoch), lat, lon, total_distance
+
+    def route_writer(self, route_id, user_id, sync_rows=10, sync_interval=5.0, on_commit=None):
+        return SQLiteRouteWriter(self, route_id, user_id, sync_rows, sync_interval, on_commit)
+
+    def compact_track(self, route_id, tolerance):
+        from simplify import simplify  # NumPy is only needed to compact the tracks
+        rows = list(self.iter_points(route_id))
+        simplified = simplify(rows, tolerance)
+        if len(simplified) < len(rows):
+            user_id = self.connection().execute('SELECT user_id FROM points WHERE route_id = ? LIMIT 1',
+                                                (route_id,)).fetchone()[0]
+            with self.connection() as db:
+                db.execute('DELETE FROM points WHERE route_id = ?', (route_id,))
+                db.executemany('INSERT INTO points VALUES (?, ?, ?, ?, ?, ?)',
+                               [(route_id, user_id, tracks.to_epoch(timestamp), lat, lon, total_distance)
+                                for timestamp, lat, lon, total_distance in simplified])
+        return len(rows), len(simplified)
+
+    def track_ends(self, route_id):
+        query = 'SELECT user_id, time, lat, lon, distance FROM points WHERE route_id = ? ORDER BY time {} LIMIT 1'
+        first = self.connection().execute(query.format('ASC'), (route_id,)).fetchone()
+        if first is None:
+            return None
+        last = self.connection().execute(query.format('DESC'), (route_id,)).fetchone()
+        return first[0], (tracks.to_timestamp(first[1]),) + first[2:], (tracks.to_timestamp(last[1]),) + last[2:]
+
+    def track_version(self, route_id):
+        query = 'SELECT count(*), max(time), total(distance) FROM points WHERE route_id = ?'
+        count, last_time, total = self.connection().execute(query, (route_id,)).fetchone()
+        return f'{count}-{last_time}-{total}' if count else None
+
+    def last_point(self, route_id, user_id):
+        query = 'SELECT time, lat, lon, distance FROM points WHERE route_id = ? ORDER BY time DESC LIMIT 1'
+        row = self.connection().execute(query, (route_id,)).fetchone()
+        return row and (tracks.to_timestamp(row[0]),) + row[1:]
+
+    def import_route(self, route, points):
+        rows = [(route['route_id'], route['user_id'], tracks.to_epoch(timestamp), lat, lon, total_distance)
+                for timestamp, lat, lon, total_distance in points]
+        with self.connection() as db:
+            db.executemany('INSERT INTO points VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.add_route(route)
+
+
+def open_storage(backend, gps_logs_dir, track_format='csv'):
+    """Return the storage backend ('files' or 'sqlite') of a GPS logs folder."""
+    if backend.lower() == 'files':
+        return FileStorage(gps_logs_dir, track_format)
+    if backend.lower() == 'sqlite':
+        return SQLiteStorage(os.path.join(gps_logs_dir, 'routes.db'))
+    raise NotImplementedError('Available storage backends: FILES, SQLITE')
+
+
+def copy_routes(src, dst):
+    """Copy all the logged routes (and their points) from a storage to another."""
+    count = 0
+    for route in src.iter_routes():
+        dst.import_route(route, src.iter_points(route['route_id']))
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import/export the routes database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='import routes.log and the route tracks into a database')
+    import_parser.add_argument('gps_logs_dir')
+    import_parser.add_argument('database', nargs='?')
+    export_parser = commands.add_parser('export', help='export a database to routes.log and route tracks')
+    export_parser.add_argument('database')
+    export_parser.add_argument('gps_logs_dir')
+    export_parser.add_argument('--track-format', default='csv', choices=['csv', 'trk'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        src = FileStorage(args.gps_logs_dir)
+        dst = SQLiteStorage(args.database or os.path.join(args.gps_logs_dir, 'routes.db'))
+    else:
+        src = SQLiteStorage(args.database)
+        os.makedirs(os.path.join(args.gps_logs_dir, 'routes'), exist_ok=True)
+        dst = FileStorage(args.gps_logs_dir, args.track_format)
+    print(f'{copy_routes(src, dst)} routes copied from {src} to {dst}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
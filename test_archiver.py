@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+import tracks
+from archiver import Archive
+from storage import open_storage
+
+
+ROWS = [('2020-02-06T13:59:14Z', 44.424582, 26.053711, 0.0),
+        ('2020-02-06T13:59:15Z', 44.424571, 26.053722, 1.5)]
+
+
+def log_routes(tmp_path, route_ids):
+    storage = open_storage('files', str(tmp_path))
+    (tmp_path / 'routes').mkdir(exist_ok=True)
+    for route_id in route_ids:
+        month = '02' if route_id < 3 else '03'
+        route = {'route_id': route_id, 'user_id': 142189814135,
+                 'timestamp_start': f'2020-{month}-06T13:59:14Z',
+                 'timestamp_stop': f'2020-{month}-06T14:59:14Z'}
+        storage.import_route(route, ROWS)
+    return storage
+
+
+class TestArchive:
+
+    def test_archive_and_lookup(self, tmp_path):
+        storage = log_routes(tmp_path, range(1, 5))
+        archive = Archive(str(tmp_path))
+        assert archive.run(keep_days=0, now=tracks.to_epoch('2020-03-01T00:00:00Z')) == 2
+        assert sorted(p.name for p in (tmp_path / 'archive').iterdir()) == ['manifest.log', 'routes_2020-02_1.zip']
+        assert archive.run(keep_days=0) == 2
+        assert not list((tmp_path / 'routes').iterdir())
+        entry = archive.lookup(3)
+        assert entry['archive'] == 'routes_2020-03_3.zip'
+        assert entry['points'] == 2
+        assert list(archive.iter_points(1)) == ROWS
+        assert list(storage.iter_points(4)) == ROWS
+        assert archive.lookup(5) is None
+
+    def test_resume_after_crash(self, tmp_path):
+        log_routes(tmp_path, [1, 2])
+        archive = Archive(str(tmp_path))
+        archive.run(keep_days=0)
+        # Power loss before the removal of the last track and while appending to the manifest
+        (tmp_path / 'routes' / 'route_2_142189814135.csv').write_text('')
+        with open(archive.manifest, 'a') as manifest:
+            manifest.write('{"route_id": 3, "us')
+        assert archive.run(keep_days=0) == 0
+        assert not (tmp_path / 'routes' / 'route_2_142189814135.csv').exists()
+        lines = (tmp_path / 'archive' / 'manifest.log').read_text().splitlines()
+        assert [json.loads(line)['route_id'] for line in lines] == [1, 2]
+
+    def test_crash_while_writing_archive(self, tmp_path, monkeypatch):
+        log_routes(tmp_path, [1, 2])
+        archive = Archive(str(tmp_path))
+        (tmp_path / 'archive').mkdir()
+        route = json.loads((tmp_path / 'routes.log').read_text().splitlines()[0])
+        archive.archive_route(route, str(tmp_path / 'routes' / 'route_1_142189814135.csv'))
+
+        def crash(src, dst):
+            raise OSError('power loss')
+        monkeypatch.setattr('os.replace', crash)
+        with pytest.raises(OSError):
+            archive.run(keep_days=0)
+        monkeypatch.undo()
+        # The month archive is intact and the track of route 2 was kept
+        assert list(archive.iter_points(1)) == ROWS
+        assert (tmp_path / 'routes' / 'route_2_142189814135.csv').exists()
+        assert archive.run(keep_days=0) == 1
+        assert list(archive.iter_points(1)) == list(archive.iter_points(2)) == ROWS
+        assert not (tmp_path / 'archive' / 'routes_2020-02_2.zip.tmp').exists()
+
+    def test_resume_offset(self, tmp_path):
+        log_routes(tmp_path, [1, 2])
+        archive = Archive(str(tmp_path))
+        assert archive.run(keep_days=0) == 2
+        assert archive.log_offset == (tmp_path / 'routes.log').stat().st_size
+        log_routes(tmp_path, [3])
+        assert archive.run(keep_days=0) == 1
+        assert archive.lookup(3)['archive'] == 'routes_2020-03_3.zip'
+
+    def test_batches(self, tmp_path):
+        log_routes(tmp_path, [1])
+        archive = Archive(str(tmp_path))
+        assert archive.run(keep_days=0) == 1
+        first_archive = (tmp_path / 'archive' / 'routes_2020-02_1.zip').read_bytes()
+        # The next routes of the month go to new archives of batch_size routes,
+        # the archives already written are not copied or rewritten
+        log_routes(tmp_path, [2, 3, 4, 5, 6])
+        assert archive.run(keep_days=0, batch_size=2) == 5
+        assert (tmp_path / 'archive' / 'routes_2020-02_1.zip').read_bytes() == first_archive
+        assert [archive.lookup(route_id)['archive'] for route_id in range(1, 7)] == [
+            'routes_2020-02_1.zip', 'routes_2020-02_2.zip',
+            'routes_2020-03_3.zip', 'routes_2020-03_3.zip', 'routes_2020-03_5.zip', 'routes_2020-03_5.zip']
+        assert all(list(archive.iter_points(route_id)) == ROWS for route_id in range(1, 7))
+
+    def test_corrupted_lines(self, tmp_path):
+        log_routes(tmp_path, [1])
+        with open(tmp_path / 'routes.log', 'a') as routes_log:
+            routes_log.write('{"route_id": 2, "user_id": 14218\n')
+            routes_log.write('[1, 2]\n{"route_id": 2, "timestamp_start": "yesterday"}\n')
+        log_routes(tmp_path, [2])
+        archive = Archive(str(tmp_path))
+        assert archive.run(keep_days=0) == 2
+        assert [entry['route_id'] for entry in archive.entries()] == [1, 2]
@@ -0,0 +1,55 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from cards import CardStore, CardStoreError, read_cards
+
+
+class TestCardStore:
+
+    def test_formats(self, tmp_path):
+        csv_path = tmp_path / 'cards.csv'
+        csv_path.write_text('card_id,name\n780870559455,Driver 1\n142189814135,\n')
+        assert read_cards(str(csv_path)) == {'780870559455': {'name': 'Driver 1'}, '142189814135': {'name': ''}}
+        json_path = tmp_path / 'cards.json'
+        json_path.write_text(json.dumps({'780870559455': {'name': 'Driver 1'}, '142189814135': None}))
+        assert read_cards(str(json_path)) == {'780870559455': {'name': 'Driver 1'}, '142189814135': {}}
+        json_path.write_text(json.dumps([{'card_id': 780870559455, 'depot': 'North'}]))
+        assert read_cards(str(json_path)) == {'780870559455': {'depot': 'North'}}
+        db_path = tmp_path / 'cards.db'
+        with sqlite3.connect(str(db_path)) as db:
+            db.execute('CREATE TABLE cards (card_id INTEGER PRIMARY KEY, name TEXT)')
+            db.execute("INSERT INTO cards VALUES (780870559455, 'Driver 1')")
+        assert read_cards(str(db_path)) == {'780870559455': {'name': 'Driver 1'}}
+        json_path.write_text(json.dumps([{'name': 'No ID'}]))
+        with pytest.raises(CardStoreError):
+            read_cards(str(json_path))
+        with pytest.raises(NotImplementedError):
+            read_cards(str(tmp_path / 'cards.txt'))
+
+    def test_hot_reload(self, tmp_path):
+        path = tmp_path / 'cards.csv'
+        cards = CardStore(str(path), check_interval=0)
+        assert 780870559455 not in cards
+        path.write_text('card_id,name\n780870559455,Driver 1\n')
+        assert 780870559455 in cards and '780870559455' in cards
+        assert cards.get(780870559455) == {'name': 'Driver 1'} and len(cards) == 1
+        # The new file is taken at once, an unreadable file keeps the cards
+        tmp = tmp_path / 'cards.tmp'
+        tmp.write_text('card_id,name\n142189814135,Driver 2\n')
+        os.replace(str(tmp), str(path))
+        assert 142189814135 in cards and 780870559455 not in cards
+        path.write_text('name\nDriver 3\n')
+        assert 142189814135 in cards
+
+    def test_check_interval(self, tmp_path):
+        path = tmp_path / 'cards.csv'
+        path.write_text('card_id\n780870559455\n')
+        cards = CardStore(str(path), check_interval=60)
+        assert 780870559455 in cards
+        path.write_text('card_id\n142189814135\n')
+        assert 142189814135 not in cards  # not checked yet
+        cards.refresh(force=True)
+        assert 142189814135 in cards
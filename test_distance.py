@@ -0,0 +1,46 @@
+import math
+import random
+
+import pytest
+
+import distance
+
+
+def short_segments(number=2000, max_length=100, seed=1546):
+    """Random (< max_length meters) segments all over the globe."""
+    rng = random.Random(seed)
+    for _ in range(number):
+        lat, lon = rng.uniform(-80, 80), rng.uniform(-180, 180)
+        length, bearing = rng.uniform(0.5, max_length), rng.uniform(0, 2 * math.pi)
+        yield (lat, lon), (lat + length * math.cos(bearing) / 111000,
+                           lon + length * math.sin(bearing) / (111000 * math.cos(math.radians(lat))))
+
+
+class TestDistance:
+
+    def test_backends(self):
+        assert distance.get_backend() is distance.enu
+        assert distance.get_backend('Haversine') is distance.haversine
+        with pytest.raises(NotImplementedError):
+            distance.get_backend('vincenty')
+
+    def test_meridian_arc_at_equator(self):
+        # The meridional radius of curvature at the equator is a * (1 - e^2)
+        expected = math.radians(0.001) * distance.A * (1 - distance.E2)
+        assert distance.enu((0, 0), (0.001, 0)) == pytest.approx(expected, rel=1e-9)
+
+    def test_zero_and_symmetry(self):
+        p1, p2 = (44.424587, 26.053704), (44.424571, 26.053722)
+        for backend in (distance.enu, distance.haversine):
+            assert backend(p1, p1) == 0
+            assert backend(p1, p2) == pytest.approx(backend(p2, p1))
+
+    def test_antimeridian(self):
+        assert distance.enu((0, 179.9999), (0, -179.9999)) == pytest.approx(22.26, abs=0.01)
+
+    def test_short_segments_against_geodesic(self):
+        pytest.importorskip('geopy')
+        for p1, p2 in short_segments():
+            reference = distance.geodesic(p1, p2)
+            assert distance.enu(p1, p2) == pytest.approx(reference, rel=1e-8)
+            assert distance.haversine(p1, p2) == pytest.approx(reference, rel=6e-3)
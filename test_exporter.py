@@ -0,0 +1,38 @@
+import io
+import gzip
+import json
+import tarfile
+
+import pytest
+
+from exporter import iter_export
+from storage import open_storage
+
+
+ROWS = [('2020-02-06T13:59:14Z', 44.424582, 26.053711, 0.0),
+        ('2020-02-06T13:59:15Z', 44.424571, 26.053722, 1.5)]
+
+
+class TestExport:
+
+    @pytest.fixture
+    def storage(self, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        storage = open_storage('files', str(tmp_path))
+        for route_id in range(1, 6):
+            storage.import_route({'route_id': route_id, 'user_id': 780870559455}, ROWS)
+        return storage
+
+    @pytest.mark.parametrize('compression, workers', [(None, 1), ('gzip', 1), ('gzip', 3)])
+    def test_export(self, storage, compression, workers):
+        lines = list(storage.iter_lines(since_route_id=1, limit=3))
+        data = b''.join(iter_export(storage, lines, compression, workers))
+        archive = tarfile.open(fileobj=io.BytesIO(data))
+        extension = '.csv.gz' if compression else '.csv'
+        assert archive.getnames() == ['routes.ndjson'] + [f'routes/route_{route_id}_780870559455{extension}'
+                                                          for route_id in (2, 3, 4)]
+        routes = archive.extractfile('routes.ndjson').read().decode().splitlines()
+        assert [json.loads(line)['route_id'] for line in routes] == [2, 3, 4]
+        track = archive.extractfile(f'routes/route_4_780870559455{extension}').read()
+        track = gzip.decompress(track) if compression else track
+        assert track.decode().splitlines()[-1] == '2020-02-06T13:59:15Z,44.424571,26.053722,1.5'
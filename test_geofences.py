@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from geofences import (CircleZone, PolygonZone, GeofenceIndex, GeofenceMonitor, GeofenceError,
+                       load_geofences, zone_from_dict, cell)
+
+
+DEPOT = {'name': 'Depot', 'lat': 44.4245, 'lon': 26.0537, 'radius': 150, 'on_enter': 'stop'}
+SITE = {'name': 'Site', 'polygon': [[44.43, 26.05], [44.43, 26.06], [44.44, 26.06], [44.44, 26.05]],
+        'on_enter': 'flag', 'on_exit': 'split'}
+
+
+class TestGeofences:
+
+    def test_zones(self, tmp_path):
+        path = tmp_path / 'geofences.json'
+        assert load_geofences(str(path)) == []
+        path.write_text(json.dumps([DEPOT, SITE]))
+        depot, site = load_geofences(str(path))
+        assert isinstance(depot, CircleZone) and isinstance(site, PolygonZone)
+        assert depot.contains(44.4250, 26.0540) and not depot.contains(44.4270, 26.0537)
+        assert site.contains(44.435, 26.055) and not site.contains(44.445, 26.055)
+        assert site.action('enter') == 'flag' and site.action('exit') == 'split'
+        for invalid in (dict(DEPOT, radius=-1), dict(DEPOT, on_enter='beep'), {'name': 'No area'}):
+            with pytest.raises(GeofenceError):
+                zone_from_dict(invalid)
+
+    def test_index(self):
+        zones = [CircleZone(f'Zone {i}', 44.0 + i * 0.005, 26.0, 200) for i in range(500)]
+        index = GeofenceIndex(zones)
+        assert index.zones_at(44.25, 26.0) == [zones[50]]
+        assert index.zones_at(45.0, 27.0) == []
+        # A fix is tested against the zones of its cell only
+        assert len(index.cells[cell(44.25, 26.0)]) <= 4
+
+    def test_monitor(self):
+        depot = CircleZone('Depot', 44.4245, 26.0537, 150, on_enter='stop')
+        monitor = GeofenceMonitor(GeofenceIndex([depot]), confirm_fixes=2)
+        monitor.reset(44.4245, 26.0537)  # the route starts in the depot
+        assert monitor.update(44.4245, 26.0537) == []
+        assert monitor.update(44.4300, 26.0537) == []
+        assert monitor.update(44.4245, 26.0537) == []  # GPS noise
+        assert monitor.update(44.4300, 26.0537) == []
+        assert monitor.update(44.4301, 26.0537) == [(depot, 'exit')]
+        assert monitor.update(44.4246, 26.0537) == []
+        assert monitor.update(44.4245, 26.0537) == [(depot, 'enter')]
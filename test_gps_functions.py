@@ -0,0 +1,106 @@
+import pytest
+import serial
+
+import gps_functions
+from gps_functions import GPSReader
+
+
+RMC = b'$GPRMC,135914.00,A,4425.47492,N,02603.22266,E,0.0,,060220,,,A*6F\r\n'
+
+
+class FakeSerial:
+    """Serial port returning the chunks of a session, one per readline (an
+    exception is raised, b'' is a timeout)."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.is_open = True
+
+    def readline(self):
+        chunk = self.chunks.pop(0) if self.chunks else b''
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def gps(monkeypatch):
+    """Chunks of each serial session (a new one per open), and the ports
+    found by the discovery."""
+    sessions, ports = [], []
+
+    def comports():
+        ports.append('/dev/ttyACM0')
+        return [type('Port', (), {'device': '/dev/ttyACM0', 'hwid': 'USB VID:PID=1546:01A8'})]
+
+    def open_serial(port, baudrate, timeout):
+        return FakeSerial(sessions.pop(0))
+    monkeypatch.setattr(gps_functions.list_ports, 'comports', comports)
+    monkeypatch.setattr(gps_functions.serial, 'Serial', open_serial)
+    return sessions, ports
+
+
+class TestGPSReader:
+
+    def test_lines(self, gps):
+        sessions, ports = gps
+        sessions.append([RMC, RMC])
+        reader = GPSReader('1546')
+        assert reader.readline() == RMC and reader.readline() == RMC
+        assert reader.readline() is None  # timeout
+        assert reader.stats() == {'port': '/dev/ttyACM0', 'reconnects': 0, 'lines_read': 2,
+                                  'partial_lines': 0, 'dropped_lines': 0}
+
+    def test_split_line(self, gps):
+        sessions, ports = gps
+        sessions.append([RMC[:20], RMC[20:50], RMC[50:], RMC[:10], RMC[10:]])
+        reader = GPSReader('1546')
+        # A line cut by the timeout is completed by the next reads
+        assert reader.readline() is None and reader.readline() is None
+        assert reader.readline() == RMC
+        assert reader.readline() is None
+        assert reader.readline() == RMC
+        assert reader.partial_lines == 3 and reader.lines_read == 2
+
+    def test_partial_line_too_long(self, gps):
+        sessions, ports = gps
+        sessions.append([b'\xb5b' * 400, b'\xb5b' * 400, RMC])
+        reader = GPSReader('1546')
+        assert reader.readline() is None and reader.readline() is None
+        assert reader.dropped_lines == 1
+        assert reader.readline() == RMC
+
+    def test_reconnect(self, gps):
+        sessions, ports = gps
+        sessions.extend([[RMC, RMC[:30], serial.SerialException('device disconnected')],
+                         [RMC[30:], RMC]])
+        reader = GPSReader('1546')
+        connects = []
+        reader.on_connect = connects.append
+        assert reader.readline() == RMC and reader.readline() is None
+        # The port is kept open and discovered once while it works
+        assert len(ports) == 1 and len(connects) == 1
+        with pytest.raises(serial.SerialException):
+            reader.readline()
+        reader.fail()
+        assert reader.backoff == 1 and not reader.is_open
+        # The partial line of the closed session is dropped (the rest of the line
+        # in the new session is left to the NMEA checks), the port is discovered again
+        assert reader.readline() == RMC[30:]
+        assert reader.readline() == RMC
+        assert len(ports) == 2 and len(connects) == 2
+        assert reader.backoff == 0
+        assert reader.stats() == {'port': '/dev/ttyACM0', 'reconnects': 1, 'lines_read': 3,
+                                  'partial_lines': 1, 'dropped_lines': 1}
+
+    def test_device_not_found(self, gps, monkeypatch):
+        monkeypatch.setattr(gps_functions.list_ports, 'comports', lambda: [])
+        reader = GPSReader('1546')
+        with pytest.raises(serial.SerialException):
+            reader.readline()
+        for failures in range(7):
+            reader.fail()
+        assert reader.backoff == reader.max_backoff
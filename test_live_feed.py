@@ -0,0 +1,126 @@
+import json
+import threading
+
+import api
+import live_feed
+from live_feed import Publisher, Reader, Hub, follow
+
+
+FIXES = [('2020-02-06T13:59:14Z', 44.4245, 26.0537, 0.0),
+         ('2020-02-06T13:59:15Z', 44.42451, 26.05371, 1.35),
+         ('2020-02-06T13:59:16Z', 44.42452, 26.05372, 2.7)]
+
+
+class InterleavedMap:
+    """Ring mapping where the publisher starts overwriting a slot
+    (without finishing it) while its fix is being read."""
+
+    def __init__(self, map, overwrite):
+        self.map = map
+        self.overwrite = overwrite
+
+    def __getitem__(self, key):
+        if key.stop - key.start == live_feed.PAYLOAD.size:
+            self.overwrite()
+        return self.map[key]
+
+
+class TestLiveFeed:
+
+    def test_publish_and_read(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        publisher = Publisher(path, slots=4)
+        reader = Reader(path)
+        assert reader.fixes(0) == []
+        for fix in FIXES:
+            publisher.publish(7, 780870559455, *fix)
+        fixes = reader.fixes(0)
+        assert [fix['sequence'] for fix in fixes] == [1, 2, 3]
+        assert fixes[1] == {'sequence': 2, 'route_id': 7, 'user_id': 780870559455,
+                            'timestamp': FIXES[1][0], 'lat': FIXES[1][1], 'lon': FIXES[1][2],
+                            'total_distance': FIXES[1][3]}
+        assert [fix['sequence'] for fix in reader.fixes(2)] == [3]
+
+    def test_slow_reader(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        publisher = Publisher(path, slots=4)
+        reader = Reader(path)
+        for i in range(10):
+            publisher.publish(7, 780870559455, *FIXES[i % 3])
+        # The overwritten fixes are skipped
+        assert [fix['sequence'] for fix in reader.fixes(2)] == [7, 8, 9, 10]
+
+    def test_torn_read(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        publisher = Publisher(path, slots=4)
+        publisher.publish(7, 780870559455, *FIXES[0])
+        reader = Reader(path)
+
+        def overwrite():
+            offset = live_feed._slot_offset(5, 4)
+            publisher.map[offset:offset + live_feed.TRAILER_OFFSET] = (
+                live_feed.SEQUENCE.pack(5) + live_feed.PAYLOAD.pack(1, 8, bytes(16)))
+        reader.map = InterleavedMap(reader.map, overwrite)
+        assert reader.read(1) is None
+
+    def test_restart(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        publisher = Publisher(path, slots=4)
+        publisher.publish(7, 780870559455, *FIXES[0])
+        publisher.close()
+        publisher = Publisher(path, slots=4)
+        publisher.publish(8, 780870559455, *FIXES[1])
+        assert [fix['route_id'] for fix in Reader(path).fixes(0)] == [7, 8]
+        # A ring of another size is a new file
+        reader = Reader(path)
+        Publisher(path, slots=8)
+        assert reader.replaced() and Reader(path).fixes(0) == []
+
+    def test_follow(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        fixes = follow(path, poll_interval=0.01, timeout=0.02)
+        assert next(fixes) is None  # no tracker
+        publisher = Publisher(path)
+        for fix in FIXES:
+            publisher.publish(7, 780870559455, *fix)
+        assert next(fixes)['sequence'] == 3  # the last fix first
+        assert next(fixes) is None
+        publisher.publish(7, 780870559455, *FIXES[0])
+        assert next(fixes)['sequence'] == 4
+
+    def test_hub(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        publisher = Publisher(path, slots=4)
+        for fix in FIXES:
+            publisher.publish(7, 780870559455, *fix)
+        hub = Hub(path, poll_interval=0.01)
+        subscribers = [hub.subscribe(timeout=0.05) for _ in range(3)] + [hub.subscribe(1, timeout=0.05)]
+        assert [next(fixes)['sequence'] for fixes in subscribers] == [3, 3, 3, 2]
+        assert next(subscribers[0]) is None
+        publisher.publish(7, 780870559455, *FIXES[0])
+        assert [next(fixes)['sequence'] for fixes in subscribers[1:]] == [4, 4, 3]
+        # One thread follows the ring for all the subscribers
+        assert [thread.name for thread in threading.enumerate()].count(repr(hub)) == 1
+        # A new ring starts again from its first fix
+        Publisher(path, slots=8).publish(8, 780870559455, *FIXES[1])
+        fix = next(fix for fix in subscribers[1] if fix is not None)
+        assert (fix['sequence'], fix['route_id']) == (1, 8)
+        hub.close()
+        assert next(subscribers[1], 'closed') == 'closed'
+
+    def test_server_sent_events(self, tmp_path):
+        path = str(tmp_path / 'live.ring')
+        api.init_live_feed(path, subscribers=2)
+        publisher = Publisher(path)
+        for fix in FIXES:
+            publisher.publish(7, 780870559455, *fix)
+        response = api.app.test_client().get('/live', headers={'Last-Event-ID': '1'}, buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        events = iter(response.response)
+        assert next(events) == b'retry: 2000\n\n'
+        event = next(events).decode().split('\n')
+        assert event[:2] == ['id: 2', 'event: fix']
+        assert json.loads(event[2][len('data: '):])['timestamp'] == FIXES[1][0]
+        response.close()
+        assert api.live_subscribers._value == 2
+        api.init_live_feed()
@@ -0,0 +1,75 @@
+import pytest
+
+import nmea
+
+
+def sentence(body):
+    """Build a raw NMEA sentence with a valid checksum."""
+    return b'$%b*%02X\r\n' % (body, nmea.checksum(body))
+
+
+class TestNMEA:
+
+    rmc = b'$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A\r\n'
+    gga = b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n'
+    vtg = b'$GPVTG,054.7,T,034.4,M,005.5,N,010.2,K*48\r\n'
+    gsa = b'$GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1*39\r\n'
+
+    def test_rmc(self):
+        fix = nmea.parse(self.rmc)
+        assert fix.timestamp == '2094-03-23T12:35:19Z'
+        assert fix.lat == 48.1173
+        assert fix.lon == 11.516667
+        assert fix.course == 84.4
+        assert fix.speed == pytest.approx(22.4 * 1.852)
+
+    def test_rmc_southern_western_hemisphere(self):
+        fix = nmea.parse_rmc(sentence(b'GNRMC,081836.00,A,3751.65,S,14507.36,W,0.0,,130998,,,A'))
+        assert fix.lat == -37.860833
+        assert fix.lon == -145.122667
+
+    def test_rmc_without_fix(self):
+        with pytest.raises(nmea.NMEAError):
+            nmea.parse_rmc(sentence(b'GPRMC,123519,V,,,,,,,230394,,,N'))
+
+    def test_gga(self):
+        assert nmea.parse(self.gga) == nmea.GGA('12:35:19', 48.1173, 11.516667, 1, 8, 0.9, 545.4)
+
+    def test_gga_without_fix(self):
+        fix = nmea.parse_gga(sentence(b'GPGGA,123519,,,,,0,00,99.99,,,,,,'))
+        assert fix.quality == nmea.NO_FIX
+        assert fix.lat is None and fix.hdop is None
+
+    def test_vtg(self):
+        assert nmea.parse(self.vtg) == nmea.VTG(54.7, 10.2)
+
+    def test_gsa(self):
+        assert nmea.parse(self.gsa) == nmea.GSA('A', 3, (4, 5, 9, 12, 24), 2.5, 1.3, 2.1)
+
+    def test_unsupported_sentence(self):
+        assert nmea.parse(sentence(b'GPGSV,3,1,11,03,03,111,00')) is None
+
+    def test_checksum_mismatch(self):
+        corrupted = self.rmc.replace(b'4807.038', b'4807.039')
+        with pytest.raises(nmea.ChecksumError):
+            nmea.parse(corrupted)
+
+    def test_malformed(self):
+        for line in [b'', b'GPRMC,123519*6A', b'$GPRMC,123519', b'$GPRMC,123519*ZZ',
+                     sentence(b'GPRMC,123519,A')]:
+            with pytest.raises(nmea.NMEAError):
+                nmea.parse_rmc(line)
+
+    def test_memoryview_checksum(self):
+        body = self.rmc[1:self.rmc.index(b'*')]
+        assert nmea.checksum(memoryview(body)) == nmea.checksum(body) == 0x6A
+
+    def test_memoryview(self):
+        buffer = bytearray(self.gga + self.rmc)
+        gga, rmc = memoryview(buffer)[:len(self.gga)], memoryview(buffer)[len(self.gga):]
+        assert nmea.parse_rmc(rmc) == nmea.parse_rmc(self.rmc)
+        assert nmea.parse_gga(gga) == nmea.parse_gga(self.gga)
+        assert nmea.parse(rmc) == nmea.parse(self.rmc)
+        with pytest.raises(nmea.ChecksumError):
+            buffer[len(self.gga) + 20] ^= 1
+            nmea.parse_rmc(rmc)
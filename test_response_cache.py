@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import api
+from response_cache import ResponseCache, files_version
+
+
+ROUTE = {'route_id': 1, 'user_id': 780870559455,
+         'timestamp_start': '2020-02-06T13:59:14Z', 'lat_start': 44.4245, 'lon_start': 26.0537,
+         'timestamp_stop': '2020-02-06T14:09:14Z', 'lat_stop': 44.4258, 'lon_stop': 26.0537,
+         'distance': 1.5}
+
+
+class TestResponseCache:
+
+    def test_versions_and_lru(self):
+        cache = ResponseCache(max_bytes=10, max_entry_bytes=6)
+        cache.put('a', 1, b'12345', [])
+        assert cache.get('a', 1) == (b'12345', [])
+        assert cache.get('a', 2) is None  # older version
+        cache.put('b', 1, b'12345', [])
+        cache.get('a', 1)
+        cache.put('c', 1, b'12', [])  # evicts b, the least recently used
+        assert cache.get('b', 1) is None and cache.get('a', 1) is not None
+        cache.put('d', 1, b'1234567', [])  # larger than max_entry_bytes
+        assert cache.get('d', 1) is None
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['evictions'], stats['bytes']) == (3, 3, 1, 7)
+
+    def test_files_version(self, tmp_path):
+        path = tmp_path / 'routes.log'
+        with pytest.raises(FileNotFoundError):
+            files_version([str(path)])
+        path.write_text('{}\n')
+        version, _ = files_version([str(path), str(tmp_path / 'routes.log-wal')])
+        assert version[1] is None
+        with open(path, 'a') as file:
+            file.write('{}\n')
+        assert files_version([str(path)])[0] != version[:1]
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def client(request, tmp_path):
+    (tmp_path / 'routes').mkdir()
+    api.init_storage(str(tmp_path), request.param)
+    return api.app.test_client()
+
+
+class TestConditionalGet:
+
+    def test_routes(self, client):
+        api.storage.add_route(ROUTE)
+        response = client.get('/routes?user_id=780870559455')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data) == [ROUTE]
+        etag = response.headers['ETag']
+        response = client.get('/routes?user_id=780870559455')
+        assert response.headers['X-Cache'] == 'HIT' and json.loads(response.data) == [ROUTE]
+        assert client.get('/routes?user_id=780870559455', headers={'If-None-Match': etag}).status_code == 304
+        # A new route changes the version of the routes
+        api.storage.add_route(dict(ROUTE, route_id=2))
+        response = client.get('/routes?user_id=780870559455', headers={'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['X-Cache'] == 'MISS'
+        assert len(json.loads(response.data)) == 2
+        assert client.get('/cache').get_json()['not_modified'] == 1
+
+    def test_if_modified_since(self, client):
+        api.storage.add_route(ROUTE)
+        response = client.get('/routes?user_id=780870559455')
+        last_modified = response.headers['Last-Modified']
+        # A route logged in the same second as the response
+        api.storage.add_route(dict(ROUTE, route_id=2))
+        response = client.get('/routes?user_id=780870559455', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 200 and len(json.loads(response.data)) == 2
+
+    def test_not_found(self, client):
+        assert client.get('/routes?route_id=3').status_code == 404
+        assert client.get('/routes?route_id=3').headers.get('X-Cache') != 'HIT'
@@ -0,0 +1,58 @@
+import os
+import json
+
+import pytest
+
+from route_index import RouteIndex
+
+
+def route(route_id, user_id, distance):
+    return {'route_id': route_id, 'user_id': user_id, 'distance': distance,
+            'timestamp_start': f'2020-02-{route_id:02}T13:59:14Z'}
+
+
+class TestRouteIndex:
+
+    def test_incremental_refresh(self, tmp_path):
+        routes_log = tmp_path / 'routes.log'
+        routes_log.write_text(''.join(json.dumps(route(i, 780870559455 + i % 2, 100 - i)) + '\n'
+                                      for i in range(1, 6)))
+        index = RouteIndex(str(routes_log))
+        assert [r['route_id'] for r in index.find_routes(user_id='780870559455')] == [2, 4]
+        assert index.find_routes(route_id=3, user_id=780870559456) == [route(3, 780870559456, 97)]
+        offset = index.offset
+        with open(routes_log, 'a') as file:
+            file.write(json.dumps(route(6, 780870559455, 200)) + '\n{"route_id": 7, "us')
+        assert [r['route_id'] for r in index.find_routes(user_id=780870559455)] == [2, 4, 6]
+        assert index.offset == offset + len(json.dumps(route(6, 780870559455, 200))) + 1
+        assert index.between('distance', 96, 98) == [3, 2, 1]  # positions in distance order
+        assert index.between('timestamp_start', '2020-02-05') == [4, 5]
+        assert list(index.iter_lines({'route_id': 6})) == [json.dumps(route(6, 780870559455, 200)) + '\n']
+
+    def test_replaced_log(self, tmp_path):
+        routes_log = tmp_path / 'routes.log'
+        routes_log.write_text(json.dumps(route(1, 780870559455, 1)) + '\n')
+        index = RouteIndex(str(routes_log))
+        assert len(index) == 1
+        (tmp_path / 'routes.log.tmp').write_text(json.dumps(route(1, 780870559455, 2)) + '\n')
+        os.replace(tmp_path / 'routes.log.tmp', routes_log)
+        assert index.find_routes(route_id=1)[0]['distance'] == 2
+
+    def test_missing_log(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            RouteIndex(str(tmp_path / 'routes.log')).find_routes(route_id=1)
+
+    def test_query(self, tmp_path):
+        routes_log = tmp_path / 'routes.log'
+        routes_log.write_text(''.join(json.dumps(route(i, 780870559455 + i % 2, i * 7 % 10)) + '\n'
+                                      for i in range(1, 21)))
+        index = RouteIndex(str(routes_log))
+        ids = lambda lines: [json.loads(line)['route_id'] for line in lines]
+        assert ids(index.iter_lines({'user_id': 780870559455}, since_route_id=10, limit=3)) == [12, 14, 16]
+        assert ids(index.iter_lines(ranges={'distance': (2, 4)}, sort='distance', descending=True)) == [
+            2, 12, 9, 19, 6, 16]
+        assert ids(index.iter_lines(ranges={'timestamp_start': ('2020-02-18', None)}, limit=2)) == [18, 19]
+        with pytest.raises(ValueError):
+            list(index.iter_lines(sort='lat_start'))
+        with pytest.raises(ValueError):
+            list(index.iter_lines(sort='distance', since_route_id=10))
@@ -0,0 +1,113 @@
+import json
+import random
+
+import pytest
+
+import tracks
+import distance
+import route_tools
+from archiver import Archive
+from storage import FileStorage
+
+
+def write_route(path, number_of_points=500, seed=780870559455):
+    """Write a route CSV the way Journey does (per fix rounding and 1 m dead-band)."""
+    rng = random.Random(seed)
+    lat, lon = 44.4245, 26.0537
+    total, previous, rows = 0, None, []
+    for i in range(number_of_points):
+        lat, lon = round(lat + rng.gauss(0, 2e-5), 6), round(lon + rng.gauss(0, 2e-5), 6)
+        if previous is not None:
+            d_dist = distance.enu(previous, (lat, lon))
+            if d_dist > 1:
+                total = round(total + d_dist, 2)
+        previous = (lat, lon)
+        rows.append(f'2020-02-06T14:{i // 60 % 60:02}:{i % 60:02}Z,{lat},{lon},{total}\n')
+    path.write_text(route_tools.CSV_HEADER + '\n' + ''.join(rows))
+    return total
+
+
+class TestRouteTools:
+
+    def test_parse_route_filename(self):
+        assert route_tools.parse_route_filename('routes/route_12_780870559455.csv') == (12, 780870559455)
+        with pytest.raises(ValueError):
+            route_tools.parse_route_filename('routes.log')
+
+    def test_recompute_matches_journey(self, tmp_path):
+        path = tmp_path / 'route_3_142189814135.csv'
+        total = write_route(path)
+        summary, lines, track, running_total = route_tools.process_route(str(path))
+        assert summary['distance'] == pytest.approx(total, abs=0.5)
+        assert running_total == pytest.approx(track['distance'], abs=0.5)
+        assert summary['points'] == 500
+        assert summary['duration'] == 499
+
+    def test_incomplete_last_line(self, tmp_path):
+        path = tmp_path / 'route_3_142189814135.csv'
+        write_route(path, 10)
+        with open(path, 'a') as file:
+            file.write('2020-02-06T14:00:10Z,44.42')
+        assert len(route_tools.load_route(str(path))) == 10
+
+    def test_rewrite_and_verify(self, tmp_path, capsys):
+        path = tmp_path / 'route_3_142189814135.csv'
+        write_route(path)
+        routes_log = tmp_path / 'routes.log'
+        routes_log.write_text(json.dumps({'route_id': 3, 'user_id': 142189814135, 'distance': 1}) + '\n')
+        assert not route_tools.verify([str(path)], str(routes_log))
+        route_tools.rewrite([str(path)], str(routes_log))
+        assert route_tools.verify([str(path)], str(routes_log), tolerance=0)
+        assert json.loads(routes_log.read_text())['points'] == 500
+
+    def test_reprocess(self, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        for route_id in range(1, 6):
+            write_route(tmp_path / 'routes' / f'route_{route_id}_142189814135.csv', 50, seed=route_id)
+        routes_log = tmp_path / 'routes.log'
+        routes_log.write_text(''.join(json.dumps({'route_id': route_id, 'bbox': [route_id] * 4}) + '\n'
+                                      for route_id in range(1, 5)))
+        # Interrupted run: route 1 done, route 2 cut in the middle of the line
+        (tmp_path / 'routes.log.reprocess').write_text(json.dumps({'route_id': 1}) + '\n{"route_id": 2, "us')
+        # Malformed track of route 3
+        (tmp_path / 'routes' / 'route_3_142189814135.csv').write_text(route_tools.CSV_HEADER + '\nA,B,C,D\n')
+        assert route_tools.reprocess(str(tmp_path / 'routes'), str(routes_log), workers=2) == 1
+        routes = [json.loads(line) for line in routes_log.read_text().splitlines()]
+        assert [route['route_id'] for route in routes] == [1, 2, 3, 4]  # route 5 is still open
+        assert routes[2] == {'route_id': 3, 'bbox': [3] * 4}  # kept
+        assert [route['points'] for route in (routes[1], routes[3])] == [50, 50]
+        assert [route['bbox'] for route in (routes[1], routes[3])] == [[2] * 4, [4] * 4]
+        assert not (tmp_path / 'routes.log.reprocess').exists()
+
+    def test_archived_routes(self, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        routes = []
+        for route_id in range(1, 4):
+            total = write_route(tmp_path / 'routes' / f'route_{route_id}_142189814135.csv', 50, seed=route_id)
+            routes.append({'route_id': route_id, 'user_id': 142189814135, 'distance': total,
+                           'timestamp_start': '2020-02-06T14:00:00Z', 'timestamp_stop': '2020-02-06T14:00:49Z'})
+        routes_log = tmp_path / 'routes.log'
+        routes[2]['timestamp_stop'] = '2020-02-08T14:00:49Z'  # not archived
+        routes_log.write_text(''.join(json.dumps(route) + '\n' for route in routes))
+        Archive(str(tmp_path)).run(keep_days=0, now=tracks.to_epoch('2020-02-07T00:00:00Z'))
+
+        listed = route_tools.list_routes(str(tmp_path / 'routes'), Archive(str(tmp_path)))
+        assert [route_id for route_id, _ in listed] == [1, 2, 3]
+        assert route_tools.is_archived(listed[0][1]) and not route_tools.is_archived(listed[2][1])
+        assert route_tools.main(['--logs-dir', str(tmp_path), 'verify']) == 0
+        route_tools.reprocess(str(tmp_path / 'routes'), str(routes_log), workers=2)
+        assert [json.loads(line)['points'] for line in routes_log.read_text().splitlines()] == [50, 50, 50]
+
+    def test_compacted_route(self, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        total = write_route(tmp_path / 'routes' / 'route_1_142189814135.csv')
+        routes_log = tmp_path / 'routes.log'
+        routes_log.write_text(json.dumps({'route_id': 1, 'user_id': 142189814135, 'distance': total,
+                                          'compacted': 5}) + '\n')
+        assert FileStorage(str(tmp_path)).compact_track(1, 5)[1] < 500
+        path = str(tmp_path / 'routes' / 'route_1_142189814135.csv')
+        assert route_tools.verify([path], str(routes_log), tolerance=0)
+        route_tools.rewrite([path], str(routes_log))
+        route_tools.reprocess(str(tmp_path / 'routes'), str(routes_log), workers=1)
+        route = json.loads(routes_log.read_text())
+        assert route['distance'] == total and route['compacted'] == 5
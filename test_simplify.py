@@ -0,0 +1,39 @@
+import pytest
+
+import tracks
+from storage import open_storage
+from simplify import simplify, zoom_tolerance
+
+
+def track(number_of_points=200):
+    """A 2 km straight line with a 50 m detour in the middle."""
+    rows = []
+    for i in range(number_of_points):
+        lat = 44.4245 + 0.018 * i / (number_of_points - 1)
+        lon = 26.0537 + (0.0006 if i == number_of_points // 2 else 0)
+        rows.append((tracks.to_timestamp(1581000000 + i), round(lat, 6), round(lon, 6), float(i)))
+    return rows
+
+
+class TestSimplify:
+
+    def test_douglas_peucker(self):
+        rows = track()
+        assert simplify(rows, 1) == [rows[0], rows[99], rows[100], rows[101], rows[-1]]
+        assert simplify(rows, 100) == [rows[0], rows[-1]]
+        assert simplify(rows[:2], 1) == rows[:2]
+
+    def test_zoom_tolerance(self):
+        assert zoom_tolerance(0, 0) == pytest.approx(156543.03, abs=0.01)
+        assert zoom_tolerance(18, 60) == pytest.approx(156543.03 / 2 ** 19, rel=1e-6)
+        with pytest.raises(ValueError):
+            zoom_tolerance(23, 0)
+
+    @pytest.mark.parametrize('backend, track_format', [('files', 'csv'), ('files', 'trk'), ('sqlite', 'csv')])
+    def test_compact_track(self, tmp_path, backend, track_format):
+        (tmp_path / 'routes').mkdir()
+        storage = open_storage(backend, str(tmp_path), track_format)
+        rows = track()
+        storage.import_route({'route_id': 1, 'user_id': 780870559455}, rows)
+        assert storage.compact_track(1, 1) == (200, 5)
+        assert list(storage.iter_points(1)) == simplify(rows, 1)
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+import api
+from route_index import RouteIndex
+from spatial import SpatialIndex, track_summary, parse_bbox
+from storage import open_storage
+
+
+USER_ID = 780870559455
+# route_id -> track: 1 inside a cell entirely in BBOX, 2 inside BBOX in an edge cell,
+# 3 in an edge cell of BBOX but outside, 4 far away
+TRACKS = {1: [('2020-02-06T13:59:14Z', 44.4123, 26.0456, 0.0), ('2020-02-06T13:59:15Z', 44.4124, 26.0457, 13.5)],
+          2: [('2020-02-07T13:59:14Z', 44.4245, 26.0537, 0.0), ('2020-02-07T13:59:15Z', 44.4301, 26.0537, 622.6)],
+          3: [('2020-02-08T13:59:14Z', 44.4255, 26.0501, 0.0), ('2020-02-08T13:59:15Z', 44.4277, 26.0501, 244.6)],
+          4: [('2020-02-09T13:59:14Z', 45.0012, 27.0012, 0.0)]}
+BBOX = (26.035, 44.395, 26.065, 44.425)
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def storage(request, tmp_path):
+    (tmp_path / 'routes').mkdir()
+    storage = open_storage(request.param, str(tmp_path))
+    for route_id, rows in TRACKS.items():
+        storage.import_route({'route_id': route_id, 'user_id': USER_ID, 'timestamp_start': rows[0][0]}, rows)
+    return storage
+
+
+class TestSpatialIndex:
+
+    def test_track_summary(self):
+        bbox, cells = track_summary(TRACKS[2])
+        assert bbox == [26.0537, 44.4245, 26.0537, 44.4301]
+        assert cells == [(44424, 26053), (44430, 26053)]
+        assert track_summary([]) == (None, [])
+        with pytest.raises(ValueError):
+            parse_bbox('26.1,44.4,26.0,44.5')
+
+    def test_queries(self, storage, tmp_path):
+        spatial_index = SpatialIndex(str(tmp_path), storage)
+        assert spatial_index.within_bbox(BBOX) == set()
+        assert spatial_index.index_routes() == 4
+        assert spatial_index.index_routes() == 0
+        assert spatial_index.within_bbox(BBOX) == {1, 2}
+        assert spatial_index.within_bbox((-180, -90, 180, 90)) == {1, 2, 3, 4}
+        assert spatial_index.near(44.4255, 26.0501, 10) == {3}
+        assert spatial_index.near(44.4255, 26.0501, 500) == {2, 3}
+        assert spatial_index.near(44.4255, 26.0501, 2000) == {1, 2, 3}
+        # Route 1 matches from its grid cell, without reading its track
+        if storage.__class__.__name__ == 'FileStorage':
+            os.remove(storage.track_path(1))
+            assert spatial_index.within_bbox(BBOX) == {1, 2}
+
+    def test_iter_lines_route_ids(self, storage):
+        routes = RouteIndex(storage.routes_log) if hasattr(storage, 'routes_log') else storage
+        lines = routes.iter_lines({'user_id': USER_ID}, route_ids={4, 2, 7}, sort='route_id', descending=True)
+        assert [json.loads(line)['route_id'] for line in lines] == [4, 2]
+        lines = routes.iter_lines(route_ids={3, 1}, limit=1)
+        assert [json.loads(line)['route_id'] for line in lines] == [1]
+
+    def test_api(self, storage, tmp_path):
+        backend = 'files' if hasattr(storage, 'routes_log') else 'sqlite'
+        api.init_storage(str(tmp_path), backend)
+        api.spatial_index.index_routes()
+        client = api.app.test_client()
+        routes = client.get('/routes?bbox=' + ','.join(map(str, BBOX))).get_json()
+        assert [route['route_id'] for route in routes] == [1, 2]
+        routes = client.get('/routes?near=44.4255,26.0501&radius=500&order=desc&limit=2').get_json()
+        assert [route['route_id'] for route in routes] == [3, 2]
+        assert client.get('/routes?near=0,0').get_json() == []
+        assert client.get('/routes?bbox=26.0,44.4').status_code == 400
+        assert client.get('/routes?since_route_id=1&sort=distance&limit=2').status_code == 400
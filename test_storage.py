@@ -0,0 +1,221 @@
+import os
+import json
+import threading
+
+import pytest
+
+import tracks
+from storage import RouteWriter, BinaryRouteWriter, STATS_GROUPS, open_storage, copy_routes
+from route_index import RouteIndex
+
+
+class TestRouteWriter:
+
+    def test_group_commit(self, tmp_path):
+        path = tmp_path / 'route_1_780870559455.csv'
+        with RouteWriter(str(path), sync_rows=10, sync_interval=3600) as writer:
+            for i in range(25):
+                writer.write(f'2020-02-06T13:59:{i:02}Z', 44.424582, 26.053711, i * 1.5)
+            assert writer.fsync_count == 2
+            assert writer.pending_rows == 5
+        assert writer.fsync_count == 3
+        lines = path.read_text().splitlines()
+        assert lines[0] == 'Timestamp,Latitude,Longitude,Total_Distance'
+        assert lines[-1] == '2020-02-06T13:59:24Z,44.424582,26.053711,36.0'
+        assert len(lines) == 26
+
+    def test_sync_interval(self, tmp_path):
+        with RouteWriter(str(tmp_path / 'route.csv'), sync_rows=100, sync_interval=0) as writer:
+            writer.write('2020-02-06T13:59:14Z', 44.424582, 26.053711, 0)
+            assert writer.fsync_count == 1
+
+    def test_flusher(self, tmp_path):
+        path = tmp_path / 'route.csv'
+        rows = [(f'2020-02-06T13:59:1{i}Z', 44.424582, 26.053711, i * 1.5) for i in range(2)]
+        commits, committed = [], threading.Event()
+
+        def on_commit(last_row):
+            commits.append((last_row, threading.current_thread()))
+            committed.set()
+        with RouteWriter(str(path), sync_rows=100, sync_interval=0.05, on_commit=on_commit) as writer:
+            for i, row in enumerate(rows):
+                writer.write(*row)
+                assert writer.fsync_count == i
+                # Committed without another row (eg. no GPS fix)
+                assert committed.wait(5)
+                committed.clear()
+            assert writer.pending_rows == 0 and path.read_text().count('\n') == 3
+        # One flusher thread for all the commits, stopped by close
+        assert commits == [(rows[0], writer.flusher), (rows[1], writer.flusher)]
+        assert not writer.flusher.is_alive()
+
+    def test_append_after_restart(self, tmp_path):
+        path = tmp_path / 'route.csv'
+        for total_distance in (0, 1.5):
+            with RouteWriter(str(path)) as writer:
+                writer.write('2020-02-06T13:59:14Z', 44.424582, 26.053711, total_distance)
+        assert path.read_text().count('Timestamp') == 1
+        assert writer.stats()['rows_written'] == 1
+
+
+class TestBinaryRouteWriter:
+
+    rows = [('2020-02-06T13:59:14Z', 44.424582, 26.053711, 0),
+            ('2020-02-06T13:59:15Z', 44.424571, 26.053722, 1.5),
+            ('2020-02-06T13:59:16Z', -44.424557, -26.053733, 3.29)]
+
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / 'route_1_780870559455.trk')
+        with BinaryRouteWriter(path) as writer:
+            for row in self.rows:
+                writer.write(*row)
+        assert os.path.getsize(path) == tracks.HEADER.size + 3 * tracks.RECORD.size
+        assert list(tracks.iter_rows(path)) == self.rows
+        assert tracks.first_and_last_rows(path) == (self.rows[0], self.rows[-1])
+
+    def test_partial_record(self, tmp_path):
+        path = str(tmp_path / 'route_1_780870559455.trk')
+        with BinaryRouteWriter(path) as writer:
+            writer.write(*self.rows[0])
+        with open(path, 'ab') as file:
+            file.write(b'\x01\x02\x03')  # record cut by a power loss
+        assert list(tracks.iter_rows(path)) == self.rows[:1]
+        with BinaryRouteWriter(path) as writer:
+            writer.write(*self.rows[1])
+        assert list(tracks.iter_rows(path)) == self.rows[:2]
+
+    def test_converters(self, tmp_path):
+        path = str(tmp_path / 'route_1_780870559455.trk')
+        with BinaryRouteWriter(path) as writer:
+            for row in self.rows:
+                writer.write(*row)
+        tracks.to_csv(path, str(tmp_path / 'route.csv'))
+        assert list(tracks.iter_rows(str(tmp_path / 'route.csv'))) == self.rows
+        tracks.from_csv(str(tmp_path / 'route.csv'), str(tmp_path / 'copy.trk'))
+        assert (tmp_path / 'copy.trk').read_bytes() == open(path, 'rb').read()
+        tracks.to_geojson(path, str(tmp_path / 'route.geojson'), {'route_id': 1})
+        feature = json.loads((tmp_path / 'route.geojson').read_text())
+        assert feature['geometry']['coordinates'][-1] == [-26.053733, -44.424557]
+        assert feature['properties']['route_id'] == 1
+
+    def test_not_a_track(self, tmp_path):
+        path = tmp_path / 'route.trk'
+        path.write_bytes(b'Timestamp,Latitude,Longitude,Total_Distance\n')
+        with pytest.raises(tracks.TrackFormatError):
+            tracks.read_records(str(path))
+
+
+class TestStorage:
+
+    route = {'route_id': 1, 'user_id': 780870559455,
+             'timestamp_start': '2020-02-06T13:59:14Z', 'lat_start': 44.424582, 'lon_start': 26.053711,
+             'timestamp_stop': '2020-02-06T13:59:16Z', 'lat_stop': -44.424557, 'lon_stop': -26.053733,
+             'distance': 3.29}
+
+    @pytest.fixture(params=['files', 'sqlite'])
+    def storage(self, request, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        return open_storage(request.param, str(tmp_path))
+
+    def test_route_round_trip(self, storage):
+        assert storage.last_route_id() == 0
+        rows = TestBinaryRouteWriter.rows
+        with storage.route_writer(1, 780870559455) as writer:
+            for row in rows:
+                writer.write(*row)
+        storage.save_checkpoint(1, 780870559455, rows[0][:3], rows[1])
+        # The track holds a point committed after the checkpoint
+        assert storage.find_open_route(1) == {'user_id': 780870559455,
+                                              'first_row': rows[0][:3],
+                                              'last_row': rows[-1]}
+        assert storage.find_open_route(2) is None
+        storage.add_route(self.route)
+        storage.clear_checkpoint()
+        assert storage.find_open_route(1) is None
+        assert storage.last_route_id() == 1
+        assert list(storage.iter_points(1)) == TestBinaryRouteWriter.rows
+        assert list(storage.find_routes(user_id='780870559455')) == [self.route]
+        assert list(storage.find_routes(user_id=1)) == []
+
+    def test_flusher(self, storage):
+        rows = TestBinaryRouteWriter.rows
+        committed = threading.Event()
+        with storage.route_writer(1, 780870559455, sync_rows=100, sync_interval=0.05,
+                                  on_commit=lambda last_row: committed.set()) as writer:
+            writer.write(*rows[0])
+            # Committed by the flusher thread
+            assert committed.wait(5)
+            assert list(storage.iter_points(1)) == rows[:1]
+
+    def test_copy_routes(self, tmp_path):
+        src = open_storage('files', str(tmp_path))
+        (tmp_path / 'routes').mkdir()
+        src.import_route(dict(self.route, points=3), TestBinaryRouteWriter.rows)
+        dst = open_storage('sqlite', str(tmp_path))
+        assert copy_routes(src, dst) == 1
+        assert list(dst.iter_routes()) == [dict(self.route, points=3)]
+        assert list(dst.iter_points(1)) == TestBinaryRouteWriter.rows
+        assert dst.find_open_route(1) is None
+
+    def test_iter_lines(self, storage):
+        for route_id in range(1, 8):
+            storage.add_route(dict(self.route, route_id=route_id, distance=route_id % 3,
+                                   user_id=780870559455 + route_id % 2))
+        ids = lambda lines: [json.loads(line)['route_id'] for line in lines]
+        assert ids(storage.iter_lines({'user_id': 780870559456}, since_route_id=1, limit=2)) == [3, 5]
+        assert ids(storage.iter_lines(ranges={'distance': (1, None)}, sort='distance', descending=True)) == [
+            2, 5, 1, 4, 7]
+        # The cursor is the route_id of the last route of a page in the route_id order
+        with pytest.raises(ValueError):
+            list(storage.iter_lines(sort='distance', since_route_id=1, limit=2))
+        with pytest.raises(ValueError):
+            list(storage.iter_lines(descending=True, since_route_id=1, limit=2))
+
+    def test_open_route_without_checkpoint(self, storage):
+        rows = TestBinaryRouteWriter.rows
+        storage.add_route(self.route)
+        with storage.route_writer(2, 780870559455) as writer:
+            for row in rows:
+                writer.write(*row)
+        # The track of route 2 has no routes.log line: it was interrupted
+        assert storage.find_open_route(2) == {'user_id': 780870559455,
+                                              'first_row': rows[0][:3],
+                                              'last_row': rows[-1]}
+        assert storage.find_open_route(3) is None
+
+    def test_checkpoint_without_track(self, storage):
+        storage.save_checkpoint(1, 780870559455, ('2020-02-06T13:59:14Z', 44.424582, 26.053711),
+                                ('2020-02-06T13:59:14Z', 44.424582, 26.053711, 0))
+        assert storage.find_open_route(1)['last_row'] == ('2020-02-06T13:59:14Z', 44.424582, 26.053711, 0)
+
+    def test_route_sequence(self, tmp_path):
+        storage = open_storage('files', str(tmp_path))
+        for route_id in (1, 2):
+            storage.add_route(dict(self.route, route_id=route_id))
+        assert json.loads((tmp_path / 'routes.seq').read_text())['route_id'] == 2
+        # routes.log changed behind the sequence (crash or offline rewrite)
+        with open(storage.routes_log, 'a') as routes_log:
+            routes_log.write(json.dumps(dict(self.route, route_id=3)) + '\n{"route_id": 4, "us')
+        assert storage.last_route_id() == 3
+        assert json.loads((tmp_path / 'routes.seq').read_text())['route_id'] == 3
+        (tmp_path / 'routes.seq').unlink()
+        assert storage.last_route_id() == 3
+
+    def test_stats(self, storage):
+        for route_id, (start, stop, user_id) in enumerate([('2020-02-06T13:59:14Z', '2020-02-06T14:09:14Z', 1),
+                                                            ('2020-02-06T15:00:00Z', '2020-02-06T15:01:00Z', 2),
+                                                            ('2020-02-10T10:00:00Z', '2020-02-10T10:00:30Z', 1)], 1):
+            storage.add_route(dict(self.route, route_id=route_id, user_id=user_id, distance=100 * route_id,
+                                   timestamp_start=start, timestamp_stop=stop))
+        assert storage.stats('user') == [{'user_id': '1', 'routes': 2, 'distance': 400, 'duration': 630},
+                                         {'user_id': '2', 'routes': 1, 'distance': 200, 'duration': 60}]
+        assert storage.stats('week') == [{'week': '2020-W06', 'routes': 2, 'distance': 300, 'duration': 660},
+                                         {'week': '2020-W07', 'routes': 1, 'distance': 300, 'duration': 30}]
+        assert storage.stats('day', user_id=1) == [
+            {'day': '2020-02-06', 'routes': 1, 'distance': 100, 'duration': 600},
+            {'day': '2020-02-10', 'routes': 1, 'distance': 300, 'duration': 30}]
+        if hasattr(storage, 'routes_log'):  # the index of routes.log used by the API
+            index = RouteIndex(storage.routes_log)
+            assert all(index.stats(group_by) == storage.stats(group_by) for group_by in STATS_GROUPS)
+        with pytest.raises(ValueError):
+            storage.stats('year')
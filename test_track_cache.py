@@ -0,0 +1,59 @@
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+import tracks
+from storage import open_storage
+from track_cache import TrackCache
+
+
+ROWS = [('2020-02-06T13:59:14Z', 38.5, -120.2, 0.0),
+        ('2020-02-06T13:59:15Z', 40.7, -120.95, 1.5),
+        ('2020-02-06T13:59:16Z', 43.252, -126.453, 3.0)]
+
+
+class TestTrackCache:
+
+    def test_encode_polyline(self):
+        assert tracks.encode_polyline(ROWS) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+    def test_formats_and_versions(self, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        storage = open_storage('files', str(tmp_path))
+        storage.import_route({'route_id': 1, 'user_id': 780870559455}, ROWS[:2])
+        cache = TrackCache(storage, str(tmp_path / 'cache'))
+        path = cache.get(1, 'csv')
+        assert open(path).read() == ''.join(tracks.csv_lines(ROWS[:2]))
+        assert gzip.open(cache.get(1, 'csv', compressed=True)).read() == open(path, 'rb').read()
+        feature = json.load(open(cache.get(1, 'geojson')))
+        assert feature['properties']['route_id'] == 1
+        # A changed track gets new cached files
+        with storage.route_writer(1, 780870559455) as writer:
+            writer.write(*ROWS[2])
+        new_path = cache.get(1, 'csv')
+        assert new_path != path and os.path.exists(path)  # may still be sent by another request
+        assert open(new_path).read() == ''.join(tracks.csv_lines(ROWS))
+        cache._sweep(now=time.time() + cache.grace + 1)
+        assert not os.path.exists(path) and os.path.exists(new_path)
+        # A removed entry is built again
+        os.remove(new_path)
+        assert cache.get(1, 'csv') == new_path and os.path.exists(new_path)
+        assert cache.get(2, 'csv') is None
+        with pytest.raises(NotImplementedError):
+            cache.get(1, 'kml')
+
+    def test_size_bound(self, tmp_path):
+        (tmp_path / 'routes').mkdir()
+        storage = open_storage('files', str(tmp_path))
+        for route_id in (1, 2, 3):
+            storage.import_route({'route_id': route_id, 'user_id': 780870559455}, ROWS)
+        cache = TrackCache(storage, str(tmp_path / 'cache'), max_size=1, grace=0)
+        paths = [cache.get(route_id, 'csv') for route_id in (1, 2, 3)]
+        # Only the entry just built is kept
+        assert [os.path.exists(path) for path in paths] == [False, False, True]
+        assert cache.size == sum(os.path.getsize(paths[2] + suffix) for suffix in ('', '.gz'))
+        # The entries left by a previous run are listed
+        assert TrackCache(storage, str(tmp_path / 'cache')).get(3, 'csv') == paths[2]
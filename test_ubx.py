@@ -0,0 +1,80 @@
+import struct
+
+import pytest
+
+import ubx
+
+
+def nav_pvt(lat=44.424587, lon=26.053704, speed=12.5, fix_type=ubx.FIX_3D, flags=0x01, valid=0x07):
+    """Build a framed NAV-PVT message (speed in m/s)."""
+    payload = ubx._nav_pvt.pack(
+        1000, 2020, 2, 6, 13, 59, 13, valid, 25, 0,
+        fix_type, flags, 0, 9, round(lon * 1e7), round(lat * 1e7), 100000, 90000, 2500, 4000,
+        0, 0, 0, round(speed * 1000), 9000000, 360, 0, 150, 0, 0, 0, 0)
+    return ubx.message(*ubx.NAV_PVT, payload)
+
+
+def framed_payload(msg):
+    return msg[ubx.HEADER_SIZE:-2]
+
+
+class TestUBX:
+
+    def test_checksum(self):
+        # CFG-RATE 1 Hz from the u-blox protocol specification
+        assert ubx.cfg_rate(1) == bytes.fromhex('b562060806 00e803 0100 0100 0139'.replace(' ', ''))
+
+    def test_configure_nav_pvt(self):
+        messages = ubx.configure_nav_pvt(rate=5)
+        assert messages[0] == ubx.message(*ubx.CFG_RATE, struct.pack('<HHH', 200, 1, 1))
+        assert messages[1] == ubx.cfg_msg(0x01, 0x07, 1)
+        assert len(messages) == 2 + len(ubx.NMEA_MESSAGES)
+        assert len(ubx.configure_nav_pvt(rate=5, disable_nmea=False)) == 2
+
+    def test_parse_nav_pvt(self):
+        framer = ubx.Framer()
+        [(msg_class, msg_id, payload)] = framer.feed(nav_pvt())
+        assert (msg_class, msg_id) == ubx.NAV_PVT
+        pvt = ubx.parse_nav_pvt(payload)
+        assert pvt.timestamp == '2020-02-06T13:59:13Z'
+        assert pvt.lat == 44.424587
+        assert pvt.lon == 26.053704
+        assert pvt.speed == pytest.approx(45)
+        assert pvt.heading == pytest.approx(90)
+        assert pvt.fix_ok and pvt.fix_type == ubx.FIX_3D
+        assert pvt.satellites == 9
+        assert pvt.h_acc == 2.5
+
+    def test_invalid_time(self):
+        payload = framed_payload(nav_pvt(valid=0x00))
+        assert ubx.parse_nav_pvt(payload).timestamp is None
+
+    def test_invalid_payload(self):
+        with pytest.raises(ubx.UBXError):
+            ubx.parse_nav_pvt(b'\x00' * 10)
+
+    def test_framer_byte_by_byte(self):
+        framer = ubx.Framer()
+        stream = nav_pvt() * 3
+        messages = []
+        for i in range(len(stream)):
+            messages += framer.feed(stream[i:i + 1])
+        assert len(messages) == 3
+        assert framer.buffer == bytearray()
+
+    def test_framer_resync(self):
+        corrupted = bytearray(nav_pvt(lat=1))
+        corrupted[20] ^= 0xFF
+        stream = (b'$GPRMC,123519,A,4807.038,N*6A\r\n' + nav_pvt(lat=2) + bytes(corrupted)
+                  + b'\xb5' + nav_pvt(lat=3))
+        framer = ubx.Framer()
+        lats = [ubx.parse_nav_pvt(payload).lat for _, _, payload in framer.feed(stream)]
+        assert lats == [2, 3]
+        assert framer.bad_checksums == 1
+
+    def test_read_capture_file(self, tmp_path):
+        capture = tmp_path / 'capture.ubx'
+        capture.write_bytes(b''.join(nav_pvt(lat=45 + i * 1e-5) for i in range(1000)))
+        fixes = list(ubx.read_nav_pvt(capture))
+        assert len(fixes) == 1000
+        assert fixes[-1].lat == pytest.approx(45 + 999e-5)
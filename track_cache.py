@@ -0,0 +1,173 @@
+"""Cache of the route tracks served by the REST API.
+
+Each track is rendered once per format (CSV, GeoJSON or encoded polyline)
+from the storage (see storage.py) and kept in the cache folder next to
+its gzip compressed copy:
+
+    cache/route_<route_id>_<version>[_<level>].<format>[.gz]
+
+The level is the simplification of the track (see simplify.py), either
+a map zoom level (z<zoom>) or a tolerance in meters (t<tolerance>).
+
+The version is a hash of Storage.track_version, so a cached file never
+changes: a track that changed (eg. rewritten by route_tools.py) gets new
+cached files. This makes the ETag that Flask derives from the file
+(mtime, size and name) a strong validator of the track content.
+
+The files are never removed when they are built, as another request
+thread may be sending them. Instead, after each build, the entries of
+the older versions of the tracks and then the least recently used
+entries (while the cache is larger than max_size bytes) are removed,
+if they were not used in the last grace seconds. An entry removed
+(or missing) when it is requested is built again.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+
+import tracks
+
+
+# format -> (file extension, mimetype)
+FORMATS = {'csv': ('csv', 'text/csv'),
+           'geojson': ('geojson', 'application/geo+json'),
+           'polyline': ('polyline', 'text/plain')}
+
+
+def render(fmt, rows, properties=None):
+    """Return the text of a track in a format of FORMATS."""
+    if fmt == 'csv':
+        return ''.join(tracks.csv_lines(rows))
+    if fmt == 'geojson':
+        return json.dumps(tracks.geojson_feature(rows, properties))
+    if fmt == 'polyline':
+        return tracks.encode_polyline(rows)
+    raise NotImplementedError(f'Available track formats: {", ".join(FORMATS).upper()}')
+
+
+class TrackCache:
+
+    def __init__(self, storage, cache_dir, max_size=256 * 2 ** 20, grace=60.0):
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.entries = None  # path -> [route_id, version, size, last use], listed by the first sweep
+        self.versions = {}   # route_id -> last version requested
+        self.size = 0
+
+    def __repr__(self):
+        return f'TrackCache in {self.cache_dir}.'
+
+    def get(self, route_id, fmt='csv', compressed=False, tolerance=None, zoom=None):
+        """Return the path of the cached track of a route in a format of
+        FORMATS, gzip compressed or not, simplified for a map zoom level or
+        with a tolerance in meters (rounded to 0.1 m) or not simplified
+        (None if the route has no track)."""
+        if fmt not in FORMATS:
+            raise NotImplementedError(f'Available track formats: {", ".join(FORMATS).upper()}')
+        if zoom is not None:
+            from simplify import zoom_tolerance  # NumPy is only needed for the simplified tracks
+            zoom_tolerance(zoom, 0)  # check the zoom level
+            level = f'_z{zoom}'
+        elif tolerance is not None:
+            tolerance = round(tolerance, 1)
+            level = f'_t{tolerance:g}' if tolerance > 0 else ''
+        else:
+            level = ''
+        track_version = self.storage.track_version(route_id)
+        if track_version is None:
+            return None
+        version = hashlib.sha1(track_version.encode()).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f'route_{route_id}_{version}{level}.{FORMATS[fmt][0]}')
+        with self.lock:
+            if self.entries is None:
+                self._list_entries()
+            self.versions[route_id] = version
+            built = not (os.path.isfile(path) and os.path.isfile(path + '.gz'))
+            if built:
+                if path in self.entries:
+                    self.size -= self.entries.pop(path)[2]  # partly removed, sized again once built
+                self._build(route_id, version, fmt, path, tolerance, zoom)
+            self._use(path, route_id, version)
+            if built:
+                self._sweep(keep=path)
+        return path + '.gz' if compressed else path
+
+    def _list_entries(self):
+        """Index the entries left in the cache folder (eg. by a previous run),
+        last used at their modification time."""
+        self.entries, self.size = {}, 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            parts = name.split('_')
+            if name.endswith('.gz') and len(parts) >= 3 and parts[0] == 'route' and parts[1].isdigit():
+                path = os.path.join(self.cache_dir, name[:-len('.gz')])
+                self._use(path, int(parts[1]), parts[2].split('.')[0], os.stat(path + '.gz').st_mtime)
+
+    def _use(self, path, route_id, version, now=None):
+        entry = self.entries.get(path)
+        if entry is None:
+            size = 0
+            for name in (path, path + '.gz'):
+                try:
+                    size += os.path.getsize(name)
+                except FileNotFoundError:
+                    pass
+            entry = self.entries[path] = [route_id, version, size, 0]
+            self.size += size
+        entry[3] = time.time() if now is None else now
+
+    def _sweep(self, now=None, keep=None):
+        """Remove the entries of the older versions of the tracks, then the
+        least recently used entries while the cache is larger than max_size,
+        skipping the entries used in the last grace seconds (and keep, the
+        entry about to be sent)."""
+        deadline = (time.time() if now is None else now) - self.grace
+        idle = sorted((entry[3], path) for path, entry in self.entries.items()
+                      if entry[3] < deadline and path != keep)
+        for last_use, path in idle:
+            route_id, version = self.entries[path][:2]
+            if version != self.versions.get(route_id, version):
+                self._remove(path)
+        for last_use, path in idle:
+            if self.size <= self.max_size:
+                break
+            if path in self.entries:
+                self._remove(path)
+
+    def _remove(self, path):
+        for name in (path, path + '.gz'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+        self.size -= self.entries.pop(path)[2]
+
+    def _build(self, route_id, version, fmt, path, tolerance=None, zoom=None):
+        """Render the track and its gzip copy (atomically, the .gz file is written
+        last as it marks a complete entry)."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        rows = self.storage.iter_points(route_id)
+        if zoom is not None:
+            from simplify import zoom_tolerance
+            rows = list(rows)
+            tolerance = zoom_tolerance(zoom, rows[0][1]) if rows else 0
+        if tolerance:
+            from simplify import simplify
+            rows = simplify(rows, tolerance)
+        data = render(fmt, rows, {'route_id': route_id}).encode()
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+        with gzip.open(path + '.gz.tmp', 'wb', compresslevel=6) as file:
+            file.write(data)
+        os.replace(path + '.gz.tmp', path + '.gz')
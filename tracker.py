@@ -4,7 +4,6 @@ import os
 import csv
 import serial
 import time
-import json
 import glob
 import subprocess
 import logging
@@ -12,7 +11,6 @@ import threading
 import queue
 import termios
 
-from geopy.distance import geodesic
 from serial.tools import list_ports
 from mfrc522 import SimpleMFRC522
 
@@ -20,12 +18,16 @@ from mfrc522 import SimpleMFRC522
 from lcd_functions import Lcd
 from buzzer_functions import Buzzer
 
-# From current directory (languages.py)
+# From current directory (languages.py, distance.py, storage.py and cards.py)
 import languages
+import distance
+from storage import FileStorage
+from cards import CardStore
 
 
 supported_languages = {'en': 'English', 'ro': 'Romanian', 'hu': 'Hungarian'}
 LANGUAGE = 'ro'
+DISTANCE_BACKEND = 'enu'  # enu, haversine or geodesic (see distance.py)
 
 # Language select
 if supported_languages[LANGUAGE] == 'Romanian':
@@ -73,14 +75,15 @@ def read_card(event, out_queue):
 
 
 # Variables initialization
+calculate_distance = distance.get_backend(DISTANCE_BACKEND)
 gps_logs_folder = BASE_DIR + 'logs/gps_logs/'
+storage = FileStorage(gps_logs_folder)
 journey_state = False
 system_time_set = False
 last_two_coordinates = []
 total_distance = 0
 route = {}
-# TODO: to replace with actual card ID's stored in a postgresql database
-card_db = ['780870559455', '142189814135']
+card_db = CardStore(BASE_DIR + 'cards.csv')  # authorized cards, reloaded when the file changes
 lcd = Lcd()
 buzzer = Buzzer()
 
@@ -158,7 +161,7 @@ while True:  # to run even if a port disconnect error is raised
                             last_two_coordinates.clear()  # clear list when not in journey
 
                         if len(last_two_coordinates) == 2:
-                            delta_distance = geodesic(last_two_coordinates[0], last_two_coordinates[1]).m
+                            delta_distance = calculate_distance(last_two_coordinates[0], last_two_coordinates[1])
                             # if we are moving (dd>1m) we add to total distance and remove first coord
                             if delta_distance > 1:
                                 total_distance = round(total_distance + delta_distance, 2)
@@ -196,17 +199,10 @@ while True:  # to run even if a port disconnect error is raised
 
                         else:
                             # Making sure the System is Fail Proof on Power Outage
-                            try:
-                                with open(gps_logs_folder + 'routes.log', 'r') as global_routelog:
-                                    last_routelog = global_routelog.readlines()[-1].strip()
-                                    last_route_id = json.loads(last_routelog)['route_id']
-                                    route_id = last_route_id + 1
-                            except FileNotFoundError:
-                                route_id = 1
-                            finally:
-                                route.update({'route_id': route_id})
-                                # TODO: remove following print
-                                print('Current route ID: {}'.format(route_id))
+                            route_id = storage.last_route_id() + 1
+                            route.update({'route_id': route_id})
+                            # TODO: remove following print
+                            print('Current route ID: {}'.format(route_id))
 
                             if route_id in [int(_.split('_')[1]) for _ in os.listdir(gps_logs_folder + 'routes/')]:
                                 # TODO: remove following print
@@ -300,10 +296,7 @@ while True:  # to run even if a port disconnect error is raised
                                         total_distance = 0  # resetting total distance at end of journey
 
                                         # Creating Global Routes Logging File
-                                        with open(gps_logs_folder + 'routes.log', 'a') as global_routelog:
-                                            global_routelog.write(json.dumps(route) + '\n')
-                                            global_routelog.flush()
-                                            os.fsync(global_routelog)
+                                        storage.add_route(route)
                                     else:
                                         # TODO: ring buzzer and flash RED LED to
                                         #  indicate invalid card read for end of journey
@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
 
-import os
-import csv
-import glob
-import json
+import sys
 import time
 import queue
+import signal
 import logging
 import threading
 import subprocess
 from collections import deque
 
-import serial
-from serial.tools import list_ports
-from geopy.distance import geodesic
 from mfrc522 import SimpleMFRC522
 
+import ubx
+import nmea
+import distance
 from lcd_functions import LCD
+from gps_functions import GPSReader
+from cards import CardStore
+from storage import open_storage
+from spatial import SpatialIndex
+from geofences import GeofenceIndex, GeofenceMonitor, load_geofences
+from live_feed import Publisher, LIVE_FEED_PATH
 from buzzer_functions import Buzzer
 from languages import English, Romanian, Hungarian
 
@@ -34,11 +38,12 @@ class UnexpectedShutdownMixin:
 class SignalingMixin:
     start_signal = threading.Event()
     stop_signal = threading.Event()
+    auto_stop = threading.Event()  # the route was ended by a geofence
 
 
 class IDQueueMixin:
     id_queue = queue.Queue()
-    id_database = [780870559455, 142189814135]
+    cards = CardStore('/home/pi/trackman/GPS-Tracker/cards.csv')  # reloaded when it changes
 
 
 class DataQueueMixin:
@@ -89,7 +94,12 @@ class RFID(threading.Thread,
                     id_list.append(self.id_queue.get())
                     self.unexpected_shutdown.clear()
                 else:
-                    id_list.append(self.reader.read_id())  # blocking
+                    card_id = self.reader.read_id()  # blocking
+                    if self.auto_stop.is_set():
+                        # The route of the start card was ended by a geofence
+                        id_list.clear()
+                        self.auto_stop.clear()
+                    id_list.append(card_id)
                     logger.info(f'RC522 Card Read. ID: {id_list[0]}.')
                     if len(id_list) == 1:
                         print('Start Route')  # TODO: remove
@@ -97,7 +107,7 @@ class RFID(threading.Thread,
                         logger.info('Route started.')
                         self.id_queue.put(id_list[0])
                         self.start_signal.set()
-                    if not all([_id in self.id_database for _id in id_list]):
+                    if not all(_id in self.cards for _id in id_list):
                         invalid_card_id = id_list.pop()
                         print('Invalid Card')  # TODO: remove
                         self.ui_event_invalid_card.set()
@@ -124,35 +134,77 @@ class GPS(threading.Thread,
     """
     ublox_vid = '1546'
 
-    def __init__(self):
+    def __init__(self, protocol='nmea', rate=1):
         threading.Thread.__init__(self)
+        if protocol.lower() not in ('nmea', 'ubx'):
+            raise NotImplementedError('Available GPS protocols: NMEA, UBX')
+        self.protocol = protocol.lower()
+        self.rate = rate
+        self.reader = GPSReader(self.ublox_vid)
+        self.framer = ubx.Framer()
+        if self.protocol == 'ubx':
+            self.reader.on_connect = self.configure_ubx
 
     def run(self):
+        read_gps_data = self.read_ubx if self.protocol == 'ubx' else self.read_nmea
         while not self.shutdown.is_set():
             try:
-                with serial.Serial(self.get_gps_port(self.ublox_vid)) as ser:
-                    raw_data = ser.readline()
-                    if raw_data[3:6] == b'RMC':
-                        self.data_queue.put(self.extract_parameters(raw_data))
-                        if self.data_queue.full():
-                            self.data_queue.get()
+                gps_data = read_gps_data()
             except IOError:
+                self.reader.fail()
                 print('GPS signal not found.')  # TODO: remove
-                logger.warning('GPS signal not found. Waiting for GPS signal...')
+                logger.warning('GPS signal not found. Waiting for GPS signal... '
+                               f'Reader stats: {self.reader.stats()}')
                 self.ui_event_not_found_gps.set()
-                time.sleep(1)
+                self.shutdown.wait(self.reader.backoff)
             else:
                 self.ui_event_not_found_gps.clear()
+                for data in gps_data:
+                    self.data_queue.put(data)
+                    if self.data_queue.full():
+                        self.data_queue.get()
+                        self.reader.dropped_lines += 1
+        self.reader.close()
+
+    def read_nmea(self):
+        """Return the GPS data of the next RMC sentence (as a list)."""
+        raw_data = self.reader.readline()
+        if raw_data is None or raw_data[3:6] != b'RMC':
+            return []
+        try:
+            return [self.extract_parameters(raw_data)]
+        except nmea.ChecksumError:
+            self.reader.dropped_lines += 1
+            return []
+
+    def read_ubx(self):
+        """Return the GPS data of the NAV-PVT messages received so far."""
+        gps_data = []
+        for msg_class, msg_id, payload in self.framer.feed(self.reader.read()):
+            if (msg_class, msg_id) == ubx.NAV_PVT:
+                try:
+                    gps_data.append(self.extract_pvt_parameters(payload))
+                except ubx.UBXError:
+                    self.reader.dropped_lines += 1
+        return gps_data
+
+    def configure_ubx(self, reader):
+        """Switch the receiver to NAV-PVT output at the configured rate.
+        Called by the reader every time the serial port is (re)opened."""
+        self.framer.buffer.clear()
+        for msg in ubx.configure_nav_pvt(self.rate):
+            reader.serial.write(msg)
+        logger.info(f'GPS configured for UBX NAV-PVT output at {self.rate} Hz.')
 
     def extract_parameters(self, data):
-        """Extract the timestamp, latitude and longitude out of a RMC NMEA bytes object."""
-        data = str(data).split(',')
+        """Extract the timestamp, latitude and longitude out of a RMC NMEA bytes object.
+
+        Raises nmea.ChecksumError for corrupted sentences.
+        """
         try:
-            lat = round(float(data[3][:2]) + float(data[3][2:]) / 60, 6)
-            lon = round(float(data[5][:3]) + float(data[5][3:]) / 60, 6)
-            _date = data[9][4:6] + '-' + data[9][2:4] + '-' + data[9][:2]
-            _time = data[1][:2] + ':' + data[1][2:4] + ':' + data[1][4:6]
-            timestamp = '20' + _date + 'T' + _time + 'Z'
+            timestamp, lat, lon = nmea.parse_rmc(data)[:3]
+        except nmea.ChecksumError:
+            raise
         except ValueError:
             print('Waiting for GPS signal...')  # TODO: remove
             logger.warning('Weak GPS signal! Waiting for stronger signal...')
@@ -161,13 +213,20 @@ class GPS(threading.Thread,
             self.ui_event_weak_gps.clear()
             return timestamp, lat, lon
 
+    def extract_pvt_parameters(self, payload):
+        """Extract the timestamp, latitude and longitude out of a UBX NAV-PVT payload."""
+        pvt = ubx.parse_nav_pvt(payload)
+        if not pvt.fix_ok or pvt.timestamp is None:
+            logger.warning('Weak GPS signal! Waiting for stronger signal...')
+            self.ui_event_weak_gps.set()
+        else:
+            self.ui_event_weak_gps.clear()
+            return pvt.timestamp, pvt.lat, pvt.lon
+
     @staticmethod
     def get_gps_port(vid):
         """Return the serial port name of the GPS sensor with the specified vendor ID."""
-        comports = [port for port in list_ports.comports()]
-        for port in comports:
-            if vid in port.hwid:
-                return port.device
+        return GPSReader.get_gps_port(vid)
 
 
 class UserInterface(threading.Thread,
@@ -279,8 +338,24 @@ class Journey(ShutdownMixin,
     gps_buffer = deque(maxlen=2)
     root_dir = '/home/pi/trackman/GPS-Tracker/'
     gps_logs_dir = root_dir + 'logs/gps_logs/'
-
-    def __init__(self):
+    geofences_path = root_dir + 'geofences.json'
+
+    def __init__(self, distance_backend='enu', storage='files', track_format='csv',
+                 sync_rows=10, sync_interval=5.0, compact_tolerance=None, live_feed=LIVE_FEED_PATH,
+                 geofence_confirm_fixes=3):
+        self.distance = distance.get_backend(distance_backend)
+        self.storage = open_storage(storage, self.gps_logs_dir, track_format)
+        self.spatial_index = SpatialIndex(self.gps_logs_dir, self.storage)
+        self.live_feed = Publisher(live_feed) if live_feed else None
+        zones = load_geofences(self.geofences_path)
+        self.geofences = GeofenceMonitor(GeofenceIndex(zones), geofence_confirm_fixes) if zones else None
+        self.geofence_events = []
+        self.split_route = False
+        self.sync_rows = sync_rows
+        self.sync_interval = sync_interval
+        self.compact_tolerance = compact_tolerance
+        self.route_writer = None
+        self.open_route = None
         self.user_id = None
         self.route_id = None
         self.total_distance = 0
@@ -308,13 +383,15 @@ class Journey(ShutdownMixin,
                 self.gps_buffer.append(self.data_queue.get())
                 print(self.gps_buffer)
                 self.timestamp_start, self.lat_start, self.lon_start = self.gps_buffer[0]
+                self.timestamp, self.lat, self.lon = self.gps_buffer[0]
+                self._log_as_csv()
+            self._reset_geofences()
 
             while not self.stop_signal.is_set():
                 self.gps_buffer.append(self.data_queue.get())
                 print(self.gps_buffer)
                 if not self.ui_event_weak_gps.is_set():
                     self.timestamp, self.lat, self.lon = self.gps_buffer[1]
-                    self._log_as_csv()
                     try:
                         gps_data = [data[1:] for data in self.gps_buffer]
                     except TypeError:
@@ -323,31 +400,62 @@ class Journey(ShutdownMixin,
                         self.total_distance = self.calculate_distance(gps_data, self.total_distance)
                         self.ui_event_enroute.set()
                         print('Distance: ', self.total_distance)
+                    self._log_as_csv()
+                    self._check_geofences()
             else:
                 self.ui_event_enroute.clear()
                 self.gps_buffer.append(self.data_queue.get())
                 self.timestamp_stop, self.lat_stop, self.lon_stop = self.gps_buffer[1]
 
-                self._route_to_json()
+                self.close_route_log()
+                compacted = self._compact_route_log() if self.compact_tolerance else False
+                self._route_to_json(compacted)
+                self.storage.clear_checkpoint()
 
                 # Cleanup
+                self.open_route = None
                 self.gps_buffer.clear()
                 self.total_distance = 0
                 self.route_id = None
+                self.geofence_events = []
                 self.start_signal.clear()
                 self.stop_signal.clear()
+                if self.split_route:
+                    # A new route of the same user starts at the next fix
+                    self.split_route = False
+                    self.id_queue.put(self.user_id)
+                    self.ui_event_start_route.set()
+                    self.start_signal.set()
+
+    def _reset_geofences(self):
+        """The zones of the first (or resumed) fix of the route are not entered."""
+        if self.geofences is not None and self.gps_buffer and self.gps_buffer[-1] is not None:
+            self.geofences.reset(*self.gps_buffer[-1][1:3])
+
+    def _check_geofences(self):
+        """Record the geofence events of the fix and end (or split) the
+        route on the events configured so (see geofences.py). The RFID
+        thread is told that the route of the start card was ended."""
+        if self.geofences is None:
+            return
+        for zone, event in self.geofences.update(self.lat, self.lon):
+            action = zone.action(event)
+            if action is None:
+                continue
+            logger.info(f'Geofence {zone.name}: {event} ({action}).')
+            self.geofence_events.append({'zone': zone.name, 'event': event,
+                                         'action': action, 'timestamp': self.timestamp})
+            if action in ('stop', 'split') and not self.stop_signal.is_set():
+                self.split_route = action == 'split'
+                if not self.split_route:
+                    self.auto_stop.set()
+                self.ui_event_stop_route.set()
+                self.stop_signal.set()
 
     def _init_route_id(self):
-        """Check for the last route ID from the routes
-        log file and initializes the new route ID."""
-        try:
-            with open(self.gps_logs_dir + 'routes.log', 'r') as routes_log:
-                last_log = routes_log.readlines()[-1].strip()
-                last_route_id = json.loads(last_log)['route_id']
-                route_id = last_route_id + 1
-        except FileNotFoundError:
-            route_id = 1
-        return route_id
+        """Check for the last logged route ID in the
+        storage and initializes the new route ID."""
+        return self.storage.last_route_id() + 1
 
     def _gps_time_update(self):
         while not self.ui_event_time_set.is_set():
@@ -370,57 +478,78 @@ class Journey(ShutdownMixin,
         unexpected system shutdown had occur.
 
         CSV Log Format: timestamp,latitude,longitude,distance
+        (or the binary format of tracks.py if track_format is 'trk',
+        or the points table of the 'sqlite' storage)
+
+        The log is kept open for the whole route and the rows are
+        committed to the SD card in groups (see storage.RouteWriter).
+
+        The first row is the start of the route and the distance
+        of each row includes the segment ending at that row.
+
+        The route checkpoint is saved when the log is opened and
+        after every commit of the log, including the commits of the
+        flusher thread of the writer (see storage.Storage).
         """
-        route_filename = f'routes/route_{self.route_id}_{self.user_id}.csv'
-        route_log_exists = os.path.isfile(self.gps_logs_dir + route_filename)
-        with open(self.gps_logs_dir + route_filename, 'a') as route_log:
-            headers = ['Timestamp', 'Latitude', 'Longitude', 'Total_Distance']
-            writer = csv.DictWriter(route_log, delimiter=',',
-                                    lineterminator='\n',
-                                    fieldnames=headers)
-            if not route_log_exists:
-                writer.writeheader()
-            writer.writerow({
-                'Timestamp': self.timestamp,
-                'Latitude':  self.lat,
-                'Longitude': self.lon,
-                'Total_Distance': self.total_distance,
-            })
-            route_log.flush()
-            os.fsync(route_log)
+        if self.route_writer is None:
+            self.route_writer = self.storage.route_writer(self.route_id, self.user_id,
+                                                          sync_rows=self.sync_rows,
+                                                          sync_interval=self.sync_interval,
+                                                          on_commit=self._save_checkpoint)
+            self._save_checkpoint()
+        self.route_writer.write(self.timestamp, self.lat, self.lon, self.total_distance)
+        self._publish_fix()
+
+    def _publish_fix(self):
+        """Publish the fix to the live feed (see live_feed.py). The feed
+        never blocks and its errors never stop the route log."""
+        if self.live_feed is None:
+            return
+        try:
+            self.live_feed.publish(self.route_id, self.user_id, self.timestamp,
+                                   self.lat, self.lon, self.total_distance)
+        except Exception as err:
+            logger.warning(f'Live feed: {err}')
+
+    def _save_checkpoint(self, last_row=None):
+        """Save the checkpoint of the route with its last committed row
+        (the current fix if None)."""
+        if last_row is None:
+            last_row = (self.timestamp, self.lat, self.lon, self.total_distance)
+        self.storage.save_checkpoint(self.route_id, self.user_id,
+                                     (self.timestamp_start, self.lat_start, self.lon_start), last_row)
+
+    def close_route_log(self):
+        """Commit the buffered rows of the route log and close it."""
+        if self.route_writer is not None:
+            self.route_writer.close()
+            logger.info(f'Route log closed. Writer stats: {self.route_writer.stats()}')
+            self.route_writer = None
 
     def _check_unexpected_shutdown(self):
-        """If the current route ID appears in the name of a file inside
-        the routes folder that means an unexpected shutdown had occur.
+        """If the route checkpoint holds the current route ID (or, without
+        a checkpoint, the current route ID already has a track) that means
+        an unexpected shutdown had occur.
         """
-        routes_dir = self.gps_logs_dir + 'routes/'
-        if self.route_id in [int(_.split('_')[1]) for _ in os.listdir(routes_dir)]:
-            return True
-        else:
-            return False
+        self.open_route = self.storage.find_open_route(self.route_id)
+        return self.open_route is not None
 
     def _fix_unexpected_shutdown(self):
-        """Grab the route parameters from the last logged route."""
+        """Grab the route parameters from the route checkpoint
+        (and the last point of the route log)."""
         self.unexpected_shutdown.set()
-        routes_dir = self.gps_logs_dir + 'routes/'
-        self.user_id = int(os.path.basename(
-            glob.glob(routes_dir + f'route_{self.route_id}_*')[0]) \
-            .split('_')[-1].split('.')[0])
+        self.user_id = self.open_route['user_id']
         self.id_queue.put(self.user_id)
-        with open(routes_dir + f'route_{self.route_id}_{self.user_id}.csv') as file:
-            lines = file.read().splitlines()
-            self.total_distance = float(lines[-1].split(',')[-1])
-            self.timestamp_start = lines[1].split(',')[0]
-            self.lat_start = float(lines[1].split(',')[1])
-            self.lon_start = float(lines[1].split(',')[2])
-
-            self.gps_buffer.append([self.timestamp_start,
-                                    float(lines[-1].split(',')[1]),
-                                    float(lines[-1].split(',')[2])
-                                    ])
-
-    def _route_to_json(self):
-        """Create a JSON route log and save it to routes.log."""
+        first_row, last_row = self.open_route['first_row'], self.open_route['last_row']
+        self.timestamp_start, self.lat_start, self.lon_start = first_row[:3]
+        self.total_distance = last_row[3]
+        self.gps_buffer.append(last_row[:3])
+
+    def _route_to_json(self, compacted=False):
+        """Create a JSON route log and save it to the storage (routes.log),
+        with the bounding box of the route track. The track is indexed
+        first (see spatial.py), so a logged route can be found by area.
+        A compacted track is marked with the compaction tolerance."""
         route = {'route_id':        self.route_id,
                  'user_id':         self.user_id,
                  'timestamp_start': self.timestamp_start,
@@ -431,10 +560,27 @@ class Journey(ShutdownMixin,
                  'lon_stop':        self.lon_stop,
                  'distance':        self.total_distance
                  }
-        with open(self.gps_logs_dir + 'routes.log', 'a') as routes_log:
-            routes_log.write(json.dumps(route) + '\n')
-            routes_log.flush()
-            os.fsync(routes_log)
+        if self.geofence_events:
+            route['geofence_events'] = self.geofence_events
+        if compacted:
+            route['compacted'] = self.compact_tolerance
+        bbox = self.spatial_index.add_route(self.route_id, self.storage.iter_points(self.route_id))
+        if bbox is not None:
+            route['bbox'] = bbox
+        self.storage.add_route(route)
+
+    def _compact_route_log(self):
+        """Simplify the finished route log (see simplify.py), keeping
+        the points farther than compact_tolerance meters from the
+        simplified route. Return True if points were removed.
+
+        The route is compacted before it is indexed and logged, so the
+        spatial index and the bounding box are those of the stored track.
+        The kept points keep their Total_Distance (the distance of the
+        full track), which route_tools.py trusts for compacted routes."""
+        before, after = self.storage.compact_track(self.route_id, self.compact_tolerance)
+        logger.info(f'Route {self.route_id} compacted from {before} to {after} points.')
+        return after < before
 
     def calculate_distance(self, gps_data, total_distance):
         """Return the distance traveled in the current journey.
@@ -445,7 +591,7 @@ class Journey(ShutdownMixin,
             total_distance  --  previously calculated travel distance (in meters)
         """
         if len(gps_data) == 2:
-            d_dist = geodesic(gps_data[0], gps_data[1]).m
+            d_dist = self.distance(gps_data[0], gps_data[1])
             if d_dist > 1:
                 total_distance = round(total_distance + d_dist, 2)
                 del gps_data[0]
@@ -475,10 +621,17 @@ if __name__ == '__main__':
     rfid = RFID()
     journey = Journey()
 
+    # Commit the route log before exiting on SIGTERM (eg. system shutdown)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     rfid.start()
     read.start()
     ui.start()
-    while not journey.shutdown.is_set():
-        journey.run()
+    try:
+        while not journey.shutdown.is_set():
+            journey.run()
+    finally:
+        journey.close_route_log()
+        journey.shutdown.set()
     read.join()
     rfid.join()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Compact binary route track format (.trk) and converters.
+
+File layout (little endian):
+    header  --  magic b'GPSTRK', format version (u8), record size (u8),
+                8 reserved bytes
+    records --  fixed-size records of:
+                    timestamp       u32  seconds since the Unix epoch (UTC)
+                    latitude        i32  microdegrees
+                    longitude       i32  microdegrees
+                    total distance  u32  centimeters
+
+A record takes 16 bytes instead of the ~50 bytes of a CSV row and keeps
+the 6 decimals precision of the CSV coordinates. The file is append-only:
+a record cut by a power loss is ignored by the readers and truncated by
+the writer before appending, so the file never needs to be parsed to be
+recovered.
+
+Usage:
+    python3 tracks.py to-csv     <route.trk> [<route.csv>]
+    python3 tracks.py to-geojson <route.trk> [<route.geojson>]
+    python3 tracks.py from-csv   <route.csv> [<route.trk>]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import struct
+import calendar
+import argparse
+
+
+MAGIC = b'GPSTRK'
+VERSION = 1
+HEADER = struct.Struct('<6sBB8x')
+RECORD = struct.Struct('<IiiI')
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+CSV_HEADER = 'Timestamp,Latitude,Longitude,Total_Distance'
+
+
+class TrackFormatError(ValueError):
+    """Raised for files that are not binary route tracks."""
+
+
+def to_epoch(timestamp):
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def to_timestamp(epoch):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+
+def pack(timestamp, lat, lon, total_distance):
+    """Return the binary record of a GPS fix."""
+    return RECORD.pack(to_epoch(timestamp), round(lat * 1e6), round(lon * 1e6),
+                       round(total_distance * 100))
+
+
+def unpack(record):
+    """Return the (timestamp, lat, lon, total_distance) of a binary record."""
+    epoch, lat, lon, total_distance = record
+    return to_timestamp(epoch), lat / 1e6, lon / 1e6, total_distance / 100
+
+
+def check_header(data, path):
+    if len(data) < HEADER.size:
+        raise TrackFormatError(f'{path}: truncated header.')
+    magic, version, record_size = HEADER.unpack_from(data)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise TrackFormatError(f'{path}: not a binary route track.')
+    if version != VERSION:
+        raise TrackFormatError(f'{path}: unsupported track format version {version}.')
+
+
+def read_records(path):
+    """Return the raw (epoch, lat_e6, lon_e6, distance_cm) records of a track.
+    The whole file is unpacked at once, a trailing partial record is ignored."""
+    with open(path, 'rb') as file:
+        return unpack_records(file.read(), path)
+
+
+def unpack_records(data, path):
+    """Return the raw records of a track held in memory."""
+    check_header(data, path)
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    return list(RECORD.iter_unpack(memoryview(data)[HEADER.size:end]))
+
+
+def _csv_rows(file):
+    next(file, None)
+    for line in file:
+        fields = line.rstrip('\n').split(',')
+        if len(fields) != 4 or not line.endswith('\n'):
+            break  # row cut by a power loss
+        yield fields[0], float(fields[1]), float(fields[2]), float(fields[3])
+
+
+def iter_rows(path):
+    """Yield the (timestamp, lat, lon, total_distance) rows of a binary (.trk) or CSV track."""
+    if path.endswith('.trk'):
+        for record in read_records(path):
+            yield unpack(record)
+    else:
+        with open(path) as file:
+            yield from _csv_rows(file)
+
+
+def iter_rows_from_bytes(data, name):
+    """Yield the rows of a track held in memory (eg. read from an archive),
+    the format is given by the extension of its name."""
+    if name.endswith('.trk'):
+        for record in unpack_records(data, name):
+            yield unpack(record)
+    else:
+        yield from _csv_rows(io.StringIO(data.decode()))
+
+
+def read_last_line(path, chunk_size=4096):
+    """Return the last complete (newline terminated) line of a file and
+    the offset where it ends, reading backwards from the end of the file.
+    Return (None, 0) if the file holds no complete line."""
+    with open(path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0:
+            step = min(chunk_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+            end = data.rfind(b'\n')
+            if end < 0:
+                continue
+            start = data.rfind(b'\n', 0, end)
+            if start >= 0 or position == 0:
+                return data[start + 1:end + 1], position + end + 1
+        return None, 0
+
+
+def first_and_last_rows(path):
+    """Return the first and the last row of a binary or CSV track
+    (reading only the beginning and the end of the file)."""
+    if path.endswith('.trk'):
+        with open(path, 'rb') as file:
+            check_header(file.read(HEADER.size), path)
+            count = (file.seek(0, os.SEEK_END) - HEADER.size) // RECORD.size
+            if not count:
+                return None, None
+            file.seek(HEADER.size)
+            first = unpack(RECORD.unpack(file.read(RECORD.size)))
+            file.seek(HEADER.size + (count - 1) * RECORD.size)
+            last = unpack(RECORD.unpack(file.read(RECORD.size)))
+        return first, last
+    first = next(iter_rows(path), None)
+    if first is None:
+        return None, None
+    fields = read_last_line(path)[0].decode().rstrip('\n').split(',')
+    return first, (fields[0], float(fields[1]), float(fields[2]), float(fields[3]))
+
+
+def csv_lines(rows):
+    """Yield the lines of the CSV track of the rows (header included)."""
+    yield CSV_HEADER + '\n'
+    for timestamp, lat, lon, total_distance in rows:
+        yield f'{timestamp},{lat},{lon},{total_distance}\n'
+
+
+def geojson_feature(rows, properties=None):
+    """Return the GeoJSON LineString feature of the rows, the fix
+    timestamps are kept in the 'times' property."""
+    rows = list(rows)
+    return {'type': 'Feature',
+            'geometry': {'type': 'LineString',
+                         'coordinates': [[lon, lat] for _, lat, lon, _ in rows]},
+            'properties': dict(properties or {},
+                               times=[row[0] for row in rows],
+                               distance=rows[-1][3] if rows else 0)}
+
+
+def encode_polyline(rows, precision=5):
+    """Return the rows coordinates in the Encoded Polyline Algorithm Format
+    (the format of the Google Maps and OSRM APIs)."""
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lon = 0
+    for _, lat, lon, _ in rows:
+        lat, lon = round(lat * factor), round(lon * factor)
+        for delta in (lat - previous_lat, lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lon = lat, lon
+    return ''.join(chunks)
+
+
+def write_rows(path, rows, binary=None):
+    """Write the rows to a new track, binary or CSV (by default
+    by the extension of the path, binary for .trk)."""
+    if binary is None:
+        binary = path.endswith('.trk')
+    if binary:
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            for row in rows:
+                file.write(pack(*row))
+    else:
+        with open(path, 'w') as file:
+            file.writelines(csv_lines(rows))
+
+
+def to_csv(src, dst):
+    with open(dst, 'w') as file:
+        file.writelines(csv_lines(iter_rows(src)))
+
+
+def to_geojson(src, dst, properties=None):
+    """Convert a track to a GeoJSON LineString feature."""
+    with open(dst, 'w') as file:
+        json.dump(geojson_feature(iter_rows(src), properties), file)
+
+
+def from_csv(src, dst):
+    write_rows(dst, iter_rows(src))
+
+
+def main(argv=None):
+    converters = {'to-csv': (to_csv, '.csv'),
+                  'to-geojson': (to_geojson, '.geojson'),
+                  'from-csv': (from_csv, '.trk')}
+    parser = argparse.ArgumentParser(description='Convert route tracks.')
+    parser.add_argument('command', choices=list(converters))
+    parser.add_argument('src')
+    parser.add_argument('dst', nargs='?')
+    args = parser.parse_args(argv)
+    converter, extension = converters[args.command]
+    converter(args.src, args.dst or os.path.splitext(args.src)[0] + extension)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
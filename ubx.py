@@ -0,0 +1,184 @@
+"""u-blox UBX binary protocol: configuration messages, an incremental
+framer for the raw serial byte stream and the NAV-PVT decoder.
+
+A NAV-PVT message (100 bytes framed) carries the position, velocity,
+accuracy estimates and UTC time of one navigation epoch as integers,
+so no text has to be split or converted to float.
+"""
+
+import struct
+from collections import namedtuple
+
+
+SYNC = b'\xb5\x62'
+HEADER_SIZE = 6  # sync chars, class, id and payload length
+MAX_PAYLOAD = 1024
+
+NAV_PVT = (0x01, 0x07)
+CFG_MSG = (0x06, 0x01)
+CFG_RATE = (0x06, 0x08)
+ACK_ACK = (0x05, 0x01)
+ACK_NAK = (0x05, 0x00)
+
+# Standard NMEA messages (class 0xF0): GGA, GLL, GSA, GSV, RMC, VTG
+NMEA_MESSAGES = [(0xF0, _id) for _id in range(6)]
+
+# Fix types of the NAV-PVT message
+NO_FIX, DEAD_RECKONING, FIX_2D, FIX_3D, GNSS_DEAD_RECKONING, TIME_ONLY = range(6)
+
+PVT = namedtuple('PVT', 'timestamp lat lon speed heading fix_type fix_ok '
+                        'satellites h_acc s_acc')
+
+_nav_pvt = struct.Struct('<IHBBBBBBIiBBBBiiiiIIiiiiiIIHB5xihH')
+
+
+class UBXError(ValueError):
+    """Raised for malformed UBX messages."""
+
+
+def checksum(data):
+    """Return the 8-bit Fletcher checksum (CK_A, CK_B) of data
+    (message class, ID, length and payload)."""
+    ck_a = ck_b = 0
+    for byte in data:
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return bytes((ck_a, ck_b))
+
+
+def message(msg_class, msg_id, payload=b''):
+    """Return a framed UBX message."""
+    body = struct.pack('<BBH', msg_class, msg_id, len(payload)) + payload
+    return SYNC + body + checksum(body)
+
+
+def cfg_rate(rate):
+    """Return a CFG-RATE message setting the navigation rate (in Hz)."""
+    return message(*CFG_RATE, struct.pack('<HHH', round(1000 / rate), 1, 1))
+
+
+def cfg_msg(msg_class, msg_id, rate):
+    """Return a CFG-MSG message setting the output rate of a message on
+    the current port (rate 1 - every navigation epoch, 0 - disabled)."""
+    return message(*CFG_MSG, struct.pack('<BBB', msg_class, msg_id, rate))
+
+
+def configure_nav_pvt(rate=1, disable_nmea=True):
+    """Return the list of messages that switch the receiver
+    to NAV-PVT output at the specified rate (in Hz)."""
+    messages = [cfg_rate(rate), cfg_msg(*NAV_PVT, 1)]
+    if disable_nmea:
+        messages += [cfg_msg(*nmea_message, 0) for nmea_message in NMEA_MESSAGES]
+    return messages
+
+
+class Framer:
+    """Incremental UBX framer.
+
+    Bytes are fed as they are read from the serial port (in chunks of any
+    size) and complete messages are returned as (class, id, payload) tuples.
+    Bytes outside of UBX frames (eg. interleaved NMEA text) are skipped
+    and frames with a bad checksum are dropped.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.messages = 0
+        self.skipped_bytes = 0
+        self.bad_checksums = 0
+
+    def feed(self, data):
+        """Add data to the buffer and return the list of complete messages."""
+        self.buffer += data
+        buffer = self.buffer
+        messages = []
+        start = 0
+        while True:
+            sync = buffer.find(SYNC, start)
+            if sync < 0:
+                # Keep a trailing first sync char, it might be completed by the next chunk
+                end = len(buffer) - 1 if buffer.endswith(SYNC[:1]) else len(buffer)
+                end = max(start, end)
+                self.skipped_bytes += end - start
+                start = end
+                break
+            self.skipped_bytes += sync - start
+            start = sync
+            if len(buffer) - start < HEADER_SIZE:
+                break
+            length = buffer[start + 4] | buffer[start + 5] << 8
+            if length > MAX_PAYLOAD:
+                self.skipped_bytes += 1
+                start += 1
+                continue
+            end = start + HEADER_SIZE + length + 2
+            if len(buffer) < end:
+                break
+            frame = memoryview(buffer)[start + 2:end - 2]
+            if checksum(frame) != buffer[end - 2:end]:
+                frame.release()
+                self.bad_checksums += 1
+                self.skipped_bytes += 1
+                start += 1
+                continue
+            messages.append((buffer[start + 2], buffer[start + 3],
+                             bytes(buffer[start + HEADER_SIZE:end - 2])))
+            frame.release()
+            self.messages += 1
+            start = end
+        del buffer[:start]
+        return messages
+
+    def stats(self):
+        return {'messages':      self.messages,
+                'skipped_bytes': self.skipped_bytes,
+                'bad_checksums': self.bad_checksums,
+                }
+
+
+def parse_nav_pvt(payload):
+    """Decode a NAV-PVT payload.
+
+    Returns the timestamp (ISO 8601, None if the UTC time is not valid),
+    latitude and longitude (in decimal degrees), ground speed (in km/h),
+    heading of motion (in degrees), fix type, fix OK flag, number of
+    satellites used, horizontal accuracy (in m) and speed accuracy (in km/h).
+    """
+    if len(payload) != _nav_pvt.size:
+        raise UBXError(f'NAV-PVT: invalid payload length {len(payload)}.')
+    (_, year, month, day, hour, minute, second, valid, _, _,
+     fix_type, flags, _, satellites, lon, lat, _, _, h_acc, _,
+     _, _, _, g_speed, heading, s_acc, _, _, _, _, _, _) = _nav_pvt.unpack(payload)
+    if valid & 0x03 == 0x03:
+        timestamp = f'{year:04}-{month:02}-{day:02}T{hour:02}:{minute:02}:{second:02}Z'
+    else:
+        timestamp = None
+    return PVT(timestamp,
+               round(lat * 1e-7, 6),
+               round(lon * 1e-7, 6),
+               g_speed * 0.0036,
+               heading * 1e-5,
+               fix_type,
+               bool(flags & 0x01),
+               satellites,
+               h_acc / 1000,
+               s_acc * 0.0036)
+
+
+def iter_messages(file, chunk_size=4096):
+    """Yield the (class, id, payload) messages of a binary file object,
+    eg. a UBX capture of the receiver output."""
+    framer = Framer()
+    while True:
+        data = file.read(chunk_size)
+        if not data:
+            break
+        yield from framer.feed(data)
+
+
+def read_nav_pvt(path):
+    """Yield the decoded NAV-PVT messages of a captured UBX file."""
+    with open(path, 'rb') as file:
+        for msg_class, msg_id, payload in iter_messages(file):
+            if (msg_class, msg_id) == NAV_PVT:
+                yield parse_nav_pvt(payload)